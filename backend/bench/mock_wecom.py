@@ -0,0 +1,273 @@
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from core.rate_limiter import TokenBucket
+
+ENDPOINTS = ("gettoken", "media/upload", "message/send")
+ERRCODE_RATE_LIMITED = 45009
+ERRCODE_TOKEN_EXPIRED = 42001
+ERRCODE_INVALID_PARAMETER = 40058
+ERRCODE_INVALID_USER_LIST = 40031
+ERRCODE_ALL_RECIPIENTS_INVALID = 81013
+MAX_USERS = 1000
+MAX_PARTIES = 100
+READ_CHUNK = 256 * 1024
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs when a benchmark opens many connections at once
+    request_queue_size = 256
+
+
+class MockWeComServer:
+    """
+    Local stand-in for the three WeCom endpoints the backend calls:
+    /cgi-bin/gettoken, /cgi-bin/media/upload and /cgi-bin/message/send.
+
+    Per endpoint it can add latency, fail a fraction of calls with given
+    errcodes and enforce a requests-per-second limit (answering 45009, like
+    WeCom does). Issued tokens expire after `token_ttl` seconds and are then
+    answered with 42001. Counters of everything it saw are in stats().
+    Upload bodies are read in full and discarded, so uploads cost what they
+    would on the wire.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, token_ttl: int = 7200):
+        self.token_ttl = token_ttl
+        self._latency: Dict[str, Tuple[float, float]] = {}
+        self._errors: Dict[str, Tuple[float, List[int]]] = {}
+        self._limits: Dict[str, TokenBucket] = {}
+        self._tokens: Dict[str, float] = {}
+        self._invalid_users: Set[str] = set()
+        self._invalid_parties: Set[str] = set()
+        self._reject_invalid = False
+        self._stats: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/cgi-bin"
+
+    # --- behaviour ---
+
+    def set_latency(self, endpoint: str, seconds: float, jitter: float = 0.0):
+        """Delay every answer on endpoint by seconds ± jitter."""
+        self._latency[endpoint] = (seconds, jitter)
+
+    def set_errors(self, endpoint: str, rate: float, errcodes: Optional[List[int]] = None):
+        """Answer a `rate` fraction of calls on endpoint with one of errcodes (default -1, system busy)."""
+        self._errors[endpoint] = (rate, list(errcodes or [-1]))
+
+    def set_rate_limit(self, endpoint: str, per_second: float, burst: Optional[float] = None):
+        self._limits[endpoint] = TokenBucket(per_second, burst or per_second)
+
+    def set_invalid_recipients(self, users=(), parties=(), reject: bool = False):
+        """
+        IDs message/send treats as unknown. By default they are skipped and
+        listed in invaliduser/invalidparty; with reject=True a call naming
+        any of them fails as a whole (40031), still listing them.
+        """
+        self._invalid_users = set(users)
+        self._invalid_parties = set(parties)
+        self._reject_invalid = reject
+
+    def revoke_tokens(self):
+        """Expire every issued token, as if WeCom had rotated them early."""
+        with self._lock:
+            self._tokens.clear()
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._errors.clear()
+            self._limits.clear()
+            self._stats.clear()
+        self.set_invalid_recipients()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    # --- request handling ---
+
+    def _answer(self, endpoint: str, token: Optional[str], body: bytes, body_bytes: int) -> Dict:
+        self._count(f"{endpoint}.calls")
+        if body_bytes:
+            self._count(f"{endpoint}.bytes", body_bytes)
+        latency, jitter = self._latency.get(endpoint, (0.0, 0.0))
+        if latency or jitter:
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+        bucket = self._limits.get(endpoint)
+        if bucket is not None and not bucket.try_acquire():
+            return self._error(endpoint, ERRCODE_RATE_LIMITED)
+        rate, errcodes = self._errors.get(endpoint, (0.0, []))
+        if rate and random.random() < rate:
+            return self._error(endpoint, random.choice(errcodes))
+
+        if endpoint == "gettoken":
+            token = uuid.uuid4().hex
+            with self._lock:
+                self._tokens[token] = time.time() + self.token_ttl
+            return {"errcode": 0, "errmsg": "ok", "access_token": token, "expires_in": self.token_ttl}
+
+        with self._lock:
+            expires_at = self._tokens.get(token or "")
+        if expires_at is None or expires_at < time.time():
+            return self._error(endpoint, ERRCODE_TOKEN_EXPIRED)
+        if endpoint == "media/upload":
+            return {"errcode": 0, "errmsg": "ok", "type": "file", "media_id": uuid.uuid4().hex,
+                    "created_at": str(int(time.time()))}
+        return self._send(body)
+
+    def _send(self, body: bytes) -> Dict:
+        try:
+            message: Dict[str, Any] = json.loads(body or b"{}")
+        except ValueError:
+            return self._error("message/send", ERRCODE_INVALID_PARAMETER)
+        users = [u for u in (message.get("touser") or "").split("|") if u]
+        parties = [p for p in (message.get("toparty") or "").split("|") if p]
+        if len(users) > MAX_USERS or len(parties) > MAX_PARTIES:
+            return self._error("message/send", ERRCODE_INVALID_PARAMETER)
+        bad_users = [u for u in users if u in self._invalid_users]
+        bad_parties = [p for p in parties if p in self._invalid_parties]
+        answer = {"errcode": 0, "errmsg": "ok", "invaliduser": "|".join(bad_users),
+                  "invalidparty": "|".join(bad_parties), "invalidtag": ""}
+        if (bad_users or bad_parties) and (self._reject_invalid or
+                                           len(bad_users) + len(bad_parties) == len(users) + len(parties)):
+            errcode = ERRCODE_INVALID_USER_LIST if self._reject_invalid else ERRCODE_ALL_RECIPIENTS_INVALID
+            self._count(f"message/send.errcode.{errcode}")
+            return {**answer, "errcode": errcode, "errmsg": "mock error"}
+        self._count("message/send.recipients", len(users) - len(bad_users) if users != ["@all"] else 1)
+        return answer
+
+    def _error(self, endpoint: str, errcode: int) -> Dict:
+        self._count(f"{endpoint}.errcode.{errcode}")
+        return {"errcode": errcode, "errmsg": "mock error"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; don't let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch(b"", 0)
+
+            def do_POST(self):
+                if self.path.split("?", 1)[0].endswith("/message/send"):
+                    body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                    self._dispatch(body, len(body))
+                else:
+                    self._dispatch(b"", self._drain_body())
+
+            def _drain_body(self) -> int:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    total = 0
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return total
+                        total += self._discard(size)
+                        self.rfile.readline()
+                return self._discard(int(self.headers.get("Content-Length") or 0))
+
+            def _discard(self, size: int) -> int:
+                remaining = size
+                while remaining:
+                    data = self.rfile.read(min(READ_CHUNK, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                return size - remaining
+
+            def _dispatch(self, body: bytes, body_bytes: int):
+                url = urlparse(self.path)
+                endpoint = url.path.split("/cgi-bin/", 1)[-1]
+                if endpoint not in ENDPOINTS:
+                    self.send_error(404)
+                    return
+                token = parse_qs(url.query).get("access_token", [None])[0]
+                payload = json.dumps(server._answer(endpoint, token, body, body_bytes)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    # --- lifecycle ---
+
+    def start(self) -> "MockWeComServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-wecom", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockWeComServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the WeCom API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9010)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upload/send calls that fail")
+    parser.add_argument("--errcodes", default="-1", help="comma-separated errcodes to fail with")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests/s per endpoint (0 = unlimited)")
+    parser.add_argument("--token-ttl", type=int, default=7200)
+    args = parser.parse_args()
+
+    server = MockWeComServer(args.host, args.port, token_ttl=args.token_ttl)
+    errcodes = [int(code) for code in args.errcodes.split(",") if code.strip()]
+    for endpoint in ENDPOINTS:
+        server.set_latency(endpoint, args.latency)
+        if args.rate_limit:
+            server.set_rate_limit(endpoint, args.rate_limit)
+    for endpoint in ("media/upload", "message/send"):
+        if args.error_rate:
+            server.set_errors(endpoint, args.error_rate, errcodes)
+    print(f"Mock WeCom API at {server.base_url} (set WeComClient.BASE_URL to this)")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+"""
+Benchmarks for the delivery hot paths, run against MockWeComServer.
+
+    cd backend
+    python -m bench.run                                  # all suites, JSON to stdout
+    python -m bench.run --suite scan --scan-files 10000,1000000
+    python -m bench.run --suite startup                  # cold start and import-time breakdown
+    python -m bench.run --output current.json --compare baseline.json
+
+Each result is {"suite", "name", "params", "metrics"}. Metric names end in
+_per_sec (higher is better), _seconds or _bytes (lower is better); other
+metrics are informational. --compare exits with status 1 when a metric is
+worse than the baseline by more than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from bench.mock_wecom import MockWeComServer
+import core.async_wecom_client as async_wecom_client
+from core.async_wecom_client import AsyncWeComClient, run_async
+from core.delivery_ledger import DeliveryLedger
+from core.file_scanner import DirectoryIndex, TreeScanner
+from core.media_cache import MediaCache
+from core.pipeline import DeliveryPipeline
+from core.rate_limiter import RateLimiter
+from core.token_cache import TokenCache
+from core.wecom_client import WeComClient
+
+SUITES = ("scan", "upload", "send", "fanout", "token", "memory", "pipeline", "startup")
+CORPID = "bench-corp"
+SECRET = "bench-secret"
+
+# Client-side limits high enough that the mock, not the limiter, sets the pace
+UNLIMITED = (1e6, 1e6)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Imported on first use only; any of them showing up after `import main` is a cold-start regression
+DEFERRED_MODULES = ("httpx", "requests", "wechatpy")
+# Run in a fresh interpreter: import main, then go through the app lifespan (startup and shutdown)
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+loaded = [m for m in %r if m in sys.modules]
+
+async def serve():
+    async with main.lifespan(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(serve())
+print(json.dumps({"import": imported - started, "lifespan": ready - imported, "loaded": loaded}))
+""" % (DEFERRED_MODULES,)
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _import_times(stderr: str) -> Dict[str, float]:
+    """Self time in seconds per top-level package, from `python -X importtime` output."""
+    totals: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        package = fields[2].strip().split(".")[0]
+        totals[package] = totals.get(package, 0.0) + int(fields[0]) / 1e6
+    return totals
+
+
+def _result(suite: str, name: str, params: Dict[str, Any], **metrics) -> Dict[str, Any]:
+    return {"suite": suite, "name": name, "params": params,
+            "metrics": {k: round(v, 6) if isinstance(v, float) else v for k, v in metrics.items()}}
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace, workdir: str, server: MockWeComServer):
+        self.args = args
+        self.workdir = workdir
+        self.server = server
+        self.db_path = os.path.join(workdir, "bench.db")
+        self.token_cache = TokenCache(self.db_path)
+        self.media_cache = MediaCache(self.db_path)
+        self.rate_limiter = RateLimiter({endpoint: UNLIMITED for endpoint in ("gettoken", "media/upload",
+                                                                                "message/send")}, UNLIMITED)
+
+    def sync_client(self, token_cache: Optional[TokenCache] = None) -> WeComClient:
+        return WeComClient(CORPID, SECRET, "1", token_cache=token_cache or self.token_cache,
+                           media_cache=self.media_cache, rate_limiter=self.rate_limiter)
+
+    def async_client(self, token_cache: Optional[TokenCache] = None) -> AsyncWeComClient:
+        return AsyncWeComClient(CORPID, SECRET, "1", token_cache=token_cache or self.token_cache,
+                                media_cache=self.media_cache, rate_limiter=self.rate_limiter)
+
+    def make_file(self, name: str, size: int) -> str:
+        path = os.path.join(self.workdir, name)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as f:
+                remaining = size
+                while remaining:
+                    block = os.urandom(min(remaining, 1024 * 1024))
+                    f.write(block)
+                    remaining -= len(block)
+        return path
+
+    def mock_latency(self):
+        self.server.reset()
+        for endpoint in ("gettoken", "media/upload", "message/send"):
+            self.server.set_latency(endpoint, self.args.latency)
+
+    # --- runners ---
+
+    def run_threads(self, calls: int, concurrency: int, call: Callable[[], Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: call(), range(calls)))
+        elapsed = time.perf_counter() - started
+        return {"elapsed_seconds": elapsed, "ok": sum(1 for r in results if r)}
+
+    def run_tasks(self, calls: int, concurrency: int, make_call: Callable[[AsyncWeComClient], Any]) -> Dict[str, Any]:
+        # The client bounds in-flight calls per loop by MAX_CONCURRENCY, read when the loop's pool is created
+        async_wecom_client.MAX_CONCURRENCY = concurrency
+        client = self.async_client()
+
+        async def runner():
+            return await asyncio.gather(*(make_call(client) for _ in range(calls)))
+
+        started = time.perf_counter()
+        results = run_async(runner())
+        elapsed = time.perf_counter() - started
+        return {"elapsed_seconds": elapsed, "ok": sum(1 for r in results if r)}
+
+    # --- suites ---
+
+    def scan(self) -> List[Dict[str, Any]]:
+        results = []
+        for count in _ints(self.args.scan_files):
+            folder = os.path.join(self.workdir, f"scan-{count}")
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+                for i in range(count):
+                    open(os.path.join(folder, f"report-{i:07d}.xlsx"), "wb").close()
+            params = {"files": count}
+
+            index = DirectoryIndex(folder)
+            started = time.perf_counter()
+            index.refresh(force=True)
+            cold = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for _ in range(100):
+                index.refresh()
+            unchanged = (time.perf_counter() - started) / 100
+
+            pattern_index = DirectoryIndex(folder, "*-00000*.xlsx")
+            started = time.perf_counter()
+            pattern_index.refresh(force=True)
+            filtered = time.perf_counter() - started
+
+            started = time.perf_counter()
+            index.files_since(0)
+            since = time.perf_counter() - started
+
+            results.append(_result("scan", "full_rescan", params, elapsed_seconds=cold,
+                                   files_per_sec=count / cold if cold else 0.0))
+            results.append(_result("scan", "unchanged_check", params, elapsed_seconds=unchanged))
+            results.append(_result("scan", "pattern_rescan", params, elapsed_seconds=filtered,
+                                   files_per_sec=count / filtered if filtered else 0.0))
+            results.append(_result("scan", "files_since", params, elapsed_seconds=since))
+
+            # The same number of files spread over dated subfolders, as a recursive route sees them
+            tree = os.path.join(self.workdir, f"tree-{count}")
+            if not os.path.isdir(tree):
+                for i in range(count):
+                    folder = os.path.join(tree, f"{2000 + i // 36500}", f"{i // 3000 % 12 + 1:02d}",
+                                          f"{i // 100 % 30 + 1:02d}")
+                    if i % 100 == 0:
+                        os.makedirs(folder, exist_ok=True)
+                    open(os.path.join(folder, f"report-{i:07d}.xlsx"), "wb").close()
+            for workers in _ints(self.args.scan_workers):
+                scanner = TreeScanner(tree, include=["*.xlsx"], workers=workers)
+                started = time.perf_counter()
+                found = sum(1 for _ in scanner.walk())
+                elapsed = time.perf_counter() - started
+                results.append(_result("scan", "tree_walk", {**params, "workers": workers},
+                                       elapsed_seconds=elapsed, files_per_sec=found / elapsed, found=found))
+        return results
+
+    def upload(self) -> List[Dict[str, Any]]:
+        results = []
+        path = self.make_file("upload.bin", self.args.upload_size)
+        calls = self.args.calls
+        for concurrency in _ints(self.args.concurrency):
+            params = {"concurrency": concurrency, "calls": calls, "size": self.args.upload_size,
+                      "latency": self.args.latency}
+            self.mock_latency()
+            client = self.sync_client()
+            run = self.run_threads(calls, concurrency, lambda: client.upload_media(path, use_cache=False))
+            results.append(_result("upload", "sync", params, uploads_per_sec=calls / run["elapsed_seconds"],
+                                   bytes_per_sec=calls * self.args.upload_size / run["elapsed_seconds"], **run))
+
+            self.mock_latency()
+            run = self.run_tasks(calls, concurrency, lambda c: c.upload_media(path, use_cache=False))
+            results.append(_result("upload", "async", params, uploads_per_sec=calls / run["elapsed_seconds"],
+                                   bytes_per_sec=calls * self.args.upload_size / run["elapsed_seconds"], **run))
+        return results
+
+    def send(self) -> List[Dict[str, Any]]:
+        results = []
+        calls = self.args.calls
+        for concurrency in _ints(self.args.concurrency):
+            params = {"concurrency": concurrency, "calls": calls, "latency": self.args.latency}
+            self.mock_latency()
+            client = self.sync_client()
+            run = self.run_threads(calls, concurrency, lambda: client.send_file_message("bench-media", "bench"))
+            results.append(_result("send", "sync", params, sends_per_sec=calls / run["elapsed_seconds"], **run))
+
+            self.mock_latency()
+            run = self.run_tasks(calls, concurrency, lambda c: c.send_file_message("bench-media", "bench"))
+            results.append(_result("send", "async", params, sends_per_sec=calls / run["elapsed_seconds"], **run))
+
+            # WeCom pushing back: a server-side rate limit plus occasional "system busy"
+            self.mock_latency()
+            self.server.set_rate_limit("message/send", self.args.mock_rate_limit)
+            self.server.set_errors("message/send", self.args.error_rate, [-1])
+            run = self.run_tasks(calls, concurrency, lambda c: c.send_file_message("bench-media", "bench"))
+            stats = self.server.stats()
+            results.append(_result("send", "async_throttled",
+                                   {**params, "mock_rate_limit": self.args.mock_rate_limit,
+                                    "error_rate": self.args.error_rate},
+                                   sends_per_sec=calls / run["elapsed_seconds"], **run,
+                                   attempts=stats.get("message/send.calls", 0),
+                                   throttled=stats.get("message/send.errcode.45009", 0)))
+        return results
+
+    def fanout(self) -> List[Dict[str, Any]]:
+        """One file to a large org, with some unknown user IDs mixed into the list."""
+        results = []
+        users = [f"user{i:05d}" for i in range(self.args.fanout_users)]
+        parties = [str(i) for i in range(1, self.args.fanout_parties + 1)]
+        invalid = users[::int(1 / self.args.fanout_invalid)] if self.args.fanout_invalid else []
+        for reject in (False, True):
+            for name, send in (
+                ("sync", lambda: self.sync_client().send_file_fanout("bench-media", "|".join(users),
+                                                                     "|".join(parties))),
+                ("async", lambda: run_async(self.async_client().send_file_fanout("bench-media", "|".join(users),
+                                                                                 "|".join(parties)))),
+            ):
+                self.mock_latency()
+                self.server.set_invalid_recipients(invalid, reject=reject)
+                started = time.perf_counter()
+                result = send()
+                elapsed = time.perf_counter() - started
+                stats = self.server.stats()
+                results.append(_result(
+                    "fanout", f"{name}_reject" if reject else name,
+                    {"users": len(users), "parties": len(parties), "invalid_users": len(invalid),
+                     "latency": self.args.latency},
+                    elapsed_seconds=elapsed, ok=result.ok, chunks=result.chunks,
+                    failed_chunks=result.failed_chunks, invalid_reported=len(result.invalid_users),
+                    calls=stats.get("message/send.calls", 0),
+                    recipients_delivered=stats.get("message/send.recipients", 0),
+                ))
+        return results
+
+    def token(self) -> List[Dict[str, Any]]:
+        """
+        Sends for a while against tokens that expire every few seconds, then
+        again with all tokens revoked halfway through. Good behaviour is a
+        gettoken call per expiry (not per send) and no failed sends.
+        """
+        results = []
+        ttl = self.args.token_ttl
+        duration = self.args.token_duration
+        concurrency = 4
+        for scenario in ("expiry", "revoked"):
+            self.mock_latency()
+            self.server.token_ttl = ttl
+            # Fresh cache with margins scaled down to the short TTL
+            cache = TokenCache(os.path.join(self.workdir, f"token-{scenario}.db"))
+            cache.EXPIRY_MARGIN = ttl * 0.2
+            cache.PROACTIVE_WINDOW = ttl * 0.2
+            client = self.sync_client(cache)
+            deadline = time.monotonic() + duration
+            revoke_at = time.monotonic() + duration / 2 if scenario == "revoked" else None
+
+            def worker():
+                nonlocal revoke_at
+                sent = failed = 0
+                while time.monotonic() < deadline:
+                    if revoke_at and time.monotonic() >= revoke_at:
+                        revoke_at = None
+                        self.server.revoke_tokens()
+                    if client.send_file_message("bench-media", "bench"):
+                        sent += 1
+                    else:
+                        failed += 1
+                return sent, failed
+
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(lambda _: worker(), range(concurrency)))
+            stats = self.server.stats()
+            results.append(_result(
+                "token", scenario, {"token_ttl": ttl, "duration": duration, "concurrency": concurrency},
+                sends=sum(s for s, _ in outcomes), failed_sends=sum(f for _, f in outcomes),
+                gettoken_calls=stats.get("gettoken.calls", 0),
+                expected_gettoken_calls=int(duration // max(1.0, ttl - 2 * ttl * 0.2)) + 1,
+                rejected_tokens=stats.get("message/send.errcode.42001", 0),
+            ))
+        self.server.token_ttl = 7200
+        return results
+
+    def memory(self) -> List[Dict[str, Any]]:
+        """Python heap peak while uploading one file; streaming keeps it flat as files grow."""
+        results = []
+        self.mock_latency()
+        for size_mb in _ints(self.args.memory_sizes):
+            size = size_mb * 1024 * 1024
+            path = self.make_file(f"memory-{size_mb}.bin", size)
+            params = {"size": size}
+            for name, upload in (
+                ("sync", lambda: self.sync_client().upload_media(path, use_cache=False)),
+                ("async", lambda: run_async(self.async_client().upload_media(path, use_cache=False))),
+            ):
+                upload()  # warm up connections and imports
+                tracemalloc.start()
+                try:
+                    ok = bool(upload())
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                results.append(_result("memory", name, params, peak_bytes=peak,
+                                       peak_ratio=peak / size, ok=ok))
+        return results
+
+    def startup(self) -> List[Dict[str, Any]]:
+        """Cold start of the backend in fresh interpreters: process start, `import main` and the app lifespan."""
+        runs = self.args.startup_runs
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")]))}
+        totals, imports, lifespans, loaded = [], [], [], set()
+        packages: Dict[str, float] = {}
+        for i in range(runs):
+            # A new directory per run: no config.json or state.db yet, as on a first boot
+            cwd = os.path.join(self.workdir, f"startup-{i}")
+            shutil.rmtree(cwd, ignore_errors=True)
+            os.makedirs(cwd)
+            started = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT], cwd=cwd, env=env,
+                                  capture_output=True, text=True, timeout=120)
+            totals.append(time.perf_counter() - started)
+            if proc.returncode != 0:
+                raise RuntimeError(f"Backend failed to start: {proc.stderr[-2000:]}")
+            timings = json.loads(proc.stdout.strip().splitlines()[-1])
+            imports.append(timings["import"])
+            lifespans.append(timings["lifespan"])
+            loaded.update(timings["loaded"])
+            for package, seconds in _import_times(proc.stderr).items():
+                packages[package] = packages.get(package, 0.0) + seconds / runs
+
+        top = sorted(packages.items(), key=lambda item: -item[1])[:self.args.startup_top]
+        return [
+            _result("startup", "cold_start", {"runs": runs},
+                    process_seconds=statistics.median(totals), import_seconds=statistics.median(imports),
+                    lifespan_seconds=statistics.median(lifespans), deferred_loaded=sorted(loaded)),
+            # Informational: per-package self time, to see which import a regression came from
+            _result("startup", "import_breakdown", {"runs": runs, "top": self.args.startup_top},
+                    packages={package: round(seconds, 6) for package, seconds in top},
+                    total=round(sum(packages.values()), 6)),
+        ]
+
+    def pipeline(self) -> List[Dict[str, Any]]:
+        """Upload, send and ledger bookkeeping per file: what a delivery job does for each pending file."""
+        results = []
+        calls = self.args.calls
+        folder = os.path.join(self.workdir, "pipeline")
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        files = []
+        for i in range(calls):
+            path = os.path.join(folder, f"file-{i:05d}.txt")
+            with open(path, "wb") as f:
+                f.write(os.urandom(self.args.upload_size))
+            files.append(path)
+        route = {
+            "name": "bench", "folder": folder, "file_pattern": "*",
+            "wecom": {"corpid": CORPID, "secret": SECRET, "agentid": "1", "touser": "bench"},
+            "delivery": {"skip_delivered": True}, "schedule": {},
+        }
+        for concurrency in _ints(self.args.concurrency):
+            self.mock_latency()
+            async_wecom_client.MAX_CONCURRENCY = concurrency
+            ledger = DeliveryLedger(os.path.join(self.workdir, f"ledger-{concurrency}.db"))
+            pipeline = DeliveryPipeline(ledger=ledger)
+            started = time.perf_counter()
+            sent = sum(run_async(pipeline.deliver_files_async(route, files)))
+            elapsed = time.perf_counter() - started
+            results.append(_result("pipeline", "deliver_files", {"concurrency": concurrency, "files": calls,
+                                                                 "size": self.args.upload_size,
+                                                                 "latency": self.args.latency},
+                                   elapsed_seconds=elapsed, files_per_sec=calls / elapsed, ok=sent))
+        return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Regression messages for metrics worse than the baseline by more than `threshold` (a fraction)."""
+    def key(result):
+        return result["suite"], result["name"], json.dumps(result["params"], sort_keys=True)
+
+    previous = {key(r): r["metrics"] for r in baseline.get("results", [])}
+    regressions = []
+    for result in current.get("results", []):
+        old = previous.get(key(result))
+        if not old:
+            continue
+        for metric, value in result["metrics"].items():
+            before = old.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+                continue
+            if metric.endswith("_per_sec"):
+                change = (before - value) / before
+            elif metric.endswith("_seconds") or metric.endswith("_bytes"):
+                change = (value - before) / before
+            else:
+                continue
+            if change > threshold:
+                regressions.append(f"{result['suite']}/{result['name']} {result['params']}: "
+                                   f"{metric} {before} -> {value} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark scanning, uploads, sends and token refresh")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="suite to run (repeatable; default all)")
+    parser.add_argument("--scan-files", default="10000,100000", help="comma-separated directory sizes")
+    parser.add_argument("--scan-workers", default="1,8", help="comma-separated thread counts for tree walks")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="comma-separated concurrency levels")
+    parser.add_argument("--calls", type=int, default=200, help="uploads/sends per concurrency level")
+    parser.add_argument("--upload-size", type=int, default=64 * 1024, help="bytes per uploaded file")
+    parser.add_argument("--memory-sizes", default="1,5,20", help="comma-separated upload sizes in MB")
+    parser.add_argument("--latency", type=float, default=0.01, help="mock server latency per call (s)")
+    parser.add_argument("--mock-rate-limit", type=float, default=100.0,
+                        help="requests/s the mock allows on message/send in the throttled scenario")
+    parser.add_argument("--error-rate", type=float, default=0.05,
+                        help="fraction of sends the mock fails in the throttled scenario")
+    parser.add_argument("--fanout-users", type=int, default=8000, help="recipients in the fanout suite")
+    parser.add_argument("--fanout-parties", type=int, default=150, help="departments in the fanout suite")
+    parser.add_argument("--fanout-invalid", type=float, default=0.01,
+                        help="fraction of fanout users the mock does not know")
+    parser.add_argument("--token-ttl", type=int, default=4, help="token lifetime for the token suite (s)")
+    parser.add_argument("--token-duration", type=float, default=10.0, help="length of each token scenario (s)")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters started by the startup suite")
+    parser.add_argument("--startup-top", type=int, default=15, help="packages listed in the import breakdown")
+    parser.add_argument("--workdir", help="keep synthetic files here (reused between runs)")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (fraction)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR, format="%(levelname)s %(message)s")
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="wecom-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    # Module-level caches (media, ledger, retry budget) default to ./state.db
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    server = MockWeComServer().start()
+    WeComClient.BASE_URL = AsyncWeComClient.BASE_URL = server.base_url
+    bench = Bench(args, workdir, server)
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "results": [],
+    }
+    try:
+        for suite in args.suite or SUITES:
+            started = time.perf_counter()
+            report["results"].extend(getattr(bench, suite)())
+            print(f"{suite}: {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        server.stop()
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import weakref
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+
+from core.metrics import API_ERRORS, SEND_DURATION, UPLOAD_BYTES, UPLOAD_DURATION, route_label
+from core.http_session import DEFAULT_TIMEOUT, UPLOAD_TIMEOUT, POOL_MAXSIZE
+from core.media_cache import MediaCache
+from core.token_cache import TokenCache
+from core.wecom_client import WeComClient, ERRCODE_INVALID_MEDIA_ID
+from core.fanout import FanoutResult, chunk_recipients, invalid_ids, split_ids
+from core.multipart import MultipartFileEncoder, ProgressCallback, check_media_file
+from core.rate_limiter import RateLimiter
+from core.retry_policy import RetryPolicy, classify_errcode, OK, RETRYABLE, TOKEN_EXPIRED
+
+# httpx logs every request URL at INFO, which would leak access tokens into app.log
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Upper bound on uploads/sends in flight per event loop
+MAX_CONCURRENCY = 8
+
+# One pooled AsyncClient and semaphore per event loop: both are bound to the
+# loop that created them, and the scheduler thread runs its own loop.
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Semaphore]]" = \
+    weakref.WeakKeyDictionary()
+
+# httpx (with httpcore and anyio) is the largest import of the backend, so it
+# is loaded with the first client instead of at startup.
+
+
+def _httpx_timeout(timeout: Tuple[int, int]) -> "httpx.Timeout":
+    import httpx
+
+    connect, read = timeout
+    return httpx.Timeout(read, connect=connect)
+
+
+def _loop_resources() -> Tuple["httpx.AsyncClient", asyncio.Semaphore]:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None or state[0].is_closed:
+        import httpx
+
+        client = httpx.AsyncClient(
+            timeout=_httpx_timeout(DEFAULT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+            transport=httpx.AsyncHTTPTransport(retries=2),
+        )
+        state = (client, asyncio.Semaphore(MAX_CONCURRENCY))
+        _loop_state[loop] = state
+    return state
+
+
+def get_async_http_client() -> "httpx.AsyncClient":
+    """Pooled keep-alive AsyncClient for the running event loop."""
+    return _loop_resources()[0]
+
+
+async def close_async_http_client():
+    state = _loop_state.pop(asyncio.get_running_loop(), None)
+    if state:
+        await state[0].aclose()
+
+
+def run_async(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine from a worker thread on a fresh loop, closing that loop's HTTP client afterwards."""
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_async_http_client()
+    return asyncio.run(runner())
+
+
+class AsyncWeComClient:
+    """
+    asyncio counterpart of WeComClient with the same surface.
+
+    Uploads and sends share the loop's pooled AsyncClient and are bounded
+    by the loop's semaphore, so callers can gather() many of them at once.
+    Token refreshes are rare and must stay single-flight across processes,
+    so they go through the blocking TokenCache path on a worker thread.
+    """
+
+    BASE_URL = WeComClient.BASE_URL
+
+    def __init__(self, corpid: str, secret: str, agentid: str, token_cache: Optional[TokenCache] = None,
+                 media_cache: Optional[MediaCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self._sync = WeComClient(corpid, secret, agentid, token_cache=token_cache, media_cache=media_cache,
+                                 rate_limiter=rate_limiter, retry_policy=retry_policy)
+        self.corpid = corpid
+        self.secret = secret
+        self.agentid = agentid
+        self.token_cache = self._sync.token_cache
+        self.media_cache = self._sync.media_cache
+        self.rate_limiter = self._sync.rate_limiter
+
+    async def get_access_token(self) -> Optional[str]:
+        token = self.token_cache.peek(self.corpid, self.secret)
+        if token:
+            return token
+        return await asyncio.to_thread(self._sync._get_access_token)
+
+    def _cached_media(self, file_path: str) -> Tuple[Optional[str], Optional[str]]:
+        """(digest, cached media_id) - blocking, run off the loop."""
+        digest = self.media_cache.file_digest(file_path)
+        return digest, self.media_cache.get(self.corpid, digest, os.path.basename(file_path))
+
+    async def _request(self, endpoint: str, do_request: Callable[["httpx.AsyncClient", str], Awaitable["httpx.Response"]],
+                       retry_network_errors: bool = True) -> Optional[Dict[str, Any]]:
+        """Async counterpart of WeComClient._request: rate limiting, token refresh and backoff."""
+        import httpx
+
+        policy = self._sync.retry_policy
+        attempt = 0
+        token_refreshed = False
+        policy.budget.record_request()
+        client, semaphore = _loop_resources()
+        while True:
+            attempt += 1
+            token = await self.get_access_token()
+            if not token:
+                return None
+
+            await self.rate_limiter.acquire_async(self.corpid, endpoint)
+            try:
+                async with semaphore:
+                    response = await do_request(client, token)
+                data = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                API_ERRORS.labels(route=route_label(), endpoint=endpoint, errcode="network").inc()
+                if retry_network_errors and policy.should_retry(attempt):
+                    logging.warning(f"{endpoint} request failed ({e}), retrying")
+                    await asyncio.sleep(policy.backoff(attempt))
+                    continue
+                logging.error(f"Error calling {endpoint}: {e}")
+                return None
+
+            kind = classify_errcode(data.get("errcode"))
+            if kind == OK:
+                return data
+            API_ERRORS.labels(route=route_label(), endpoint=endpoint, errcode=str(data.get("errcode"))).inc()
+            if kind == TOKEN_EXPIRED and not token_refreshed:
+                logging.warning(f"{endpoint}: access token rejected ({data.get('errcode')}), refreshing",
+                                extra={"errcode": data.get("errcode")})
+                await asyncio.to_thread(self.token_cache.invalidate, self.corpid, self.secret, token)
+                token_refreshed = True
+                continue
+            if kind == RETRYABLE and policy.should_retry(attempt):
+                delay = policy.backoff(attempt)
+                logging.warning(f"{endpoint} throttled ({data.get('errcode')}), retrying in {delay:.1f}s",
+                                extra={"errcode": data.get("errcode")})
+                await asyncio.sleep(delay)
+                continue
+            return data
+
+    async def upload_media(self, file_path: str, use_cache: bool = True,
+                           progress: Optional[ProgressCallback] = None) -> Optional[str]:
+        """
+        Upload file and return media_id. Identical content uploaded within the last 3 days is reused.
+        The body is streamed from disk; progress(bytes_sent, total) is called as chunks go out.
+        """
+        if not os.path.exists(file_path):
+            logging.error(f"File not found: {file_path}")
+            return None
+
+        # Fail fast before any bytes are sent
+        error = check_media_file(file_path)
+        if error:
+            logging.error(f"Cannot upload {os.path.basename(file_path)}: {error}")
+            return None
+
+        digest = None
+        filename = os.path.basename(file_path)
+        if use_cache:
+            try:
+                digest, media_id = await asyncio.to_thread(self._cached_media, file_path)
+                if media_id:
+                    logging.info(f"Reusing cached media_id for {filename}")
+                    return media_id
+            except Exception as e:
+                logging.warning(f"Media cache unavailable: {e}")
+                digest = None
+
+        url = f"{self.BASE_URL}/media/upload"
+
+        async def do_upload(client: "httpx.AsyncClient", token: str) -> "httpx.Response":
+            params = {
+                "access_token": token,
+                "type": "file"
+            }
+            body = MultipartFileEncoder(file_path, filename=filename, progress=progress)
+            return await client.post(url, params=params, content=body.aiter_chunks(), headers=body.headers,
+                                     timeout=_httpx_timeout(UPLOAD_TIMEOUT))
+
+        try:
+            with UPLOAD_DURATION.labels(route=route_label()).time():
+                data = await self._request("media/upload", do_upload)
+        except OSError as e:
+            logging.error(f"Error uploading media: {e}")
+            return None
+        if data is None:
+            return None
+        if data.get("errcode") == 0:
+            media_id = data.get("media_id")
+            UPLOAD_BYTES.labels(route=route_label()).observe(os.path.getsize(file_path))
+            if digest:
+                await asyncio.to_thread(self.media_cache.put, self.corpid, digest, filename,
+                                        os.path.getsize(file_path), media_id)
+            return media_id
+        else:
+            logging.error(f"Failed to upload media: {data}", extra={"errcode": data.get("errcode")})
+            return None
+
+    async def send_file_message(self, media_id: str, touser: str = "@all", toparty: str = "") -> bool:
+        return (await self.send_file_fanout(media_id, touser, toparty)).ok
+
+    async def send_file_fanout(self, media_id: str, touser: str = "@all", toparty: str = "") -> FanoutResult:
+        """See WeComClient.send_file_fanout; chunks are gathered, bounded by the loop's semaphore."""
+        chunks = chunk_recipients(touser, toparty)
+        result = FanoutResult(len(chunks))
+        await asyncio.gather(*(self._send_chunk(media_id, users, parties, result) for users, parties in chunks))
+        result.log()
+        return result
+
+    async def _send_chunk(self, media_id: str, touser: str, toparty: str, result: FanoutResult):
+        data = await self._send_once(media_id, touser, toparty)
+        retry = result.record(touser, toparty, data, retry_allowed=True)
+        if retry:
+            logging.warning(f"Resending to {len(split_ids(retry[0]))} user(s) / {len(split_ids(retry[1]))} "
+                            f"party(ies) without the invalid IDs", extra={"errcode": data.get("errcode")})
+            result.record(retry[0], retry[1], await self._send_once(media_id, *retry), retry_allowed=False)
+
+    async def _send_once(self, media_id: str, touser: str, toparty: str) -> Optional[Dict[str, Any]]:
+        url = f"{self.BASE_URL}/message/send"
+
+        payload = {
+            "touser": touser,
+            "toparty": toparty,
+            "msgtype": "file",
+            "agentid": self.agentid,
+            "file": {
+                "media_id": media_id
+            },
+            "safe": 0
+        }
+
+        async def do_send(client: "httpx.AsyncClient", token: str) -> "httpx.Response":
+            return await client.post(url, params={"access_token": token}, json=payload)
+
+        # A send that timed out may still have been delivered; don't risk a duplicate
+        with SEND_DURATION.labels(route=route_label()).time():
+            data = await self._request("message/send", do_send, retry_network_errors=False)
+        if data is not None and data.get("errcode") != 0:
+            if data.get("errcode") == ERRCODE_INVALID_MEDIA_ID:
+                await asyncio.to_thread(self.media_cache.invalidate_media, self.corpid, media_id)
+            if not any(invalid_ids(data)):
+                logging.error(f"Failed to send message: {data}", extra={"errcode": data.get("errcode")})
+        return data
@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from wechatpy.enterprise.crypto import WeChatCrypto
+
+# wechatpy (and its crypto backend) is imported by the first callback request,
+# not at startup; most instances never receive one.
+
+logger = logging.getLogger(__name__)
+
+AES_KEY_LENGTH = 43
+MAX_CRYPTO_ENTRIES = 8
+# Events waiting for the worker; beyond this new events are dropped (WeCom is still acknowledged)
+MAX_PENDING_EVENTS = 1000
+
+# handler(message) where message is a parsed wechatpy message or event
+EventHandler = Callable[[Any], None]
+
+
+class CallbackError(Exception):
+    """A callback request that must be rejected; status is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class CallbackService:
+    """
+    WeCom callback handling: URL verification and encrypted message events.
+
+    WeChatCrypto objects (which decode the AES key) are cached per
+    (token, aes_key, corpid), so a request costs one signature check and
+    one AES decryption. Message events are decrypted and queued, and the
+    HTTP handler returns immediately; a single worker thread runs the
+    registered handlers, so slow handlers never push the reply past
+    WeCom's 5 second deadline.
+    """
+
+    def __init__(self, max_crypto: int = MAX_CRYPTO_ENTRIES, max_pending: int = MAX_PENDING_EVENTS):
+        self.max_crypto = max_crypto
+        self._crypto: "OrderedDict[Tuple[str, str, str], WeChatCrypto]" = OrderedDict()
+        self._crypto_lock = threading.Lock()
+        self._events: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._handlers: List[EventHandler] = []
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def get_crypto(self, wecom_conf: Dict[str, Any]) -> "WeChatCrypto":
+        token = wecom_conf.get("token")
+        aes_key = wecom_conf.get("aes_key")
+        corpid = wecom_conf.get("corpid")
+        if not token or not aes_key or not corpid:
+            raise CallbackError("Token, AES Key or CorpID not configured")
+        if len(aes_key) != AES_KEY_LENGTH:
+            raise CallbackError(f"AES Key length is {len(aes_key)}, expected {AES_KEY_LENGTH}")
+
+        key = (token, aes_key, corpid)
+        with self._crypto_lock:
+            crypto = self._crypto.get(key)
+            if crypto is not None:
+                self._crypto.move_to_end(key)
+                return crypto
+        from wechatpy.enterprise.crypto import WeChatCrypto
+
+        crypto = WeChatCrypto(token, aes_key, corpid)
+        with self._crypto_lock:
+            self._crypto[key] = crypto
+            while len(self._crypto) > self.max_crypto:
+                self._crypto.popitem(last=False)
+        return crypto
+
+    def verify_url(self, wecom_conf: Dict[str, Any], msg_signature: str, timestamp: str,
+                   nonce: str, echostr: str) -> str:
+        """Answer WeCom's URL verification (GET). Returns the decrypted echostr."""
+        crypto = self.get_crypto(wecom_conf)
+        try:
+            echo = crypto.check_signature(msg_signature, timestamp, nonce, echostr)
+        except _signature_errors() as e:
+            raise CallbackError(f"Invalid signature: {e}", status=403)
+        except Exception as e:
+            raise CallbackError(f"Cannot decrypt echostr: {e}")
+        if isinstance(echo, bytes):
+            echo = echo.decode("utf-8")
+        logger.debug("Callback URL verified")
+        return echo
+
+    def accept_message(self, wecom_conf: Dict[str, Any], body: bytes, msg_signature: str,
+                       timestamp: str, nonce: str) -> bool:
+        """
+        Verify and decrypt a message event (POST) and queue it for the worker.
+        Returns False if the event was dropped because the queue is full.
+        """
+        crypto = self.get_crypto(wecom_conf)
+        try:
+            xml = crypto.decrypt_message(body, msg_signature, timestamp, nonce)
+        except _signature_errors() as e:
+            raise CallbackError(f"Invalid signature: {e}", status=403)
+        except Exception as e:
+            raise CallbackError(f"Cannot decrypt message: {e}")
+
+        self._ensure_worker()
+        try:
+            self._events.put_nowait(xml)
+        except queue.Full:
+            logger.warning("Callback event queue full, dropping event")
+            return False
+        logger.debug("Callback event queued")
+        return True
+
+    def add_handler(self, handler: EventHandler):
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def _ensure_worker(self):
+        if self._worker and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="wecom-callback", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        from wechatpy.enterprise import parse_message
+
+        while True:
+            xml = self._events.get()
+            if xml is None:
+                return
+            try:
+                message = parse_message(xml)
+            except Exception as e:
+                logger.error(f"Cannot parse callback message: {e}")
+                continue
+            for handler in list(self._handlers):
+                try:
+                    handler(message)
+                except Exception as e:
+                    logger.error(f"Callback handler failed for {getattr(message, 'type', '?')}: {e}")
+
+    def stop(self, timeout: float = 5.0):
+        """Let queued events finish, then stop the worker."""
+        worker = self._worker
+        if not worker or not worker.is_alive():
+            return
+        try:
+            self._events.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        worker.join(timeout)
+
+
+def _signature_errors() -> Tuple[type, ...]:
+    from wechatpy.enterprise.exceptions import InvalidCorpIdException
+    from wechatpy.exceptions import InvalidSignatureException
+    return InvalidSignatureException, InvalidCorpIdException
+
+
+_default_service: Optional[CallbackService] = None
+_default_lock = threading.Lock()
+
+
+def get_callback_service() -> CallbackService:
+    global _default_service
+    if _default_service is None:
+        with _default_lock:
+            if _default_service is None:
+                _default_service = CallbackService()
+    return _default_service
@@ -1,6 +1,12 @@
+import errno
+import hashlib
 import json
+import logging
 import os
-from typing import Dict, Any
+import stat
+import tempfile
+import threading
+from typing import Dict, Any, Optional, Tuple
 
 CONFIG_FILE = "config.json"
 
@@ -16,39 +22,210 @@ DEFAULT_CONFIG = {
     "schedule": {
         "enabled": False,
         "time": "09:00", # HH:MM
-        "frequency": "daily" # daily, hourly
-    }
+        "frequency": "daily", # daily, hourly, cron, watch
+        "cron": "", # Used when frequency is "cron", e.g. "0 9 * * 1-5"
+        "timezone": "", # IANA name such as "Asia/Shanghai"; empty means system time
+        "catch_up": "skip" # Runs missed while stopped: skip, once, all
+    },
+    "delivery": {
+        "skip_delivered": True, # Never re-send a file already delivered to the same recipients
+        "catch_up": False, # Send every undelivered file since the last success, not just the newest
+        "route_workers": 4, # Routes processed in parallel
+        "max_attempts": 3, # Attempts per delivery job before it is marked failed
+        "retry_delay": 30, # Seconds before the first retry; doubles on each further attempt
+        "bundle": False, # Zip several pending files into one message instead of one message each
+        "bundle_min_files": 2, # Only bundle when at least this many files are pending
+        "split_oversize": True, # Zip files over WeCom's 20MB limit and split them into .001, .002 volumes
+        "compression_level": 6, # zlib level 1-9 for bundles and oversize files
+        "packaging_workers": 2 # Processes used to build archives
+    },
+    "scan": {
+        "recursive": False, # Also look in subfolders (e.g. 2026/10/18/report.xlsx)
+        "include": [], # Globs on the file name, or on the path below the folder if they contain "/"; empty = file_pattern
+        "exclude": ["~$*", "*.tmp"], # Skipped files; patterns with "/" also skip whole subfolders
+        "max_depth": None, # Subfolder levels to descend; None = unlimited
+        "max_age_days": None, # Ignore files older than this
+        "workers": 8 # Subfolders listed in parallel
+    },
+    "upload": {
+        "max_bytes": 512 * 1024 * 1024 # Largest file accepted by /api/upload and /api/uploads
+    },
+    "logging": {
+        "level": "INFO",
+        "levels": {}, # Per-module overrides, e.g. {"core.pipeline": "DEBUG"}
+        "console": True # Also write plain-text logs to stderr (docker logs)
+    },
+    "leader": {
+        "lease_seconds": 30, # Another instance takes over scheduling this long after the leader stops renewing
+        "renew_seconds": 10 # How often the leader renews its lease (and followers try to take it)
+    },
+    # Optional list of {name, folder, file_pattern, touser, toparty, wecom, delivery, scan};
+    # empty means a single route built from monitor_folder and wecom
+    "routes": []
 }
 
+
+class FrozenDict(dict):
+    """Read-only dict. Still a dict, so it serializes with json and FastAPI as-is."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("config snapshot is read-only; use ConfigManager.update or save_config")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Deep, mutable copy of a frozen snapshot."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
 class ConfigManager:
+    """
+    config.json access with an in-memory snapshot.
+
+    load_config only re-reads the file when its (mtime, inode, size)
+    changes, and hands out the same immutable snapshot to every caller.
+    save_config writes a temp file, fsyncs it and renames it over the
+    original, so readers never observe a half-written file. If the file
+    on disk becomes unreadable, the last good snapshot keeps being served
+    instead of silently falling back to DEFAULT_CONFIG.
+    """
+
     def __init__(self, config_path: str = CONFIG_FILE):
         self.config_path = config_path
+        self._snapshot: Optional[FrozenDict] = None
+        self._stat_key: Optional[Tuple[int, int, int]] = None
+        self._lock = threading.RLock()
+        # Bumped whenever the snapshot changes; cheap change detection for callers
+        self.version = 0
+        # Hash of the snapshot's content, the same in every process (e.g. for ETags)
+        self.digest = ""
         self._ensure_config_exists()
 
     def _ensure_config_exists(self):
         if not os.path.exists(self.config_path):
             self.save_config(DEFAULT_CONFIG)
 
-    def load_config(self) -> Dict[str, Any]:
+    def _file_key(self) -> Optional[Tuple[int, int, int]]:
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading config: {e}")
-            return DEFAULT_CONFIG
+            st = os.stat(self.config_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _set_snapshot(self, config: Dict[str, Any], stat_key: Optional[Tuple[int, int, int]]):
+        self._snapshot = freeze(config)
+        self._stat_key = stat_key
+        self.version += 1
+        self.digest = hashlib.blake2b(json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8"),
+                                      digest_size=16).hexdigest()
+
+    def load_config(self) -> Dict[str, Any]:
+        """Current config as a read-only snapshot. Use thaw() for a mutable copy."""
+        stat_key = self._file_key()
+        if self._snapshot is not None and stat_key == self._stat_key:
+            return self._snapshot
+
+        with self._lock:
+            if self._snapshot is not None and stat_key == self._stat_key:
+                return self._snapshot
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    self._set_snapshot(json.load(f), stat_key)
+            except Exception as e:
+                logging.error(f"Error loading config: {e}")
+                if self._snapshot is None:
+                    self._set_snapshot(DEFAULT_CONFIG, None)
+                else:
+                    # Keep serving the last good config; remember the bad file so we don't re-parse it
+                    self._stat_key = stat_key
+            return self._snapshot
+
+    def reload(self) -> Dict[str, Any]:
+        """Drop the cached snapshot and re-read the file."""
+        with self._lock:
+            self._stat_key = None
+            self._snapshot = None
+        return self.load_config()
 
     def save_config(self, config: Dict[str, Any]):
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.config_path))
+            data = json.dumps(config, indent=4, ensure_ascii=False)
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix=".config.", suffix=".tmp", dir=directory)
+                self._copy_mode(fd)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                try:
+                    os.replace(tmp_path, self.config_path)
+                    tmp_path = None
+                    self._fsync_dir(directory)
+                except OSError as e:
+                    # A single-file Docker bind mount can't be renamed over (EBUSY/EXDEV);
+                    # fall back to rewriting it in place
+                    if e.errno not in (errno.EBUSY, errno.EXDEV):
+                        raise
+                    with open(self.config_path, 'w', encoding='utf-8') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+            except Exception as e:
+                logging.error(f"Error saving config: {e}")
+                return
+            finally:
+                if tmp_path:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+            self._set_snapshot(config, self._file_key())
+
+    def _copy_mode(self, fd: int):
+        # mkstemp creates 0600; keep the existing file's mode (0644 for a new one) across the rename
+        if not hasattr(os, 'fchmod'):
+            return
         try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+            mode = stat.S_IMODE(os.stat(self.config_path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.fchmod(fd, mode)
+
+    @staticmethod
+    def _fsync_dir(directory: str):
+        # Persist the rename itself; not supported on Windows
+        if os.name != 'posix':
+            return
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def get(self, key: str, default: Any = None) -> Any:
         config = self.load_config()
         return config.get(key, default)
 
     def update(self, key: str, value: Any):
-        config = self.load_config()
-        config[key] = value
-        self.save_config(config)
+        with self._lock:
+            config = thaw(self.load_config())
+            config[key] = value
+            self.save_config(config)
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, tzinfo
+from typing import List, Optional, Set
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+MONTH_NAMES = {name: i + 1 for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+DAY_NAMES = {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+# Give up looking for a match after this many years (e.g. "0 0 30 2 *")
+MAX_SEARCH_YEARS = 5
+
+
+def get_timezone(name: Optional[str]) -> Optional[tzinfo]:
+    """tzinfo for an IANA name such as "Asia/Shanghai"; None (system local time) if empty or unknown."""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def _parse_field(field: str, low: int, high: int, names: Optional[dict] = None) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.lower().split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f"Invalid step in cron field: {field}")
+        if part in ("*", ""):
+            start, end = low, high
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = _parse_value(a, names), _parse_value(b, names)
+        else:
+            start = _parse_value(part, names)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field out of range [{low}-{high}]: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def _parse_value(value: str, names: Optional[dict]) -> int:
+    if names and value in names:
+        return names[value]
+    return int(value)
+
+
+class CronExpression:
+    """
+    Standard 5-field cron expression: minute hour day-of-month month day-of-week.
+
+    Supports *, lists, ranges, steps, month/day names and the @daily style
+    aliases. As in cron, when both day fields are restricted a day matches
+    if either of them does. Day-of-week 7 is accepted as Sunday.
+    """
+
+    def __init__(self, expr: str):
+        self.expr = expr.strip()
+        fields = ALIASES.get(self.expr.lower(), self.expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expr!r}")
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+        weekdays = _parse_field(fields[4], 0, 7, DAY_NAMES)
+        self.weekdays = {d % 7 for d in weekdays}
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    def __repr__(self) -> str:
+        return f"CronExpression({self.expr!r})"
+
+    def _day_matches(self, wall: datetime) -> bool:
+        # datetime.weekday(): Monday=0; cron: Sunday=0
+        dom = wall.day in self.days
+        dow = (wall.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return dow
+        if self._any_weekday:
+            return dom
+        return dom or dow
+
+    def next_wall_time(self, wall: datetime) -> datetime:
+        """First matching naive wall-clock minute strictly after `wall`."""
+        wall = wall.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = wall.year + MAX_SEARCH_YEARS
+        while wall.year <= limit:
+            if wall.month not in self.months:
+                year, month = (wall.year + 1, 1) if wall.month == 12 else (wall.year, wall.month + 1)
+                wall = datetime(year, month, 1)
+                continue
+            if not self._day_matches(wall):
+                wall = datetime(wall.year, wall.month, wall.day) + timedelta(days=1)
+                continue
+            if wall.hour not in self.hours:
+                wall = wall.replace(minute=0) + timedelta(hours=1)
+                continue
+            if wall.minute not in self.minutes:
+                wall += timedelta(minutes=1)
+                continue
+            return wall
+        raise ValueError(f"Cron expression never matches: {self.expr!r}")
+
+    def next_after(self, ts: float, tz: Optional[tzinfo] = None) -> float:
+        """
+        Timestamp of the first occurrence strictly after `ts`, evaluated in
+        `tz` (system local time if None). A wall time skipped by a DST jump
+        fires at the shifted instant; a repeated one fires once.
+        """
+        wall = self._to_wall(ts, tz)
+        while True:
+            wall = self.next_wall_time(wall)
+            candidate = self._to_timestamp(wall, tz)
+            if candidate > ts:
+                return candidate
+
+    def occurrences(self, start_ts: float, end_ts: float, tz: Optional[tzinfo] = None,
+                    limit: int = 100) -> List[float]:
+        """Occurrences in (start_ts, end_ts], at most `limit` of them."""
+        result = []
+        ts = start_ts
+        while len(result) < limit:
+            ts = self.next_after(ts, tz)
+            if ts > end_ts:
+                break
+            result.append(ts)
+        return result
+
+    @staticmethod
+    def _to_wall(ts: float, tz: Optional[tzinfo]) -> datetime:
+        if tz is None:
+            return datetime.fromtimestamp(ts)
+        return datetime.fromtimestamp(ts, tz).replace(tzinfo=None)
+
+    @staticmethod
+    def _to_timestamp(wall: datetime, tz: Optional[tzinfo]) -> float:
+        if tz is None:
+            return wall.timestamp()
+        return wall.replace(tzinfo=tz).timestamp()
+
+
+def legacy_cron(frequency: str, time_str: str) -> Optional[str]:
+    """Cron equivalent of the old schedule settings: daily at HH:MM, or hourly at minute MM."""
+    try:
+        hour, minute = (int(x) for x in (time_str or "09:00").split(":")[:2])
+    except ValueError:
+        return None
+    if frequency == "daily":
+        return f"{minute} {hour} * * *"
+    if frequency == "hourly":
+        return f"{minute} * * * *"
+    return None
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from core.storage import STATE_DB, get_connection
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+
+def recipients_key(touser: str, toparty: str) -> str:
+    return f"touser={touser or ''};toparty={toparty or ''}"
+
+
+class DeliveryLedger:
+    """
+    Durable record of every file delivery attempt.
+
+    A file is identified by (route, path, size, mtime_ns, recipients), so a
+    report that is overwritten with new content counts as a new file, and
+    the same file sent to different recipients is tracked separately. The
+    unique index makes "was this already sent?" a single indexed lookup.
+    """
+
+    def __init__(self, db_path: str = STATE_DB):
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        conn = get_connection(self.db_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " route TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT,"
+            " recipients TEXT NOT NULL,"
+            " media_id TEXT,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " UNIQUE (route, path, size, mtime_ns, recipients))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_deliveries_route_status ON deliveries (route, status, mtime_ns)"
+        )
+
+    def is_delivered(self, route: str, file_path: str, recipients: str) -> bool:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        row = get_connection(self.db_path).execute(
+            "SELECT 1 FROM deliveries WHERE route = ? AND path = ? AND size = ? AND mtime_ns = ?"
+            " AND recipients = ? AND status = ?",
+            (route, os.path.abspath(file_path), st.st_size, st.st_mtime_ns, recipients, STATUS_SENT)
+        ).fetchone()
+        return row is not None
+
+    def begin(self, route: str, file_path: str, recipients: str, sha256: Optional[str] = None) -> int:
+        """Record a delivery attempt and return its id. Retries of the same file reuse the row."""
+        st = os.stat(file_path)
+        now = time.time()
+        path = os.path.abspath(file_path)
+        conn = get_connection(self.db_path)
+        conn.execute(
+            "INSERT INTO deliveries (route, path, size, mtime_ns, sha256, recipients, status, attempts,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?)"
+            " ON CONFLICT (route, path, size, mtime_ns, recipients) DO UPDATE SET"
+            " status = excluded.status, attempts = attempts + 1, error = NULL,"
+            " sha256 = COALESCE(excluded.sha256, sha256), updated_at = excluded.updated_at",
+            (route, path, st.st_size, st.st_mtime_ns, sha256, recipients, STATUS_PENDING, now, now)
+        )
+        row = conn.execute(
+            "SELECT id FROM deliveries WHERE route = ? AND path = ? AND size = ? AND mtime_ns = ? AND recipients = ?",
+            (route, path, st.st_size, st.st_mtime_ns, recipients)
+        ).fetchone()
+        return row[0]
+
+    def mark_sent(self, delivery_id: int, media_id: str, note: Optional[str] = None):
+        """note (kept in the error column) records e.g. recipients WeCom rejected as invalid."""
+        get_connection(self.db_path).execute(
+            "UPDATE deliveries SET status = ?, media_id = ?, error = ?, updated_at = ? WHERE id = ?",
+            (STATUS_SENT, media_id, note, time.time(), delivery_id)
+        )
+
+    def mark_failed(self, delivery_id: int, error: str):
+        get_connection(self.db_path).execute(
+            "UPDATE deliveries SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (STATUS_FAILED, error, time.time(), delivery_id)
+        )
+
+    def last_sent_mtime(self, route: str, recipients: str) -> Optional[int]:
+        """mtime_ns of the newest file successfully delivered on this route."""
+        row = get_connection(self.db_path).execute(
+            "SELECT MAX(mtime_ns) FROM deliveries WHERE route = ? AND recipients = ? AND status = ?",
+            (route, recipients, STATUS_SENT)
+        ).fetchone()
+        return row[0] if row else None
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        conn = get_connection(self.db_path)
+        cursor = conn.execute(
+            "SELECT id, route, path, size, sha256, recipients, media_id, status, attempts, error,"
+            " created_at, updated_at FROM deliveries ORDER BY updated_at DESC LIMIT ?",
+            (limit,)
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_default_ledger: Optional[DeliveryLedger] = None
+_default_lock = threading.Lock()
+
+
+def get_delivery_ledger() -> DeliveryLedger:
+    global _default_ledger
+    if _default_ledger is None:
+        with _default_lock:
+            if _default_ledger is None:
+                _default_ledger = DeliveryLedger()
+    return _default_ledger
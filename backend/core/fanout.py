@@ -0,0 +1,139 @@
+import logging
+import threading
+from itertools import zip_longest
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# WeCom limits per message/send call
+MAX_USERS_PER_MESSAGE = 1000
+MAX_PARTIES_PER_MESSAGE = 100
+# Chunks sent at once by the blocking client (the async client uses its own semaphore)
+FANOUT_WORKERS = 4
+
+ALL_USERS = "@all"
+# Invalid IDs named in a log line; the rest are only counted
+LOGGED_INVALID_IDS = 20
+# message/send: every recipient of the call was invalid
+ERRCODE_ALL_RECIPIENTS_INVALID = 81013
+
+
+def split_ids(value: Optional[str]) -> List[str]:
+    """'a|b|a' -> ['a', 'b']: WeCom recipient lists are '|'-separated; blanks and repeats are dropped."""
+    seen = set()
+    ids = []
+    for part in (value or "").split("|"):
+        part = part.strip()
+        if part and part not in seen:
+            seen.add(part)
+            ids.append(part)
+    return ids
+
+
+def chunk_recipients(touser: str, toparty: str) -> List[Tuple[str, str]]:
+    """
+    Split recipients into (touser, toparty) pairs within WeCom's per-call
+    limits. User and party chunks are paired up, so the number of calls is
+    the larger of the two chunk counts. "@all" is a single call.
+    """
+    if (touser or "").strip() == ALL_USERS:
+        return [(ALL_USERS, "")]
+    users = split_ids(touser)
+    parties = split_ids(toparty)
+    if not users and not parties:
+        return [(touser or "", toparty or "")]
+    user_chunks = ["|".join(users[i:i + MAX_USERS_PER_MESSAGE])
+                   for i in range(0, len(users), MAX_USERS_PER_MESSAGE)]
+    party_chunks = ["|".join(parties[i:i + MAX_PARTIES_PER_MESSAGE])
+                    for i in range(0, len(parties), MAX_PARTIES_PER_MESSAGE)]
+    return list(zip_longest(user_chunks, party_chunks, fillvalue=""))
+
+
+def invalid_ids(data: Dict[str, Any]) -> Tuple[Set[str], Set[str]]:
+    """(invalid users, invalid parties) reported by a message/send response."""
+    return set(split_ids(data.get("invaliduser"))), set(split_ids(data.get("invalidparty")))
+
+
+class FanoutResult:
+    """Outcome of sending one media_id to every chunk of a recipient list."""
+
+    def __init__(self, chunks: int):
+        self.chunks = chunks
+        self.sent_chunks = 0
+        self.failed_chunks = 0
+        # Chunks with no valid recipient at all: nothing to deliver, nothing to retry
+        self.invalid_chunks = 0
+        self.invalid_users: Set[str] = set()
+        self.invalid_parties: Set[str] = set()
+        self.errcodes: List[Any] = []
+        # The blocking client records chunks from several threads
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self) -> bool:
+        """
+        Every chunk with at least one valid recipient was delivered. Also
+        true when every recipient was invalid: resending cannot help, so
+        the send is done and the invalid IDs say why nobody got it.
+        """
+        return self.failed_chunks == 0 and self.sent_chunks + self.invalid_chunks > 0
+
+    @property
+    def delivered(self) -> bool:
+        """At least one recipient got the message."""
+        return self.sent_chunks > 0
+
+    def invalid_summary(self) -> Optional[str]:
+        """'invalid users: a, b; invalid parties: 3', or None if every ID was valid."""
+        parts = []
+        for kind, ids in (("users", self.invalid_users), ("parties", self.invalid_parties)):
+            if ids:
+                shown = sorted(ids)[:LOGGED_INVALID_IDS]
+                more = f" and {len(ids) - len(shown)} more" if len(ids) > len(shown) else ""
+                parts.append(f"invalid {kind}: {', '.join(shown)}{more}")
+        return "; ".join(parts) or None
+
+    def record(self, touser: str, toparty: str, data: Optional[Dict[str, Any]],
+               retry_allowed: bool) -> Optional[Tuple[str, str]]:
+        """
+        Account for one call's response. If WeCom rejected the call because
+        of invalid IDs and some recipients were valid, returns the valid
+        remainder to send again (when retry_allowed); otherwise None.
+        """
+        with self._lock:
+            return self._record(touser, toparty, data, retry_allowed)
+
+    def _record(self, touser: str, toparty: str, data: Optional[Dict[str, Any]],
+                retry_allowed: bool) -> Optional[Tuple[str, str]]:
+        if data is None:
+            self.failed_chunks += 1
+            return None
+        bad_users, bad_parties = invalid_ids(data)
+        self.invalid_users |= bad_users
+        self.invalid_parties |= bad_parties
+        errcode = data.get("errcode")
+        if errcode == 0:
+            # Partial success: WeCom delivered to the valid ones and listed the rest
+            self.sent_chunks += 1
+            return None
+
+        self.errcodes.append(errcode)
+        if bad_users or bad_parties or errcode == ERRCODE_ALL_RECIPIENTS_INVALID:
+            users = [u for u in split_ids(touser) if u not in bad_users]
+            parties = [p for p in split_ids(toparty) if p not in bad_parties]
+            if errcode == ERRCODE_ALL_RECIPIENTS_INVALID or (not users and not parties):
+                # Nobody left to deliver to; not a failure of this chunk
+                self.invalid_chunks += 1
+                return None
+            if retry_allowed:
+                return "|".join(users), "|".join(parties)
+        self.failed_chunks += 1
+        return None
+
+    def log(self):
+        for kind, ids in (("users", self.invalid_users), ("parties", self.invalid_parties)):
+            if ids:
+                shown = sorted(ids)[:LOGGED_INVALID_IDS]
+                more = f" and {len(ids) - len(shown)} more" if len(ids) > len(shown) else ""
+                logging.warning(f"{len(ids)} {kind} not found in WeCom: {', '.join(shown)}{more}")
+        if self.chunks > 1:
+            logging.info(f"Fan-out: {self.sent_chunks}/{self.chunks} recipient batches sent, "
+                         f"{self.failed_chunks} failed, {self.invalid_chunks} without valid recipients")
@@ -1,31 +1,253 @@
 import os
-import glob
-from typing import Optional
+import bisect
+import fnmatch
+import heapq
+import logging
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+from core.metrics import SCAN_DURATION, route_label
+
+
+class DirectoryIndex:
+    """
+    mtime-ordered index of the regular files in one directory.
+
+    The directory is re-read with os.scandir only when its own mtime changes
+    (a file was created, removed or renamed), so repeated "latest file"
+    lookups on an unchanged folder cost a single stat of the directory.
+    Files rewritten in place do not touch the directory mtime; call
+    refresh(force=True) if a producer does that.
+    """
+
+    def __init__(self, directory_path: str, file_pattern: str = "*"):
+        self.directory_path = directory_path
+        self.file_pattern = file_pattern
+        self._dir_mtime_ns = None
+        # Sorted ascending by (mtime_ns, path); the newest file is the last entry.
+        self._entries: List[Tuple[int, str]] = []
+        self._lock = threading.Lock()
+
+    def _matches(self, name: str) -> bool:
+        if name.startswith('.'):
+            return False
+        return self.file_pattern in ("*", "") or fnmatch.fnmatch(name, self.file_pattern)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rescan the directory if it changed. Returns True when a rescan happened."""
+        try:
+            dir_mtime_ns = os.stat(self.directory_path).st_mtime_ns
+        except OSError:
+            with self._lock:
+                self._dir_mtime_ns = None
+                self._entries = []
+            return False
+
+        with self._lock:
+            if not force and dir_mtime_ns == self._dir_mtime_ns:
+                return False
+
+            started = time.monotonic()
+            entries = []
+            try:
+                with os.scandir(self.directory_path) as it:
+                    for entry in it:
+                        if not self._matches(entry.name):
+                            continue
+                        try:
+                            # d_type answers is_file without a syscall; stat() is
+                            # one call per candidate instead of isfile + getmtime.
+                            if not entry.is_file():
+                                continue
+                            entries.append((entry.stat().st_mtime_ns, entry.path))
+                        except OSError:
+                            # Removed between readdir and stat
+                            continue
+            except OSError as e:
+                logging.warning(f"Error scanning directory {self.directory_path}: {e}")
+                return False
+
+            entries.sort()
+            self._entries = entries
+            self._dir_mtime_ns = dir_mtime_ns
+            SCAN_DURATION.labels(route=route_label()).observe(time.monotonic() - started)
+            return True
+
+    def latest(self) -> Optional[str]:
+        self.refresh()
+        with self._lock:
+            return self._entries[-1][1] if self._entries else None
+
+    def entries(self) -> List[Tuple[int, str]]:
+        """Snapshot of (mtime_ns, path) pairs, oldest first. Does not refresh."""
+        with self._lock:
+            return list(self._entries)
+
+    def files_since(self, mtime_ns: int) -> List[str]:
+        """Files modified strictly after mtime_ns, oldest first."""
+        self.refresh()
+        with self._lock:
+            pos = bisect.bisect_right(self._entries, (mtime_ns, chr(0x10FFFF)))
+            return [path for _, path in self._entries[pos:]]
+
 
 class FileScanner:
-    @staticmethod
-    def get_latest_file(directory_path: str, file_pattern: str = "*") -> Optional[str]:
+    _indexes: Dict[Tuple[str, str], DirectoryIndex] = {}
+    _indexes_lock = threading.Lock()
+
+    @classmethod
+    def get_index(cls, directory_path: str, file_pattern: str = "*") -> DirectoryIndex:
+        """Return the process-wide index for (directory, pattern), creating it on first use."""
+        key = (os.path.abspath(directory_path), file_pattern)
+        with cls._indexes_lock:
+            index = cls._indexes.get(key)
+            if index is None:
+                index = DirectoryIndex(key[0], file_pattern)
+                cls._indexes[key] = index
+            return index
+
+    @classmethod
+    def get_latest_file(cls, directory_path: str, file_pattern: str = "*") -> Optional[str]:
         """
         Get the latest file in the directory.
         Ignores directories and hidden files (starting with .).
         """
-        if not directory_path or not os.path.exists(directory_path):
+        if not directory_path or not os.path.isdir(directory_path):
             return None
 
-        # Construct search pattern
-        search_path = os.path.join(directory_path, file_pattern)
-        files = glob.glob(search_path)
-        
-        # Filter out directories and hidden files
-        files = [f for f in files if os.path.isfile(f) and not os.path.basename(f).startswith('.')]
+        return cls.get_index(directory_path, file_pattern).latest()
 
-        if not files:
-            return None
 
-        # Sort by modification time, descending
+# Office lock files and partial downloads that sit next to real reports
+DEFAULT_EXCLUDE = ("~$*", "*.tmp")
+DEFAULT_SCAN_WORKERS = 8
+
+
+def _compile(patterns: Iterable[str]) -> Tuple[Optional[Pattern], Optional[Pattern]]:
+    """
+    One regex for the patterns matched against file names and one for
+    those matched against paths relative to the scan root (any pattern
+    containing "/"). None where there are no patterns of that kind.
+    """
+    names, paths = [], []
+    for pattern in patterns:
+        pattern = pattern.strip().replace("\\", "/")
+        if pattern:
+            (paths if "/" in pattern else names).append(fnmatch.translate(pattern.strip("/")))
+    return (re.compile("|".join(names)) if names else None,
+            re.compile("|".join(paths)) if paths else None)
+
+
+class ScanRules:
+    """
+    Compiled include/exclude globs.
+
+    A pattern without "/" is matched against the file name ("*.xlsx",
+    "~$*"); one with "/" against the path relative to the scan root
+    ("2026/*/*.xlsx", "archive/*"). In either kind, "*" also matches
+    across "/". A file is taken when it matches some include pattern (or
+    there are none) and no exclude pattern. Exclude patterns also prune
+    directories. Names starting with "." are always skipped.
+    """
+
+    def __init__(self, include: Iterable[str] = (), exclude: Iterable[str] = DEFAULT_EXCLUDE):
+        include = [p for p in include if p and p != "*"]
+        self._include = _compile(include) if include else None
+        self._exclude = _compile(exclude)
+
+    @staticmethod
+    def _hit(compiled: Tuple[Optional[Pattern], Optional[Pattern]], name: str, rel_path: str) -> bool:
+        by_name, by_path = compiled
+        return bool((by_name and by_name.match(name)) or (by_path and by_path.match(rel_path)))
+
+    def wants_dir(self, name: str, rel_path: str) -> bool:
+        return not name.startswith(".") and not self._hit(self._exclude, name, rel_path)
+
+    def wants_file(self, name: str, rel_path: str) -> bool:
+        if name.startswith(".") or self._hit(self._exclude, name, rel_path):
+            return False
+        return self._include is None or self._hit(self._include, name, rel_path)
+
+
+class TreeScanner:
+    """
+    Recursive scan of a folder tree.
+
+    Each directory is listed by one task on a thread pool, and the
+    subdirectories it finds are submitted as they turn up, so independent
+    subtrees are read concurrently - on a network share the latency of
+    each readdir/stat round trip overlaps instead of adding up. Results
+    are produced as directories complete: walk() and newer_than() stream
+    (mtime_ns, path) pairs in no particular order, and latest() keeps only
+    the n newest in a heap. Nothing is cached between scans; unlike
+    DirectoryIndex a tree has no single mtime that says it is unchanged.
+    """
+
+    def __init__(self, root: str, include: Iterable[str] = (), exclude: Optional[Iterable[str]] = None,
+                 max_depth: Optional[int] = None, max_age_seconds: Optional[float] = None,
+                 workers: int = DEFAULT_SCAN_WORKERS):
+        self.root = os.path.abspath(root)
+        self.rules = ScanRules(include, DEFAULT_EXCLUDE if exclude is None else exclude)
+        # 0 = files directly in root only
+        self.max_depth = max_depth
+        self.max_age_seconds = max_age_seconds
+        self.workers = max(1, workers)
+
+    def _list_dir(self, path: str, rel: str, depth: int, min_mtime_ns: int):
+        """Files and subdirectories of one directory: ([(mtime_ns, path)], [(path, rel, depth)])."""
+        files, subdirs = [], []
         try:
-            latest_file = max(files, key=os.path.getmtime)
-            return latest_file
-        except Exception as e:
-            print(f"Error finding latest file: {e}")
-            return None
+            with os.scandir(path) as it:
+                for entry in it:
+                    rel_path = f"{rel}/{entry.name}" if rel else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if (self.max_depth is None or depth < self.max_depth) and \
+                                    self.rules.wants_dir(entry.name, rel_path):
+                                subdirs.append((entry.path, rel_path, depth + 1))
+                        elif entry.is_file() and self.rules.wants_file(entry.name, rel_path):
+                            mtime_ns = entry.stat().st_mtime_ns
+                            if mtime_ns > min_mtime_ns:
+                                files.append((mtime_ns, entry.path))
+                    except OSError:
+                        # Removed between readdir and stat
+                        continue
+        except OSError as e:
+            logging.warning(f"Error scanning directory {path}: {e}")
+        return files, subdirs
+
+    def walk(self, newer_than_ns: int = -1) -> Iterator[Tuple[int, str]]:
+        """Every matching file as (mtime_ns, path), modified after newer_than_ns and within the age cutoff."""
+        if not os.path.isdir(self.root):
+            return
+        min_mtime_ns = newer_than_ns
+        if self.max_age_seconds:
+            min_mtime_ns = max(min_mtime_ns, int((time.time() - self.max_age_seconds) * 1e9))
+
+        started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan")
+        try:
+            pending = {executor.submit(self._list_dir, self.root, "", 0, min_mtime_ns)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    for path, rel, depth in subdirs:
+                        pending.add(executor.submit(self._list_dir, path, rel, depth, min_mtime_ns))
+                    yield from files
+            SCAN_DURATION.labels(route=route_label()).observe(time.monotonic() - started)
+        finally:
+            # Also reached when the caller stops iterating early
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def newer_than(self, mtime_ns: int) -> Iterator[str]:
+        """Paths of files modified strictly after mtime_ns, streamed in discovery order."""
+        for _, path in self.walk(mtime_ns):
+            yield path
+
+    def latest(self, n: int = 1) -> Iterator[str]:
+        """The n most recently modified files, newest first. Memory is bounded by n, not by the tree size."""
+        yield from (path for _, path in heapq.nlargest(n, self.walk()))
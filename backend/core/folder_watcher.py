@@ -0,0 +1,249 @@
+import os
+import select
+import struct
+import threading
+import time
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from core.file_scanner import FileScanner
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+
+def _load_inotify():
+    """Return libc with inotify bound, or None when unavailable (non-Linux, musl without it, ...)."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FolderWatcher:
+    """
+    Watches a folder and calls on_file(path) once for every new file that
+    has finished being written.
+
+    Uses inotify when available, so the thread sleeps in select() until the
+    kernel reports activity. A file is considered complete after a
+    close-write (or moved-in) event followed by settle_seconds with no size
+    or mtime change. Falls back to polling the directory index, which also
+    covers network mounts where remote writers produce no inotify events.
+    Files already present when the watcher starts are not dispatched.
+    """
+
+    def __init__(self, directory_path: str, on_file: Callable[[str], None], file_pattern: str = "*",
+                 settle_seconds: float = 0.5, poll_interval: float = 5.0, use_inotify: bool = True):
+        self.directory_path = os.path.abspath(directory_path)
+        self.on_file = on_file
+        self.file_pattern = file_pattern
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._wake_r = None
+        self._wake_w = None
+        self._mode = None
+        # name -> (size, mtime_ns, last_change_monotonic, closed)
+        self._pending: Dict[str, Tuple[int, int, float, bool]] = {}
+        # name -> (size, mtime_ns) of files already dispatched or present at start
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # --- lifecycle ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._pending.clear()
+        self._seen = self._current_files()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="watch-dispatch")
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"x")
+            except OSError:
+                pass
+        if self._thread:
+            self._thread.join(timeout=2)
+        for fd in (self._wake_r, self._wake_w):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._wake_r = self._wake_w = None
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        logging.info(f"Folder watcher stopped: {self.directory_path}")
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def mode(self) -> Optional[str]:
+        return self._mode
+
+    # --- helpers ---
+
+    def _matches(self, name: str) -> bool:
+        if not name or name.startswith('.'):
+            return False
+        return self.file_pattern in ("*", "") or fnmatch.fnmatch(name, self.file_pattern)
+
+    def _current_files(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        try:
+            with os.scandir(self.directory_path) as it:
+                for entry in it:
+                    if not self._matches(entry.name):
+                        continue
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            files[entry.name] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return files
+
+    def _touch_pending(self, name: str, closed: bool):
+        if not self._matches(name):
+            return
+        try:
+            st = os.stat(os.path.join(self.directory_path, name))
+        except OSError:
+            self._pending.pop(name, None)
+            return
+        prev = self._pending.get(name)
+        closed = closed or (prev is not None and prev[3])
+        self._pending[name] = (st.st_size, st.st_mtime_ns, time.monotonic(), closed)
+
+    def _check_pending(self, require_close: bool) -> Optional[float]:
+        """Dispatch settled files. Returns seconds until the next check is due, or None if idle."""
+        now = time.monotonic()
+        next_due = None
+        for name, (size, mtime_ns, changed_at, closed) in list(self._pending.items()):
+            path = os.path.join(self.directory_path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[name]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self._pending[name] = (st.st_size, st.st_mtime_ns, now, closed)
+                changed_at = now
+            elif (closed or not require_close) and now - changed_at >= self.settle_seconds:
+                del self._pending[name]
+                if self._seen.get(name) == (st.st_size, st.st_mtime_ns):
+                    continue
+                self._seen[name] = (st.st_size, st.st_mtime_ns)
+                self._dispatch(path)
+                continue
+            if closed or not require_close:
+                due = max(0.0, changed_at + self.settle_seconds - now)
+                next_due = due if next_due is None else min(next_due, due)
+        return next_due
+
+    def _dispatch(self, path: str):
+        logging.info(f"Watcher detected new file: {path}")
+        if self._executor:
+            self._executor.submit(self._safe_call, path)
+
+    def _safe_call(self, path: str):
+        try:
+            self.on_file(path)
+        except Exception as e:
+            logging.error(f"Error handling watched file {path}: {e}")
+
+    # --- loops ---
+
+    def _run(self):
+        libc = _load_inotify() if self.use_inotify else None
+        fd = -1
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(fd, self.directory_path.encode(), _WATCH_MASK) < 0:
+                os.close(fd)
+                fd = -1
+        if fd >= 0:
+            self._mode = "inotify"
+            logging.info(f"Folder watcher started (inotify): {self.directory_path}")
+            try:
+                self._inotify_loop(fd)
+            finally:
+                os.close(fd)
+        else:
+            self._mode = "polling"
+            logging.info(f"Folder watcher started (polling every {self.poll_interval}s): {self.directory_path}")
+            self._poll_loop()
+
+    def _inotify_loop(self, fd: int):
+        timeout = None
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd, self._wake_r], [], [], timeout)
+            if self._stop_event.is_set():
+                break
+            if fd in readable:
+                try:
+                    buf = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    buf = b""
+                offset = 0
+                while offset + _EVENT_HEADER.size <= len(buf):
+                    _, mask, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+                    raw = buf[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length]
+                    offset += _EVENT_HEADER.size + length
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        logging.warning(f"Watched folder went away, switching to polling: {self.directory_path}")
+                        self._mode = "polling"
+                        self._poll_loop()
+                        return
+                    if mask & IN_ISDIR:
+                        continue
+                    name = raw.split(b"\0", 1)[0].decode(errors="surrogateescape")
+                    self._touch_pending(name, closed=bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO)))
+            timeout = self._check_pending(require_close=True)
+
+    def _poll_loop(self):
+        index = FileScanner.get_index(self.directory_path, self.file_pattern)
+        index.refresh()
+        while not self._stop_event.is_set():
+            if index.refresh():
+                for mtime_ns, path in index.entries():
+                    name = os.path.basename(path)
+                    seen = self._seen.get(name)
+                    if name not in self._pending and (seen is None or seen[1] != mtime_ns):
+                        self._touch_pending(name, closed=False)
+            next_due = self._check_pending(require_close=False)
+            wait = self.poll_interval if next_due is None else min(self.poll_interval, max(next_due, 0.05))
+            self._stop_event.wait(wait)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+# Responses smaller than this are sent as they are; gzip would barely shrink them
+GZIP_MINIMUM_SIZE = 1024
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Weak ETag (gzip may re-encode the body) for content, or for versions
+    that every instance shares (state.db counters, file stat). Never pass
+    per-process counters: tags must match across workers and restarts.
+    """
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check with weak comparison, as RFC 9110 requires for GET."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    # no-cache: browsers keep the body but revalidate on every poll
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def conditional_json(request: Request, etag: str, build: Callable[[], Any]) -> Response:
+    """
+    304 when the client already has `etag`; otherwise build() as JSON with
+    the ETag. Compute etag before calling build(), so a change in between
+    only makes the tag older than the body, never newer.
+    """
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    return JSONResponse(build(), headers=cache_headers(etag))
+
+
+class VersionProbe:
+    """
+    Evaluates a version (or snapshot) function at most once per `max_age`
+    seconds, however many long-poll requests are waiting on it, so a dozen
+    open dashboards cost one probe per interval instead of one each.
+    """
+
+    def __init__(self, compute: Callable[[], Any], max_age: float = 1.0):
+        self.compute = compute
+        self.max_age = max_age
+        self._value: Any = None
+        self._at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        with self._lock:
+            now = time.monotonic()
+            if self._value is None or now - self._at >= self.max_age:
+                self._value = self.compute()
+                self._at = now
+            return self._value
+
+
+class SelectiveGZipMiddleware:
+    """
+    GZipMiddleware except for the given paths. Server-Sent Events must not
+    go through it: the compressor holds each event back until enough output
+    has accumulated, so a live log stream would stall.
+    """
+
+    def __init__(self, app, minimum_size: int = GZIP_MINIMUM_SIZE, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self.exclude_paths:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -0,0 +1,84 @@
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# requests and urllib3 are imported when the first session is built rather
+# than at startup: an instance that only serves the API never needs them.
+
+# Connection pool sizing: all WeCom calls go to a single host, so one pool
+# with enough slots for the concurrent upload/send threads is sufficient.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+UPLOAD_TIMEOUT = (5, 120)
+
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+
+
+def _adapter_class():
+    from requests.adapters import HTTPAdapter
+
+    class TimeoutHTTPAdapter(HTTPAdapter):
+        """HTTPAdapter that applies a default timeout when the caller does not pass one."""
+
+        def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+            self.timeout = timeout
+            super().__init__(*args, **kwargs)
+
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = self.timeout
+            return super().send(request, **kwargs)
+
+    return TimeoutHTTPAdapter
+
+
+def _build_session() -> "requests.Session":
+    import requests
+    from urllib3.util.retry import Retry
+
+    # Connection failures are retried for every method since nothing reached
+    # the server. Read errors and 5xx are only retried for GET (gettoken):
+    # replaying a media/upload or message/send could duplicate the delivery.
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=2,
+        status=2,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = _adapter_class()(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> "requests.Session":
+    """Return the process-wide keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
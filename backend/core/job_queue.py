@@ -0,0 +1,390 @@
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from core.log_setup import log_context
+from core.metrics import JOB_DURATION
+from core.storage import STATE_DB, get_connection
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_SUCCEEDED = "succeeded"
+STATE_FAILED = "failed"
+JOB_STATES = (STATE_QUEUED, STATE_RUNNING, STATE_SUCCEEDED, STATE_FAILED)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 30.0
+MAX_RETRY_DELAY = 3600.0
+# Finished jobs kept for the status endpoints
+KEEP_FINISHED = 1000
+# Triggers from a person or a new file: a job they join runs now instead of waiting out its retry backoff
+IMMEDIATE_TRIGGERS = ("manual", "watch")
+# A scheduled run catching up on missed occurrences: delivers everything since the last success,
+# and a queued job of the route it joins is widened to it
+BACKLOG_TRIGGER = "catch_up"
+# A process running jobs stamps its heartbeat this often; a running job whose owner has not
+# stamped for ORPHAN_AFTER_SECONDS belongs to a process that died or lost the database
+HEARTBEAT_SECONDS = 10.0
+ORPHAN_AFTER_SECONDS = 60.0
+# Upper bound on an idle worker's sleep, so jobs enqueued by another process are still picked up
+IDLE_POLL_SECONDS = 30.0
+
+# handler(job) -> result dict; raising marks the attempt failed
+JobHandler = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+_COLUMNS = ("id", "route", "file", "trigger", "state", "attempts", "max_attempts", "result", "error",
+            "created_at", "started_at", "finished_at", "run_after")
+
+
+class FatalJobError(Exception):
+    """Raised by a handler to fail a job without retrying it."""
+
+
+class JobQueue:
+    """
+    Durable, SQLite-backed queue of delivery jobs with a worker pool.
+
+    A job targets one route (and optionally a single file). Triggering a
+    route that already has a job waiting returns that job instead of
+    queueing another, and a job is only started when no other job for the
+    same route is running, across all processes sharing state.db. Failed
+    attempts are retried with exponential backoff up to max_attempts; a
+    manual or watch trigger joining a job that is backing off makes it due
+    again with a fresh set of attempts.
+    Queued jobs survive a restart. While a process runs jobs it keeps a
+    heartbeat in state.db; jobs left running by a process whose heartbeat
+    has stopped are queued again by adopt_orphans, while jobs still
+    finishing on a process that merely stopped taking new ones are left
+    alone.
+    """
+
+    def __init__(self, handler: JobHandler, db_path: str = STATE_DB, workers: int = DEFAULT_WORKERS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retry_delay: float = DEFAULT_RETRY_DELAY):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._threads: List[threading.Thread] = []
+        self._stop_event: Optional[threading.Event] = None
+        self._wakeup = threading.Condition()
+        # Jobs this process is running, across pool generations; the heartbeat runs while > 0
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._heartbeat: Optional[threading.Thread] = None
+        self._init_db()
+
+    def _init_db(self):
+        conn = get_connection(self.db_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " route TEXT NOT NULL,"
+            " file TEXT,"
+            " trigger TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " max_attempts INTEGER NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " owner TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " run_after REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, run_after)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_route_state ON jobs (route, state)")
+        # Liveness of processes running jobs, kept apart from jobs so beats don't bump jobs_version
+        conn.execute("CREATE TABLE IF NOT EXISTS job_heartbeats (owner TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+        # Change counter kept by triggers, so writes from every process bump it
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs_version (id INTEGER PRIMARY KEY CHECK (id = 1),"
+                     " version INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO jobs_version (id, version) VALUES (1, 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS jobs_version_{event.lower()} AFTER {event} ON jobs"
+                         " BEGIN UPDATE jobs_version SET version = version + 1; END")
+
+    # --- producers ---
+
+    def enqueue(self, route: str, trigger: str = "manual", file: Optional[str] = None) -> int:
+        """Queue a run of `route` (or of a single file on it). Returns the job id, possibly of an existing queued job."""
+        now = time.time()
+        expedited = False
+        conn = get_connection(self.db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, run_after FROM jobs WHERE route = ? AND file IS ? AND state = ? ORDER BY id LIMIT 1",
+                (route, file, STATE_QUEUED)
+            ).fetchone()
+            if row:
+                job_id, coalesced = row[0], True
+                if trigger in IMMEDIATE_TRIGGERS and row[1] > now:
+                    conn.execute("UPDATE jobs SET trigger = ?, attempts = 0, run_after = ? WHERE id = ?",
+                                 (trigger, now, job_id))
+                    expedited = True
+                elif trigger == BACKLOG_TRIGGER:
+                    conn.execute("UPDATE jobs SET trigger = ? WHERE id = ?", (trigger, job_id))
+            else:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (route, file, trigger, state, max_attempts, created_at, run_after)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (route, file, trigger, STATE_QUEUED, self.max_attempts, now, now)
+                ).lastrowid
+                coalesced = False
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if coalesced:
+            logging.info(f"[{route}] 已有等待中的任务 #{job_id}，合并本次触发 ({trigger})"
+                         + ("，立即执行" if expedited else ""))
+        if expedited or not coalesced:
+            self._notify()
+        return job_id
+
+    # --- status ---
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = get_connection(self.db_path).execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def recent(self, limit: int = 50, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        params: tuple = ()
+        if state:
+            query += " WHERE state = ?"
+            params = (state,)
+        rows = get_connection(self.db_path).execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,))
+        return [self._to_dict(row) for row in rows.fetchall()]
+
+    def version(self) -> int:
+        """Bumped by every change to the jobs table; a cheap check before recomputing counts or lists."""
+        row = get_connection(self.db_path).execute("SELECT version FROM jobs_version").fetchone()
+        return row[0] if row else 0
+
+    def counts(self) -> Dict[str, int]:
+        rows = get_connection(self.db_path).execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        return {state: count for state, count in rows.fetchall()}
+
+    @staticmethod
+    def _to_dict(row) -> Dict[str, Any]:
+        job = dict(zip(_COLUMNS, row))
+        if job["result"]:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    # --- workers ---
+
+    def configure(self, workers: int, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                  retry_delay: float = DEFAULT_RETRY_DELAY):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        if workers != self.workers:
+            self.workers = workers
+            if self._threads:
+                self.stop()
+                self.start()
+
+    def start(self):
+        if self._threads:
+            return
+        self.adopt_orphans()
+        # A fresh event per generation, so workers of a stopped pool that are still
+        # finishing a job exit afterwards instead of joining the new pool
+        self._stop_event = threading.Event()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run_worker, args=(self._stop_event,),
+                                      name=f"job-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Job queue started with {self.workers} workers")
+
+    def stop(self, timeout: float = 5.0):
+        """Stop taking new jobs. Jobs already running finish in the background."""
+        if self._stop_event:
+            self._stop_event.set()
+        self._notify(all_workers=True)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        """Look for runnable jobs now, e.g. ones another process has enqueued."""
+        self._notify(all_workers=True)
+
+    def is_running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def _notify(self, all_workers: bool = False):
+        with self._wakeup:
+            if all_workers:
+                self._wakeup.notify_all()
+            else:
+                self._wakeup.notify()
+
+    def adopt_orphans(self):
+        """
+        Queue again jobs left running by another process, on any host, whose
+        heartbeat has stopped. A former leader's jobs that are still
+        finishing keep their owner's heartbeat fresh and are left to it (the
+        route stays blocked until they end); call this periodically to pick
+        them up should that process die before finishing.
+        """
+        stale = time.time() - ORPHAN_AFTER_SECONDS
+        conn = get_connection(self.db_path)
+        rows = conn.execute(
+            "SELECT id, owner FROM jobs j WHERE state = ? AND (owner IS NULL OR owner != ?)"
+            " AND NOT EXISTS (SELECT 1 FROM job_heartbeats h WHERE h.owner = j.owner AND h.heartbeat_at >= ?)",
+            (STATE_RUNNING, self.owner, stale)
+        ).fetchall()
+        for job_id, owner in rows:
+            if self._requeue(conn, job_id, owner):
+                logging.warning(f"任务 #{job_id} 在 {owner} 上中断，已重新排队")
+        conn.execute("DELETE FROM job_heartbeats WHERE heartbeat_at < ?", (stale,))
+
+    @staticmethod
+    def _requeue(conn, job_id: int, owner: Optional[str]) -> bool:
+        return conn.execute(
+            "UPDATE jobs SET state = ?, owner = NULL, run_after = ? WHERE id = ? AND state = ? AND owner IS ?",
+            (STATE_QUEUED, time.time(), job_id, STATE_RUNNING, owner)
+        ).rowcount > 0
+
+    def _beat(self):
+        get_connection(self.db_path).execute(
+            "INSERT OR REPLACE INTO job_heartbeats (owner, heartbeat_at) VALUES (?, ?)", (self.owner, time.time())
+        )
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self._active_lock:
+                if not self._active:
+                    continue
+            try:
+                self._beat()
+            except sqlite3.Error as e:
+                logging.warning(f"Job heartbeat failed: {e}")
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest runnable job whose route is idle."""
+        conn = get_connection(self.db_path)
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs j WHERE state = ? AND run_after <= ?"
+                " AND NOT EXISTS (SELECT 1 FROM jobs r WHERE r.route = j.route AND r.state = ?)"
+                " ORDER BY run_after, id LIMIT 1",
+                (STATE_QUEUED, now, STATE_RUNNING)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, owner = ?, started_at = ?,"
+                    " finished_at = NULL WHERE id = ?",
+                    (STATE_RUNNING, self.owner, now, row[0])
+                )
+                conn.execute("INSERT OR REPLACE INTO job_heartbeats (owner, heartbeat_at) VALUES (?, ?)",
+                             (self.owner, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not row:
+            return None
+        job = self._to_dict(row)
+        job.update(state=STATE_RUNNING, attempts=job["attempts"] + 1, started_at=now)
+        return job
+
+    def _next_wait(self) -> float:
+        row = get_connection(self.db_path).execute(
+            "SELECT MIN(run_after) FROM jobs WHERE state = ?", (STATE_QUEUED,)
+        ).fetchone()
+        if row and row[0] is not None:
+            return min(IDLE_POLL_SECONDS, max(0.05, row[0] - time.time()))
+        return IDLE_POLL_SECONDS
+
+    def _run_worker(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    if not stop_event.is_set():
+                        self._wakeup.wait(self._next_wait())
+                continue
+            with self._active_lock:
+                self._active += 1
+                if self._heartbeat is None:
+                    self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat",
+                                                       daemon=True)
+                    self._heartbeat.start()
+            try:
+                self._execute(job)
+            finally:
+                with self._active_lock:
+                    self._active -= 1
+            # A finished job may unblock a queued one for the same route
+            self._notify()
+
+    def _execute(self, job: Dict[str, Any]):
+        with log_context(task_id=str(job["id"]), route=job["route"]):
+            try:
+                result = self.handler(job) or {}
+            except Exception as e:
+                JOB_DURATION.labels(route=job["route"], state=STATE_FAILED).observe(time.time() - job["started_at"])
+                self._finish_failed(job, e)
+                return
+            JOB_DURATION.labels(route=job["route"], state=STATE_SUCCEEDED).observe(time.time() - job["started_at"])
+            self._finish(job, "state = ?, result = ?, error = NULL, finished_at = ?",
+                         (STATE_SUCCEEDED, json.dumps(result, ensure_ascii=False), time.time()))
+            self._prune()
+
+    def _finish(self, job: Dict[str, Any], assignments: str, params: tuple) -> bool:
+        """Record a job's outcome, unless another instance adopted it meanwhile (this process looked dead)."""
+        updated = get_connection(self.db_path).execute(
+            f"UPDATE jobs SET {assignments}, owner = NULL WHERE id = ? AND owner = ?",
+            params + (job["id"], self.owner)
+        ).rowcount > 0
+        if not updated:
+            logging.warning(f"[{job['route']}] 任务 #{job['id']} 已被其他实例接管，本次结果不再记录")
+        return updated
+
+    def _finish_failed(self, job: Dict[str, Any], error: Exception):
+        now = time.time()
+        if not isinstance(error, FatalJobError) and job["attempts"] < job["max_attempts"]:
+            delay = min(MAX_RETRY_DELAY, self.retry_delay * (2 ** (job["attempts"] - 1)))
+            delay = random.uniform(delay / 2, delay)
+            if not self._finish(job, "state = ?, error = ?, finished_at = ?, run_after = ?",
+                                (STATE_QUEUED, str(error), now, now + delay)):
+                return
+            logging.warning(f"[{job['route']}] 任务 #{job['id']} 第 {job['attempts']} 次执行失败: {error}，"
+                            f"{delay:.0f} 秒后重试")
+            return
+        if not self._finish(job, "state = ?, error = ?, finished_at = ?", (STATE_FAILED, str(error), now)):
+            return
+        logging.error(f"[{job['route']}] 任务 #{job['id']} 执行失败: {error}")
+        self._prune()
+
+    def _prune(self):
+        get_connection(self.db_path).execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND id <= ("
+            " SELECT id FROM jobs WHERE state IN (?, ?) ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (STATE_SUCCEEDED, STATE_FAILED, STATE_SUCCEEDED, STATE_FAILED, KEEP_FINISHED)
+        )
+
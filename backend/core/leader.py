@@ -0,0 +1,188 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from core.metrics import LEADER
+from core.storage import STATE_DB, get_connection
+
+DEFAULT_LEASE_SECONDS = 30
+DEFAULT_RENEW_SECONDS = 10
+
+
+class LeaderElection:
+    """
+    Keeps at most one process in charge of `name` among every uvicorn
+    worker and container sharing state.db.
+
+    The holder owns a row in the leases table with an expiry time and
+    renews it every renew_seconds; the others try to take it over on the
+    same interval, which succeeds once the lease has lapsed. A holder that
+    cannot renew before its own lease runs out steps down by itself, so a
+    process cut off from the database does not keep acting as leader.
+    stop() deletes the row, letting another instance take over right away
+    instead of waiting for the lease to expire. Otherwise only expires_at
+    decides: process IDs say nothing about liveness across containers and
+    PID namespaces, so a lease left by a crashed process is taken over once
+    it lapses.
+
+    on_elected, on_demoted and on_renewed run on the election thread (or
+    the caller of start/stop).
+    """
+
+    def __init__(self, name: str, db_path: str = STATE_DB,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS, renew_seconds: float = DEFAULT_RENEW_SECONDS,
+                 on_elected: Optional[Callable[[], None]] = None,
+                 on_demoted: Optional[Callable[[], None]] = None,
+                 on_renewed: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = min(renew_seconds, lease_seconds / 2)
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_renewed = on_renewed
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leader = False
+        # Monotonic time our lease runs out if it is not renewed
+        self._deadline = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: Optional[threading.Event] = None
+        # Serialises elections, renewals and stop()
+        self._lock = threading.RLock()
+        self._init_db()
+
+    def _init_db(self):
+        conn = get_connection(self.db_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " acquired_at REAL NOT NULL)"
+        )
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader
+
+    def holder(self) -> Optional[Dict[str, Any]]:
+        """The current lease row, or None if nobody holds it."""
+        try:
+            row = get_connection(self.db_path).execute(
+                "SELECT owner, expires_at, acquired_at FROM leases WHERE name = ?", (self.name,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Reading lease '{self.name}' failed: {e}")
+            return None
+        if not row or row[1] < time.time():
+            return None
+        return {"owner": row[0],
+                "expires_at": datetime.fromtimestamp(row[1]).isoformat(),
+                "acquired_at": datetime.fromtimestamp(row[2]).isoformat()}
+
+    def try_acquire(self) -> Optional[bool]:
+        """
+        Take or renew the lease. True if we hold it afterwards, False if
+        another live instance does, None if the database could not be reached.
+        """
+        now = time.time()
+        conn = get_connection(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, expires_at, acquired_at FROM leases WHERE name = ?",
+                                   (self.name,)).fetchone()
+                if row and row[0] != self.owner and row[1] > now:
+                    conn.execute("COMMIT")
+                    return False
+                acquired_at = row[2] if row and row[0] == self.owner else now
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, owner, expires_at, acquired_at) VALUES (?, ?, ?, ?)",
+                    (self.name, self.owner, now + self.lease_seconds, acquired_at)
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logging.warning(f"Lease '{self.name}' could not be renewed: {e}")
+            return None
+
+    def release(self):
+        """Give the lease up so another instance can take over without waiting for it to expire."""
+        try:
+            get_connection(self.db_path).execute("DELETE FROM leases WHERE name = ? AND owner = ?",
+                                                 (self.name, self.owner))
+        except sqlite3.Error as e:
+            logging.warning(f"Releasing lease '{self.name}' failed: {e}")
+
+    # --- lifecycle ---
+
+    def start(self):
+        """Run one election right away (a lone instance leads from startup), then keep the lease."""
+        if self._thread:
+            return
+        self._stop_event = threading.Event()
+        self._tick()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_event,),
+                                        name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stop_event:
+            self._stop_event.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        with self._lock:
+            if self._leader:
+                self._demote("shutting down", logging.INFO)
+            self.release()
+
+    def _run(self, stop_event: threading.Event):
+        while not stop_event.wait(self.renew_seconds):
+            self._tick()
+
+    def _tick(self):
+        with self._lock:
+            started = time.monotonic()
+            won = self.try_acquire()
+            if won is None:
+                if self._leader and time.monotonic() >= self._deadline:
+                    self._demote("lease expired while the database was unreachable")
+                return
+            if not won:
+                if self._leader:
+                    holder = self.holder()
+                    self._demote(f"lease taken over by {holder['owner'] if holder else 'another instance'}")
+                return
+            self._deadline = started + self.lease_seconds
+            if not self._leader:
+                self._leader = True
+                LEADER.labels(lease=self.name).set(1)
+                logging.info(f"Elected leader for '{self.name}' ({self.owner})")
+                self._call(self.on_elected)
+            else:
+                self._call(self.on_renewed)
+
+    def _demote(self, reason: str, level: int = logging.WARNING):
+        self._leader = False
+        LEADER.labels(lease=self.name).set(0)
+        logging.log(level, f"No longer leader for '{self.name}': {reason}")
+        self._call(self.on_demoted)
+
+    def _call(self, callback: Optional[Callable[[], None]]):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception:
+            logging.exception(f"Leader callback for '{self.name}' failed")
+
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+LOG_FILE = "app.log"
+# Size-based rotation for LOG_FILE
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+BLOCK_SIZE = 8192
+# Upper bound on bytes returned by one incremental read
+MAX_READ_BYTES = 1024 * 1024
+# How far back a filtered tail searches for matching lines
+MAX_SCAN_BYTES = 16 * 1024 * 1024
+
+# Lines written before structured logging: "asctime - LEVEL - message"
+_TEXT_LINE = re.compile(r"^(\S+ \S+) - ([A-Z]+) - (.*)$", re.S)
+
+LinePredicate = Callable[[str], bool]
+
+
+def make_cursor(inode: int, offset: int) -> str:
+    return f"{inode}:{offset}"
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    try:
+        inode, offset = cursor.split(":", 1)
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_record(line: str) -> Dict[str, Any]:
+    """
+    A log line as a dict with at least ts, level and msg.
+
+    JSON lines (see core.log_setup) are returned as-is; older plain-text
+    lines are split into their asctime/level/message parts.
+    """
+    line = line.rstrip("\n")
+    if line.startswith("{"):
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                return record
+        except ValueError:
+            pass
+    match = _TEXT_LINE.match(line)
+    if match:
+        return {"ts": match.group(1), "level": match.group(2), "msg": match.group(3)}
+    return {"ts": "", "level": "", "msg": line}
+
+
+def format_record(record: Dict[str, Any]) -> str:
+    """Render a parsed record in the classic "asctime - LEVEL - message" form."""
+    if not record.get("ts"):
+        return record.get("msg", "")
+    text = f"{record['ts']} - {record.get('level', '')} - {record.get('msg', '')}"
+    if record.get("exc"):
+        text += "\n" + record["exc"]
+    return text
+
+
+def make_filter(filters: Dict[str, Any]) -> Optional[LinePredicate]:
+    """
+    Predicate over raw log lines for the non-empty entries of `filters`.
+
+    "level" is a minimum severity; every other key (route, task_id, file,
+    errcode, logger ...) must match the record's field exactly.
+    """
+    filters = {k: v for k, v in filters.items() if v not in (None, "")}
+    if not filters:
+        return None
+    min_level = filters.pop("level", None)
+    min_levelno = logging.getLevelName(str(min_level).upper()) if min_level else None
+    if not isinstance(min_levelno, int):
+        min_levelno = None
+
+    def predicate(line: str) -> bool:
+        record = parse_record(line)
+        if min_levelno is not None:
+            levelno = logging.getLevelName(record.get("level", ""))
+            if not isinstance(levelno, int) or levelno < min_levelno:
+                return False
+        return all(str(record.get(k, "")) == str(v) for k, v in filters.items())
+
+    return predicate
+
+
+def _reverse_lines(f, end: int, max_bytes: int) -> Iterator[str]:
+    """Complete lines before `end`, newest first, reading fixed-size blocks backwards."""
+    pos = end
+    partial = b""
+    while pos > 0 and end - pos < max_bytes:
+        step = min(BLOCK_SIZE, pos)
+        pos -= step
+        f.seek(pos)
+        chunks = (f.read(step) + partial).split(b"\n")
+        # chunks[0] may continue in the previous block
+        partial = chunks[0]
+        for chunk in reversed(chunks[1:]):
+            yield chunk.decode("utf-8", errors="replace") + "\n"
+    if pos == 0 and partial:
+        yield partial.decode("utf-8", errors="replace") + "\n"
+
+
+def _complete_end(f, end: int) -> int:
+    """Offset just past the last newline before `end` (0 if there is none): where the complete lines stop."""
+    pos = end
+    while pos > 0:
+        step = min(BLOCK_SIZE, pos)
+        pos -= step
+        f.seek(pos)
+        newline = f.read(step).rfind(b"\n")
+        if newline >= 0:
+            return pos + newline + 1
+    return 0
+
+
+def tail_lines(path: str = LOG_FILE, lines: int = 50,
+               predicate: Optional[LinePredicate] = None) -> Tuple[List[str], str]:
+    """
+    Last `lines` complete lines of the file (matching `predicate`, if
+    given) plus a cursor pointing just after them. A record still being
+    written is left out, and read_since returns it whole once finished.
+
+    Reads fixed-size blocks backwards from the end until enough lines have
+    been found, so the cost depends on `lines`, not on the file size. A
+    filtered tail gives up after MAX_SCAN_BYTES.
+    """
+    result: List[str] = []
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        end = _complete_end(f, st.st_size)
+        if lines > 0:
+            for i, line in enumerate(_reverse_lines(f, end, MAX_SCAN_BYTES if predicate else end)):
+                # end is just past a newline, so the first chunk is the empty one after it
+                if i == 0 and line == "\n":
+                    continue
+                if predicate is None or predicate(line):
+                    result.append(line)
+                    if len(result) >= lines:
+                        break
+    result.reverse()
+    return result, make_cursor(st.st_ino, end)
+
+
+def read_since(path: str = LOG_FILE, cursor: Optional[str] = None, max_bytes: int = MAX_READ_BYTES,
+               predicate: Optional[LinePredicate] = None) -> Tuple[List[str], str, bool]:
+    """
+    Complete lines appended after `cursor`.
+
+    Returns (lines, new_cursor, reset). reset is True when the file was
+    rotated or truncated since the cursor was issued; reading then restarts
+    from the beginning of the new file. A trailing line without a newline
+    is left for the next call.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        parsed = parse_cursor(cursor)
+        reset = parsed is None or parsed[0] != st.st_ino or parsed[1] > st.st_size
+        offset = 0 if reset else parsed[1]
+
+        f.seek(offset)
+        data = f.read(min(max_bytes, st.st_size - offset))
+
+    last_newline = data.rfind(b"\n")
+    if last_newline < 0:
+        return [], make_cursor(st.st_ino, offset), reset
+    data = data[:last_newline + 1]
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    if predicate:
+        lines = [line for line in lines if predicate(line)]
+    return lines, make_cursor(st.st_ino, offset + len(data)), reset
@@ -0,0 +1,212 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from core.log_reader import LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+
+# Structured fields copied from a record (via extra= or log_context) into the JSON line
+CONTEXT_FIELDS = ("task_id", "route", "file", "duration_ms", "errcode")
+
+DEFAULT_LEVELS = {
+    # httpx logs every request URL at INFO, access_token included
+    "httpx": "WARNING",
+    "httpcore": "WARNING",
+    "urllib3": "WARNING",
+}
+
+_context: contextvars.ContextVar = contextvars.ContextVar("log_context", default={})
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
+
+def new_task_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+def current_context() -> Dict[str, Any]:
+    return _context.get()
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach fields (task_id, route, file ...) to every record logged inside
+    the block, including from asyncio tasks and to_thread calls started in it.
+    """
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log_context onto the record. Runs in the calling thread, before queueing."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, plus any CONTEXT_FIELDS set on the record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() folds the traceback into msg; keep it in exc_text for the JSON "exc" field
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class ProcessSafeRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that several processes (uvicorn workers) can share.
+
+    Every write and rollover happens under an exclusive flock on
+    `<file>.lock`, so only one process rotates and lines never interleave.
+    A process whose open file was rotated away by another reopens the path
+    before writing instead of appending to the renamed backup. Without
+    fcntl (Windows) it behaves like RotatingFileHandler.
+    """
+
+    def __init__(self, filename: str, maxBytes: int = 0, backupCount: int = 0, encoding: Optional[str] = None):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self._lock_file = open(self.baseFilename + ".lock", "a") if fcntl else None
+
+    def emit(self, record: logging.LogRecord):
+        if self._lock_file is None:
+            super().emit(record)
+            return
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        except OSError:
+            self.handleError(record)
+            return
+        try:
+            self._reopen_if_rotated()
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = self._open()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            super().close()
+        finally:
+            self.release()
+
+
+def apply_levels(logging_conf: Optional[Dict[str, Any]] = None):
+    """Set the root level and per-module levels, e.g. {"level": "INFO", "levels": {"core.pipeline": "DEBUG"}}."""
+    logging_conf = logging_conf or {}
+    logging.getLogger().setLevel(str(logging_conf.get("level", "INFO")).upper())
+    for name, level in {**DEFAULT_LEVELS, **(logging_conf.get("levels") or {})}.items():
+        try:
+            logging.getLogger(name).setLevel(str(level).upper())
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring invalid log level {level!r} for {name}")
+
+
+def setup_logging(logging_conf: Optional[Dict[str, Any]] = None, log_file: str = LOG_FILE):
+    """
+    Route all logging through an in-memory queue.
+
+    Callers only enqueue the record; a single listener thread formats it
+    and writes it to the sinks (app.log as JSON lines with size-based
+    rotation, shared safely by all workers, and optionally stderr as plain
+    text). Request handlers and
+    delivery threads therefore never wait on disk. Safe to call again to
+    change levels; the sinks are only created once.
+    """
+    global _listener, _queue_handler
+    logging_conf = logging_conf or {}
+    if _listener is None:
+        sinks = []
+        file_handler = ProcessSafeRotatingFileHandler(
+            log_file, maxBytes=int(logging_conf.get("max_bytes", LOG_MAX_BYTES)),
+            backupCount=int(logging_conf.get("backup_count", LOG_BACKUP_COUNT)), encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        sinks.append(file_handler)
+        if logging_conf.get("console", True):
+            console = logging.StreamHandler(sys.stderr)
+            console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+            sinks.append(console)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        _queue_handler = _QueueHandler(log_queue)
+        _queue_handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+
+        _listener = QueueListener(log_queue, *sinks, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+    apply_levels(logging_conf)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
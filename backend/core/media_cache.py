@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from core.storage import STATE_DB, get_connection
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """Streaming SHA-256 of a file, read in fixed-size chunks."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class MediaCache:
+    """
+    Persistent map of file content -> WeCom temporary media_id.
+
+    media_ids are shared by all apps of a corp and stay valid for 3 days,
+    so entries are keyed by (corpid, sha256, filename) and expire a little
+    before WeCom drops them. The filename is part of the key because
+    recipients see the name the media was uploaded under. Content hashes
+    are themselves cached per (path, size, mtime) so unchanged files are
+    not re-read on every run.
+    Beyond expiry, the least recently used entries are evicted once the
+    cache holds more than max_entries.
+    """
+
+    MEDIA_TTL = 3 * 24 * 3600
+    # Stop reusing a media_id this long before WeCom expires it
+    EXPIRY_MARGIN = 3600
+
+    def __init__(self, db_path: str = STATE_DB, max_entries: int = 1000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._init_db()
+
+    def _init_db(self):
+        conn = get_connection(self.db_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS media_cache ("
+            " corpid TEXT NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " media_id TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (corpid, sha256, filename))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_media_cache_last_used ON media_cache (last_used)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL)"
+        )
+
+    def file_digest(self, file_path: str) -> str:
+        """SHA-256 of file_path, reusing the stored hash if size and mtime are unchanged."""
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        conn = get_connection(self.db_path)
+        row = conn.execute(
+            "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, st.st_size, st.st_mtime_ns)
+        ).fetchone()
+        if row:
+            return row[0]
+
+        digest = hash_file(path)
+        conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, digest)
+        )
+        return digest
+
+    def remember_digest(self, file_path: str, digest: str):
+        """Record a hash computed elsewhere (e.g. while the file was uploaded), so file_digest needn't re-read it."""
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        get_connection(self.db_path).execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, digest)
+        )
+
+    def get(self, corpid: str, digest: str, filename: str) -> Optional[str]:
+        now = time.time()
+        conn = get_connection(self.db_path)
+        row = conn.execute(
+            "SELECT media_id FROM media_cache"
+            " WHERE corpid = ? AND sha256 = ? AND filename = ? AND expires_at > ?",
+            (corpid, digest, filename, now)
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE media_cache SET last_used = ? WHERE corpid = ? AND sha256 = ? AND filename = ?",
+            (now, corpid, digest, filename)
+        )
+        return row[0]
+
+    def put(self, corpid: str, digest: str, filename: str, size: int, media_id: str):
+        now = time.time()
+        conn = get_connection(self.db_path)
+        conn.execute(
+            "INSERT OR REPLACE INTO media_cache (corpid, sha256, filename, size, media_id, expires_at, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (corpid, digest, filename, size, media_id, now + self.MEDIA_TTL - self.EXPIRY_MARGIN, now)
+        )
+        self.evict()
+
+    def invalidate_media(self, corpid: str, media_id: str):
+        """Forget a media_id WeCom no longer accepts."""
+        get_connection(self.db_path).execute(
+            "DELETE FROM media_cache WHERE corpid = ? AND media_id = ?", (corpid, media_id)
+        )
+
+    def evict(self):
+        conn = get_connection(self.db_path)
+        conn.execute("DELETE FROM media_cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM media_cache WHERE rowid IN ("
+            " SELECT rowid FROM media_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        conn.execute(
+            "DELETE FROM file_hashes WHERE rowid IN ("
+            " SELECT rowid FROM file_hashes ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+
+_default_cache: Optional[MediaCache] = None
+_default_lock = threading.Lock()
+
+
+def get_media_cache() -> MediaCache:
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = MediaCache()
+    return _default_cache
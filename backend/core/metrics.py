@@ -0,0 +1,78 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from core.log_setup import current_context
+
+# Metric label values come from the active log_context, so clients and
+# scanners get a route label without it being passed down explicitly.
+
+# With several uvicorn workers, point this at an empty directory before the
+# server starts: every process then records its samples there, and /metrics
+# answers with the sum over all of them whichever worker it reaches. Only the
+# leader runs jobs, so without it most workers would report zeros.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+SCAN_DURATION = Histogram(
+    "wecom_scan_duration_seconds", "Time to rescan a monitored folder", ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+TOKEN_FETCH_DURATION = Histogram(
+    "wecom_token_fetch_duration_seconds", "Latency of /gettoken calls", ["route"],
+)
+UPLOAD_BYTES = Histogram(
+    "wecom_upload_bytes", "Size of files uploaded to WeCom", ["route"],
+    buckets=(1024, 16 * 1024, 128 * 1024, 1024 ** 2, 4 * 1024 ** 2, 10 * 1024 ** 2, 20 * 1024 ** 2),
+)
+UPLOAD_DURATION = Histogram(
+    "wecom_upload_duration_seconds", "Time to upload one file, retries included", ["route"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+SEND_DURATION = Histogram(
+    "wecom_send_duration_seconds", "Latency of message/send, retries included", ["route"],
+)
+API_ERRORS = Counter(
+    "wecom_api_errors_total", "WeCom API calls answered with a non-zero errcode (or no answer)",
+    ["route", "endpoint", "errcode"],
+)
+DELIVERIES = Counter(
+    "wecom_deliveries_total", "Files delivered or failed", ["route", "status"],
+)
+JOB_DURATION = Histogram(
+    "wecom_job_duration_seconds", "Duration of delivery jobs", ["route", "state"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+# Gauges say how worker processes combine in multiprocess mode
+JOB_QUEUE_DEPTH = Gauge(
+    "wecom_job_queue_depth", "Delivery jobs per state", ["state"], multiprocess_mode="mostrecent",
+)
+SCHEDULER_LAG = Gauge(
+    "wecom_scheduler_lag_seconds", "Delay between a job's planned and actual fire time", ["job"],
+    multiprocess_mode="mostrecent",
+)
+
+LEADER = Gauge(
+    "wecom_leader", "Processes of this instance holding the lease (0 or 1)", ["lease"],
+    multiprocess_mode="livesum",
+)
+
+
+def route_label() -> str:
+    return str(current_context().get("route", ""))
+
+
+def render_metrics():
+    """(body, content_type) for the /metrics endpoint, aggregated over all workers in multiprocess mode."""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def release_process_metrics():
+    """On shutdown in multiprocess mode: drop this process's live gauges (e.g. wecom_leader)."""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
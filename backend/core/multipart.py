@@ -0,0 +1,116 @@
+import asyncio
+import mimetypes
+import os
+import uuid
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+CHUNK_SIZE = 256 * 1024
+
+# WeCom temporary media limits (bytes); every type must be larger than 5 bytes
+MEDIA_MIN_BYTES = 5
+MEDIA_MAX_BYTES = {
+    "image": 10 * 1024 * 1024,
+    "voice": 2 * 1024 * 1024,
+    "video": 10 * 1024 * 1024,
+    "file": 20 * 1024 * 1024,
+}
+MEDIA_EXTENSIONS = {
+    "image": {".jpg", ".jpeg", ".png"},
+    "voice": {".amr"},
+    "video": {".mp4"},
+}
+
+# (bytes_sent, total_bytes)
+ProgressCallback = Callable[[int, int], None]
+
+
+def check_media_file(file_path: str, media_type: str = "file") -> Optional[str]:
+    """Validate a file against WeCom's upload limits. Returns an error message, or None if it can be sent."""
+    try:
+        size = os.path.getsize(file_path)
+    except OSError as e:
+        return f"File not readable: {e}"
+    if size <= MEDIA_MIN_BYTES:
+        return f"File too small ({size} bytes), WeCom requires more than {MEDIA_MIN_BYTES} bytes"
+    limit = MEDIA_MAX_BYTES.get(media_type, MEDIA_MAX_BYTES["file"])
+    if size > limit:
+        return f"File too large ({size} bytes), WeCom {media_type} limit is {limit} bytes"
+    allowed = MEDIA_EXTENSIONS.get(media_type)
+    if allowed and os.path.splitext(file_path)[1].lower() not in allowed:
+        return f"Unsupported {media_type} type: {os.path.basename(file_path)}"
+    return None
+
+
+class MultipartFileEncoder:
+    """
+    multipart/form-data body for a single file field, produced in fixed-size
+    chunks so the file is never held in memory.
+
+    The total length is known up front, so the request carries a
+    Content-Length instead of being sent chunked. Pass the encoder itself
+    as the body for requests, or aiter_chunks() for httpx. Each instance
+    can be consumed once; build a new one per attempt.
+    """
+
+    def __init__(self, file_path: str, field_name: str = "media", filename: Optional[str] = None,
+                 chunk_size: int = CHUNK_SIZE, progress: Optional[ProgressCallback] = None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+        self.file_size = os.path.getsize(file_path)
+
+        filename = (filename or os.path.basename(file_path)).replace('"', '\\"')
+        mime = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"; '
+            f"filelength={self.file_size}\r\n"
+            f"Content-Type: {mime}\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self._head) + self.file_size + len(self._tail)
+
+    @property
+    def headers(self):
+        return {"Content-Type": self.content_type, "Content-Length": str(len(self))}
+
+    def _report(self, sent: int):
+        if self.progress:
+            self.progress(sent, self.file_size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        sent = 0
+        with open(self.file_path, "rb") as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                yield chunk
+                self._report(sent)
+        yield self._tail
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        yield self._head
+        sent = 0
+        f = await asyncio.to_thread(open, self.file_path, "rb")
+        try:
+            while True:
+                # Reads may hit a network share; keep them off the event loop
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                yield chunk
+                self._report(sent)
+        finally:
+            f.close()
+        yield self._tail
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from core.multipart import MEDIA_MAX_BYTES
+
+# Archives and volumes are built here (next to state.db) and removed once delivered
+STAGING_DIR = ".bundles"
+STALE_SECONDS = 24 * 3600
+DEFAULT_WORKERS = 2
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_MIN_FILES = 2
+# Largest file WeCom accepts as a "file" message
+VOLUME_BYTES = MEDIA_MAX_BYTES["file"]
+# Room for zip headers and for deflate growing incompressible data slightly
+ZIP_OVERHEAD_PER_FILE = 1024
+ZIP_GROWTH = 1.001
+COPY_BUFFER = 1024 * 1024
+# Already compressed; deflating them again costs time and saves nothing
+STORED_EXTENSIONS = {".zip", ".gz", ".7z", ".rar", ".jpg", ".jpeg", ".png", ".mp4", ".mp3", ".xz", ".bz2"}
+# Path separators, characters Windows rejects in file names, and control characters
+_UNSAFE_NAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def archive_stem(name: Optional[str]) -> str:
+    """A route name made safe to use as a file name: no directory parts, no hidden or empty names."""
+    stem = _UNSAFE_NAME_CHARS.sub("_", name or "").strip().lstrip(".")
+    return stem or "bundle"
+
+
+def build_zip(out_path: str, members: List[List[str]], level: int) -> int:
+    """
+    Write [path, arcname] members into a zip at out_path and return its size.
+    Runs in a worker process; zipfile reads and deflates each member in
+    chunks, so memory use does not grow with the input.
+    """
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=level) as zf:
+        for path, arcname in members:
+            stored = os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+            zf.write(path, arcname, compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    return os.path.getsize(out_path)
+
+
+def split_file(path: str, volume_bytes: int) -> List[str]:
+    """
+    Cut path into path.001, path.002, ... of at most volume_bytes each
+    (7-Zip opens them directly). The size is spread evenly over the
+    volumes, so the last one is never a sliver WeCom would reject as too
+    small.
+    """
+    size = os.path.getsize(path)
+    count = max(1, -(-size // volume_bytes))
+    base, extra = divmod(size, count)
+    volumes = []
+    with open(path, "rb") as src:
+        for number in range(1, count + 1):
+            volume = f"{path}.{number:03d}"
+            # The first `extra` volumes take one byte of the remainder each
+            per_volume = base + (1 if number <= extra else 0)
+            written = 0
+            with open(volume, "wb") as dst:
+                while written < per_volume:
+                    data = src.read(min(COPY_BUFFER, per_volume - written))
+                    if not data:
+                        break
+                    dst.write(data)
+                    written += len(data)
+            volumes.append(volume)
+    os.unlink(path)
+    return volumes
+
+
+class Package:
+    """What gets uploaded and sent for one or more source files."""
+
+    def __init__(self, sources: List[str], paths: List[str], staging: Optional[str] = None):
+        # Original files this package delivers (ledger rows)
+        self.sources = sources
+        # Files to upload and send, in order (one, or numbered volumes)
+        self.paths = paths
+        # Directory holding generated files, removed by cleanup()
+        self.staging = staging
+
+    @classmethod
+    def plain(cls, file_path: str) -> "Package":
+        return cls([file_path], [file_path])
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.paths[0]) if len(self.paths) == 1 else \
+            f"{os.path.basename(self.paths[0])[:-4]} ({len(self.paths)} volumes)"
+
+    def cleanup(self):
+        if self.staging:
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def plan_bundles(files: List[str], capacity: int) -> List[List[str]]:
+    """
+    Group files into bundles whose worst-case zip size fits capacity
+    (first-fit decreasing). Groups keep the input order of their files.
+    """
+    order = {path: i for i, path in enumerate(files)}
+    sizes = {path: _zip_estimate(path) for path in files}
+    bins: List[List[Any]] = []  # [remaining, [paths]]
+    for path in sorted(files, key=lambda p: -sizes[p]):
+        for entry in bins:
+            if sizes[path] <= entry[0]:
+                entry[0] -= sizes[path]
+                entry[1].append(path)
+                break
+        else:
+            bins.append([capacity - sizes[path], [path]])
+    return [sorted(paths, key=order.get) for _, paths in bins]
+
+
+def _zip_estimate(path: str) -> int:
+    return int(os.path.getsize(path) * ZIP_GROWTH) + ZIP_OVERHEAD_PER_FILE
+
+
+class Packager:
+    """
+    Turns a route's pending files into packages before upload.
+
+    With bundling on, files that fit are zipped together so N reports
+    cost one upload and one send instead of N of each. A file over
+    WeCom's size limit is zipped on its own and, if still too big, split
+    into numbered volumes. Archives are built in a process pool, so the
+    CPU-bound deflate never holds the GIL of the server process.
+    """
+
+    def __init__(self, staging_dir: str = STAGING_DIR, workers: int = DEFAULT_WORKERS,
+                 volume_bytes: int = VOLUME_BYTES):
+        self.staging_dir = staging_dir
+        self.workers = workers
+        self.volume_bytes = volume_bytes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._clean_stale()
+
+    def configure(self, workers: int):
+        with self._lock:
+            if workers == self.workers:
+                return
+            self.workers = workers
+            old, self._pool = self._pool, None
+        if old:
+            old.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: forking a process full of threads can leave locks held in the child
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    async def _run(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        try:
+            # Worker processes are started on submit
+            future = loop.run_in_executor(self._get_pool(), func, *args)
+        except (OSError, RuntimeError) as e:
+            return await self._run_in_thread(e, func, *args)
+        try:
+            return await future
+        except BrokenProcessPool as e:
+            return await self._run_in_thread(e, func, *args)
+
+    async def _run_in_thread(self, error: Exception, func: Callable, *args) -> Any:
+        # No usable worker processes (e.g. a sandbox that forbids them); zlib releases the GIL anyway
+        logging.warning(f"Packaging pool unavailable ({error}), packaging in a thread")
+        with self._lock:
+            self._pool = None
+        return await asyncio.to_thread(func, *args)
+
+    def _clean_stale(self):
+        """Remove staging directories left behind by a crash."""
+        try:
+            entries = list(os.scandir(self.staging_dir))
+        except OSError:
+            return
+        cutoff = time.time() - STALE_SECONDS
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _new_staging(self) -> str:
+        path = os.path.join(self.staging_dir, uuid.uuid4().hex)
+        os.makedirs(path)
+        return path
+
+    # --- planning and building ---
+
+    async def package(self, route: Dict[str, Any], files: List[str]) -> List[Package]:
+        """Packages covering every file in `files`, following the route's delivery settings."""
+        delivery_conf = route["delivery"]
+        split = delivery_conf.get("split_oversize", True)
+        level = delivery_conf.get("compression_level", DEFAULT_COMPRESSION_LEVEL)
+
+        plain, oversize = [], []
+        for path in files:
+            try:
+                too_big = os.path.getsize(path) > self.volume_bytes
+            except OSError:
+                too_big = False
+            (oversize if too_big and split else plain).append(path)
+
+        groups = [[path] for path in plain]
+        if delivery_conf.get("bundle", False) and \
+                len(plain) >= delivery_conf.get("bundle_min_files", DEFAULT_MIN_FILES):
+            groups = await asyncio.to_thread(plan_bundles, plain, self.volume_bytes)
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        bundles = [g for g in groups if len(g) > 1]
+        tasks = []
+        for i, group in enumerate(bundles):
+            suffix = f"-{i + 1}" if len(bundles) > 1 else ""
+            tasks.append(self._build(route, group, f"{archive_stem(route['name'])}_{stamp}{suffix}.zip", level))
+        for path in oversize:
+            tasks.append(self._build(route, [path], f"{os.path.basename(path)}.zip", level))
+
+        packages = [Package.plain(g[0]) for g in groups if len(g) == 1]
+        for built in await asyncio.gather(*tasks):
+            packages.extend(built)
+        return packages
+
+    async def _build(self, route: Dict[str, Any], sources: List[str], zip_name: str,
+                     level: int) -> List[Package]:
+        staging = None
+        try:
+            staging = await asyncio.to_thread(self._new_staging)
+            out_path = os.path.join(staging, zip_name)
+            members = [[path, _arcname(route["folder"], path)] for path in sources]
+            started = time.monotonic()
+            size = await self._run(build_zip, out_path, members, level)
+            paths = [out_path]
+            if size > self.volume_bytes:
+                paths = await self._run(split_file, out_path, self.volume_bytes)
+            logging.info(f"Packaged {len(sources)} file(s) into {zip_name} ({size} bytes, {len(paths)} part(s))",
+                         extra={"duration_ms": int((time.monotonic() - started) * 1000)})
+            return [Package(sources, paths, staging)]
+        except Exception as e:
+            logging.error(f"Packaging {zip_name} failed, sending the file(s) as they are: {e}")
+            if staging:
+                shutil.rmtree(staging, ignore_errors=True)
+            return [Package.plain(path) for path in sources]
+
+
+def _arcname(folder: str, path: str) -> str:
+    """Name inside the zip: the path below the route folder (keeps same-named files from subfolders apart)."""
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(folder or "."))
+    return os.path.basename(path) if rel.startswith("..") else rel
+
+
+_default_packager: Optional[Packager] = None
+_default_lock = threading.Lock()
+
+
+def get_packager() -> Packager:
+    global _default_packager
+    if _default_packager is None:
+        with _default_lock:
+            if _default_packager is None:
+                _default_packager = Packager()
+    return _default_packager
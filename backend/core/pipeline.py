@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from core.async_wecom_client import AsyncWeComClient, run_async
+from core.delivery_ledger import DeliveryLedger, get_delivery_ledger, recipients_key
+from core.file_scanner import DEFAULT_SCAN_WORKERS, FileScanner, TreeScanner
+from core.log_setup import log_context
+from core.metrics import DELIVERIES
+from core.packager import Package, get_packager
+
+DEFAULT_ROUTE = "default"
+
+
+class DeliveryError(Exception):
+    """Some files of a route run could not be delivered."""
+
+
+def resolve_routes(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Normalize the config into a list of routes.
+
+    Each entry of config["routes"] may override the top-level wecom and
+    delivery settings (corpid/secret/agentid, touser/toparty, catch_up ...).
+    A config without routes keeps working as a single "default" route built
+    from monitor_folder.
+    """
+    base_wecom = config.get("wecom", {})
+    base_delivery = config.get("delivery", {})
+    base_scan = config.get("scan", {})
+
+    raw_routes = config.get("routes") or []
+    if not raw_routes and config.get("monitor_folder"):
+        raw_routes = [{"name": DEFAULT_ROUTE, "folder": config.get("monitor_folder")}]
+
+    routes = []
+    for i, raw in enumerate(raw_routes):
+        if not raw.get("enabled", True) or not raw.get("folder"):
+            continue
+        wecom = {**base_wecom, **raw.get("wecom", {})}
+        for key in ("touser", "toparty"):
+            if key in raw:
+                wecom[key] = raw[key]
+        routes.append({
+            "name": raw.get("name") or f"route-{i + 1}",
+            "folder": raw.get("folder"),
+            "file_pattern": raw.get("file_pattern", "*"),
+            "wecom": wecom,
+            "delivery": {**base_delivery, **raw.get("delivery", {})},
+            # {recursive, include, exclude, max_depth, max_age_days, workers}
+            "scan": {**base_scan, **raw.get("scan", {})},
+            # Optional {cron, timezone, catch_up, enabled}; without a cron the route follows the global schedule
+            "schedule": raw.get("schedule") or {},
+        })
+    return routes
+
+
+def find_route(config: Dict[str, Any], name: Optional[str]) -> Optional[Dict[str, Any]]:
+    routes = resolve_routes(config)
+    if not name:
+        return routes[0] if routes else None
+    return next((r for r in routes if r["name"] == name), None)
+
+
+def route_recipients(route: Dict[str, Any]) -> str:
+    wecom_conf = route["wecom"]
+    return recipients_key(wecom_conf.get("touser", "@all"), wecom_conf.get("toparty", ""))
+
+
+def make_tree_scanner(route: Dict[str, Any]) -> TreeScanner:
+    """Recursive scanner for a route with scan.recursive set; include defaults to the route's file_pattern."""
+    scan_conf = route.get("scan") or {}
+    max_age_days = scan_conf.get("max_age_days")
+    return TreeScanner(
+        route["folder"],
+        include=scan_conf.get("include") or [route["file_pattern"]],
+        exclude=scan_conf.get("exclude"),
+        max_depth=scan_conf.get("max_depth"),
+        max_age_seconds=max_age_days * 86400 if max_age_days else None,
+        workers=scan_conf.get("workers") or DEFAULT_SCAN_WORKERS,
+    )
+
+
+def make_client(route: Dict[str, Any]) -> AsyncWeComClient:
+    wecom_conf = route["wecom"]
+    return AsyncWeComClient(
+        corpid=wecom_conf.get("corpid"),
+        secret=wecom_conf.get("secret"),
+        agentid=wecom_conf.get("agentid")
+    )
+
+
+class DeliveryPipeline:
+    """
+    Scans a route's folder and delivers its pending files.
+
+    run_job is called by the job queue worker that claimed the route's job,
+    so routes run in parallel and a hung network share or a failing corp
+    only holds up its own route; the queue runs at most one job per route
+    at a time. Within a route, files are uploaded and sent concurrently on
+    a fresh event loop.
+    """
+
+    def __init__(self, ledger: Optional[DeliveryLedger] = None):
+        self.ledger = ledger or get_delivery_ledger()
+
+    def pending_files(self, route: Dict[str, Any]) -> List[str]:
+        """Files that still need delivering on this route, oldest first."""
+        delivery_conf = route["delivery"]
+        recipients = route_recipients(route)
+        folder = route["folder"]
+        pattern = route["file_pattern"]
+
+        tree = make_tree_scanner(route) if (route.get("scan") or {}).get("recursive") else None
+        candidates = []
+        if delivery_conf.get("catch_up", False):
+            # Everything newer than the last file that went out on this route
+            since = self.ledger.last_sent_mtime(route["name"], recipients)
+            if since is not None:
+                if tree:
+                    candidates = [path for _, path in sorted(tree.walk(since))]
+                else:
+                    candidates = FileScanner.get_index(folder, pattern).files_since(since)
+        if not candidates:
+            if tree:
+                latest_file = next(tree.latest(1), None)
+            else:
+                latest_file = FileScanner.get_latest_file(folder, pattern)
+            candidates = [latest_file] if latest_file else []
+
+        if delivery_conf.get("skip_delivered", True):
+            candidates = [f for f in candidates if not self.ledger.is_delivered(route["name"], f, recipients)]
+        return candidates
+
+    async def deliver_package_async(self, client: AsyncWeComClient, route: Dict[str, Any],
+                                    package: Package) -> bool:
+        """Upload and send a package (a file, a bundle or volumes); its source files share the outcome."""
+        name = package.name
+        # Each gathered coroutine runs in its own task, so the file field stays per-package
+        with log_context(file=name):
+            try:
+                return await self._deliver_package_async(client, route, package, name)
+            finally:
+                await asyncio.to_thread(package.cleanup)
+
+    async def _deliver_package_async(self, client: AsyncWeComClient, route: Dict[str, Any],
+                                     package: Package, name: str) -> bool:
+        wecom_conf = route["wecom"]
+        started = time.monotonic()
+
+        def begin() -> List[int]:
+            return [self.ledger.begin(route["name"], source, route_recipients(route),
+                                      client.media_cache.file_digest(source))
+                    for source in package.sources]
+
+        # Hashing and ledger writes (which may wait on another process's state.db lock) stay off the event loop
+        try:
+            delivery_ids = await asyncio.to_thread(begin)
+        except OSError as e:
+            logging.error(f"[{route['name']}] 文件读取失败: {e}")
+            return False
+
+        def record(success: bool, media_id: Optional[str], error: Optional[str]):
+            for delivery_id in delivery_ids:
+                if success:
+                    self.ledger.mark_sent(delivery_id, media_id, note=error)
+                else:
+                    self.ledger.mark_failed(delivery_id, error)
+
+        async def finish(success: bool, media_id: Optional[str] = None, error: Optional[str] = None):
+            DELIVERIES.labels(route=route["name"], status="sent" if success else "failed").inc(len(delivery_ids))
+            await asyncio.to_thread(record, success, media_id, error)
+
+        # Upload (volumes together, so nothing is sent unless every part made it)
+        media_ids = await asyncio.gather(*(client.upload_media(path, use_cache=not package.staging)
+                                           for path in package.paths))
+        if not all(media_ids):
+            logging.error(f"[{route['name']}] 文件上传失败: {name}")
+            await finish(False, error="upload failed")
+            return False
+
+        # Send, volumes in order
+        success = True
+        result = None
+        for media_id in media_ids:
+            result = await client.send_file_fanout(
+                media_id=media_id,
+                touser=wecom_conf.get("touser", "@all"),
+                toparty=wecom_conf.get("toparty", "")
+            )
+            success = result.ok
+            if not success:
+                break
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        if success and not result.delivered:
+            # Every recipient is invalid: retrying cannot help, so the file counts as done
+            invalid = result.invalid_summary()
+            logging.error(f"[{route['name']}] 接收人全部无效，文件未送达任何人: {name} ({invalid})",
+                          extra={"duration_ms": duration_ms})
+            await finish(True, media_id=",".join(media_ids), error=f"no valid recipients ({invalid})")
+        elif success:
+            covered = f" (含 {len(package.sources)} 个文件)" if len(package.sources) > 1 else ""
+            logging.info(f"[{route['name']}] 文件发送成功: {name}{covered}", extra={"duration_ms": duration_ms})
+            await finish(True, media_id=",".join(media_ids), error=result.invalid_summary())
+        else:
+            logging.error(f"[{route['name']}] 消息发送失败: {name}", extra={"duration_ms": duration_ms})
+            await finish(False, error="send failed")
+        return success
+
+    async def deliver_files_async(self, route: Dict[str, Any], files: List[str]) -> List[bool]:
+        # The client's semaphore bounds requests in flight
+        started = time.monotonic()
+        client = make_client(route)
+        packages = await get_packager().package(route, files)
+        outcomes = await asyncio.gather(*(self.deliver_package_async(client, route, p) for p in packages))
+        delivered = {source: ok for package, ok in zip(packages, outcomes) for source in package.sources}
+        results = [delivered.get(f, False) for f in files]
+        logging.info(f"[{route['name']}] 执行完成: 成功 {sum(results)} / {len(results)}",
+                     extra={"duration_ms": int((time.monotonic() - started) * 1000)})
+        return results
+
+    def run_job(self, route: Dict[str, Any], file_path: Optional[str] = None) -> Dict[str, int]:
+        """
+        Job queue entry point: deliver the route's pending files, or just
+        file_path. Returns {"pending", "sent"}; raises DeliveryError if any
+        file failed, so the job is retried (already delivered files are
+        skipped on the next attempt when skip_delivered is on).
+        """
+        if file_path:
+            files = [file_path]
+            if route["delivery"].get("skip_delivered", True) and \
+                    self.ledger.is_delivered(route["name"], file_path, route_recipients(route)):
+                logging.info(f"[{route['name']}] 文件已发送过，跳过: {os.path.basename(file_path)}")
+                files = []
+        else:
+            files = self.pending_files(route)
+            if files:
+                logging.info(f"[{route['name']}] 找到待发送文件 {len(files)} 个: "
+                             f"{', '.join(os.path.basename(f) for f in files)}")
+            else:
+                logging.info(f"[{route['name']}] 未找到需要发送的新文件")
+        if not files:
+            return {"pending": 0, "sent": 0}
+
+        sent = sum(run_async(self.deliver_files_async(route, files)))
+        if sent < len(files):
+            raise DeliveryError(f"{len(files) - sent} / {len(files)} files failed")
+        return {"pending": len(files), "sent": sent}
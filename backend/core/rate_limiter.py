@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# Requests per second (sustained rate, burst capacity) per corp and endpoint.
+# WeCom allows 10k calls/min per API per corp; stay below that with headroom,
+# and keep gettoken low since tokens are cached anyway.
+DEFAULT_ENDPOINT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "gettoken": (1.0, 5),
+    "media/upload": (20.0, 20),
+    "message/send": (50.0, 50),
+}
+DEFAULT_ENDPOINT_LIMIT = (50.0, 50)
+# Across all endpoints of one corp
+DEFAULT_CORP_LIMIT = (120.0, 120)
+
+
+class TokenBucket:
+    """Classic token bucket. Thread-safe; acquire() reserves a token and returns how long to wait for it."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take tokens (possibly going negative) and return the seconds until they are actually available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def deposit(self, tokens: float):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+
+class RateLimiter:
+    """
+    Token buckets per (corpid, endpoint) and per corpid.
+
+    A call waits for both its endpoint bucket and its corp bucket, so bursts
+    run at the allowed rate instead of tripping 45009/45033 on WeCom's side.
+    """
+
+    def __init__(self, endpoint_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 corp_limit: Tuple[float, float] = DEFAULT_CORP_LIMIT):
+        self.endpoint_limits = dict(endpoint_limits or DEFAULT_ENDPOINT_LIMITS)
+        self.corp_limit = corp_limit
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, endpoint_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                  corp_limit: Optional[Tuple[float, float]] = None):
+        with self._lock:
+            if endpoint_limits:
+                self.endpoint_limits.update(endpoint_limits)
+            if corp_limit:
+                self.corp_limit = corp_limit
+            self._buckets.clear()
+
+    def _bucket(self, corpid: str, endpoint: str) -> TokenBucket:
+        key = (corpid or "", endpoint)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    if endpoint == "*":
+                        rate, capacity = self.corp_limit
+                    else:
+                        rate, capacity = self.endpoint_limits.get(endpoint, DEFAULT_ENDPOINT_LIMIT)
+                    bucket = self._buckets[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def _reserve(self, corpid: str, endpoint: str) -> float:
+        return max(self._bucket(corpid, endpoint).reserve(), self._bucket(corpid, "*").reserve())
+
+    def acquire(self, corpid: str, endpoint: str):
+        delay = self._reserve(corpid, endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, corpid: str, endpoint: str):
+        delay = self._reserve(corpid, endpoint)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_default_limiter: Optional[RateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _default_limiter
+    if _default_limiter is None:
+        with _default_lock:
+            if _default_limiter is None:
+                _default_limiter = RateLimiter()
+    return _default_limiter
@@ -0,0 +1,81 @@
+import random
+import threading
+from typing import Optional
+
+from core.rate_limiter import TokenBucket
+
+# errcode classification
+OK = "ok"
+RETRYABLE = "retryable"
+TOKEN_EXPIRED = "token_expired"
+FATAL = "fatal"
+
+# -1: system busy; 45009: API call frequency exceeded; 45033: too many
+# concurrent calls; 45011: API call too frequent; 45047: too many calls in
+# progress for this user
+RETRYABLE_ERRCODES = {-1, 45009, 45011, 45033, 45047}
+# 40014: invalid access_token; 42001: access_token expired;
+# 40082: invalid suite_token (stale token from another app)
+TOKEN_ERRCODES = {40014, 42001, 40082}
+
+
+def classify_errcode(errcode: Optional[int]) -> str:
+    if errcode == 0:
+        return OK
+    if errcode in TOKEN_ERRCODES:
+        return TOKEN_EXPIRED
+    if errcode in RETRYABLE_ERRCODES:
+        return RETRYABLE
+    return FATAL
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of overall traffic.
+
+    Every first attempt deposits `ratio` tokens and every retry withdraws
+    one, so during an outage retries cannot multiply load beyond roughly
+    (1 + ratio) times the normal request rate. min_retries per second keeps
+    a trickle of retries available when traffic is low.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_sec: float = 1.0, capacity: float = 20):
+        self.ratio = ratio
+        self._bucket = TokenBucket(min_retries_per_sec, capacity)
+
+    def record_request(self):
+        self._bucket.deposit(self.ratio)
+
+    def can_retry(self) -> bool:
+        return self._bucket.try_acquire(1.0)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by max_attempts and a shared retry budget."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0,
+                 budget: Optional[RetryBudget] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or get_retry_budget()
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number `attempt` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts and self.budget.can_retry()
+
+
+_default_budget: Optional[RetryBudget] = None
+_default_lock = threading.Lock()
+
+
+def get_retry_budget() -> RetryBudget:
+    global _default_budget
+    if _default_budget is None:
+        with _default_lock:
+            if _default_budget is None:
+                _default_budget = RetryBudget()
+    return _default_budget
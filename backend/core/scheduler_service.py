@@ -1,63 +1,239 @@
-import schedule
-import time
-import threading
-from typing import Callable
+import heapq
+import itertools
 import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.cron import CronExpression, get_timezone
+from core.metrics import SCHEDULER_LAG
+from core.storage import STATE_DB, get_connection
+
+# What to do with occurrences missed while the process was down or asleep
+CATCH_UP_SKIP = "skip"  # drop them, wait for the next one
+CATCH_UP_ONCE = "once"  # run once for all of them
+CATCH_UP_ALL = "all"  # run once over everything missed: the job's func is called with backlog=True
+CATCH_UP_POLICIES = (CATCH_UP_SKIP, CATCH_UP_ONCE, CATCH_UP_ALL)
+
+# A run this late still counts as on time under the "skip" policy
+MISFIRE_GRACE_SECONDS = 60
+# Missed occurrences counted for the catch-up log line
+MAX_MISSED_COUNTED = 24
+# Re-check the wall clock at least this often, in case it was adjusted
+MAX_SLEEP_SECONDS = 3600
+
+
+class ScheduledJob:
+    def __init__(self, name: str, cron: str, func: Callable[[], Any], timezone: Optional[str] = None,
+                 catch_up: str = CATCH_UP_SKIP):
+        self.name = name
+        self.cron = CronExpression(cron)
+        self.timezone = timezone or None
+        self.tz = get_timezone(timezone)
+        self.func = func
+        self.catch_up = catch_up if catch_up in CATCH_UP_POLICIES else CATCH_UP_SKIP
+        self.next_run: Optional[float] = None
+        # Heap entries carrying an older seq belong to a replaced version of this job
+        self.seq = 0
+
+    @property
+    def spec(self) -> str:
+        return f"{self.cron.expr}|{self.timezone or ''}"
+
+    def same_schedule(self, other: "ScheduledJob") -> bool:
+        return self.spec == other.spec and self.catch_up == other.catch_up
+
+    def next_run_datetime(self) -> Optional[datetime]:
+        if self.next_run is None:
+            return None
+        if self.tz is None:
+            return datetime.fromtimestamp(self.next_run).astimezone()
+        return datetime.fromtimestamp(self.next_run, self.tz)
 
-# Configure logging
-logging.basicConfig(
-    filename='app.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 
 class SchedulerService:
-    def __init__(self):
+    """
+    Runs named cron jobs on a single thread.
+
+    Next fire times live in a heap and the thread sleeps on a condition
+    until the nearest one, so an idle scheduler does not wake up at all
+    between runs (other than a clock re-check once an hour). Adding,
+    changing or removing a job only touches that job. The last fire time
+    of each job is kept in state.db, so occurrences missed while the
+    process was down are handled by the job's catch-up policy on restart.
+    Job functions should be quick (e.g. enqueue work); they run on the
+    scheduler thread. A catch-up under the "all" policy calls the function
+    as func(backlog=True), so it can cover every missed occurrence in one run.
+    """
+
+    def __init__(self, db_path: str = STATE_DB):
+        self.db_path = db_path
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
         self._stop_event = threading.Event()
-        self._thread = None
-        self._job = None
+        self._thread: Optional[threading.Thread] = None
+        self._init_db()
+
+    def _init_db(self):
+        get_connection(self.db_path).execute(
+            "CREATE TABLE IF NOT EXISTS scheduled_runs ("
+            " name TEXT PRIMARY KEY,"
+            " spec TEXT NOT NULL,"
+            " last_fire REAL NOT NULL)"
+        )
+
+    # --- jobs ---
+
+    def add_job(self, name: str, cron: str, func: Callable[[], Any], timezone: Optional[str] = None,
+                catch_up: str = CATCH_UP_SKIP) -> ScheduledJob:
+        """Add or replace one job. An unchanged schedule keeps its pending fire time."""
+        job = ScheduledJob(name, cron, func, timezone, catch_up)
+        with self._cond:
+            existing = self._jobs.get(name)
+            if existing and existing.same_schedule(job):
+                existing.func = func
+                return existing
+            job.next_run = self._first_run(job)
+            job.seq = next(self._counter)
+            self._jobs[name] = job
+            heapq.heappush(self._heap, (job.next_run, job.seq, name))
+            self._cond.notify()
+        logging.info(f"Scheduled job {name}: '{job.cron.expr}' ({job.timezone or 'local time'}), "
+                     f"next run {job.next_run_datetime()}")
+        return job
+
+    def remove_job(self, name: str):
+        with self._cond:
+            # Its heap entry is skipped when it comes up
+            if self._jobs.pop(name, None):
+                logging.info(f"Removed scheduled job {name}")
+
+    def set_jobs(self, specs: Dict[str, Dict[str, Any]]):
+        """
+        Make the job set equal to `specs` ({name: {cron, func, timezone, catch_up}}),
+        adding, replacing and removing only what differs.
+        """
+        for name in list(self._jobs):
+            if name not in specs:
+                self.remove_job(name)
+        for name, spec in specs.items():
+            try:
+                self.add_job(name, spec["cron"], spec["func"], spec.get("timezone"),
+                             spec.get("catch_up", CATCH_UP_SKIP))
+            except ValueError as e:
+                logging.error(f"Invalid schedule for {name}: {e}")
+                self.remove_job(name)
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [{"name": job.name, "cron": job.cron.expr, "timezone": job.timezone,
+                     "catch_up": job.catch_up, "next_run": job.next_run_datetime()}
+                    for job in self._jobs.values()]
+
+    def get_next_run(self, name: Optional[str] = None) -> Optional[datetime]:
+        with self._cond:
+            jobs = [self._jobs[name]] if name in self._jobs else ([] if name else list(self._jobs.values()))
+            pending = [job for job in jobs if job.next_run is not None]
+            if not pending:
+                return None
+            return min(pending, key=lambda job: job.next_run).next_run_datetime()
+
+    def _first_run(self, job: ScheduledJob) -> float:
+        """Next fire time for a newly added job, picking up from its last recorded run if the schedule is unchanged."""
+        now = time.time()
+        row = get_connection(self.db_path).execute(
+            "SELECT spec, last_fire FROM scheduled_runs WHERE name = ?", (job.name,)
+        ).fetchone()
+        if row and row[0] == job.spec and job.catch_up != CATCH_UP_SKIP:
+            # May lie in the past; the loop then applies the catch-up policy
+            return job.cron.next_after(row[1], job.tz)
+        return job.cron.next_after(now, job.tz)
+
+    def _record_fire(self, job: ScheduledJob, fire_ts: float):
+        get_connection(self.db_path).execute(
+            "INSERT INTO scheduled_runs (name, spec, last_fire) VALUES (?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET spec = excluded.spec, last_fire = excluded.last_fire",
+            (job.name, job.spec, fire_ts)
+        )
+
+    # --- thread ---
 
     def start(self):
         if self._thread and self._thread.is_alive():
             return
-        
+
         self._stop_event.clear()
-        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread = threading.Thread(target=self._run_loop, name="scheduler", daemon=True)
         self._thread.start()
         logging.info("Scheduler started")
 
     def stop(self):
         self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
         if self._thread:
             self._thread.join(timeout=2)
         logging.info("Scheduler stopped")
 
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
     def _run_loop(self):
         while not self._stop_event.is_set():
-            schedule.run_pending()
-            time.sleep(1)
-
-    def update_job(self, time_str: str, frequency: str, task_func: Callable):
-        schedule.clear()
-        self._job = None
-        
-        if frequency == 'daily':
-            # time_str should be HH:MM
-            self._job = schedule.every().day.at(time_str).do(task_func)
-            logging.info(f"Scheduled daily job at {time_str}")
-        elif frequency == 'hourly':
-             # For demo/testing, interprets time_str as minutes past the hour if needed, 
-             # but here we simplify to just "every hour" or custom interval if complex.
-             # For MVP, let's assume 'hourly' means every hour.
-             self._job = schedule.every().hour.do(task_func)
-             logging.info("Scheduled hourly job")
-        
-        # Add more logic as needed for other frequencies
-
-    def get_next_run(self):
-        if self._job:
-            return self._job.next_run
+            with self._cond:
+                due = self._pop_due()
+                if due is None:
+                    timeout = MAX_SLEEP_SECONDS
+                    if self._heap:
+                        timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+                    self._cond.wait(timeout)
+                    continue
+                job, fire_ts = due
+                SCHEDULER_LAG.labels(job=job.name).set(max(0.0, time.time() - fire_ts))
+                run, backlog = self._runs_for(job, fire_ts)
+                job.next_run = job.cron.next_after(max(fire_ts, time.time()), job.tz)
+                heapq.heappush(self._heap, (job.next_run, job.seq, job.name))
+
+            # Outside the lock: job functions may call back into the scheduler
+            if run:
+                try:
+                    if backlog:
+                        job.func(backlog=True)
+                    else:
+                        job.func()
+                except Exception as e:
+                    logging.error(f"Scheduled job {job.name} failed: {e}")
+            try:
+                self._record_fire(job, fire_ts)
+            except Exception as e:
+                logging.error(f"Error recording run of {job.name}: {e}")
+
+    def _pop_due(self) -> Optional[tuple]:
+        """Remove and return (job, fire_ts) for the earliest due entry, discarding stale ones."""
+        now = time.time()
+        while self._heap:
+            fire_ts, seq, name = self._heap[0]
+            job = self._jobs.get(name)
+            if job is None or job.seq != seq:
+                heapq.heappop(self._heap)
+                continue
+            if fire_ts > now:
+                return None
+            heapq.heappop(self._heap)
+            return job, fire_ts
         return None
 
-    def is_running(self):
-        return self._thread is not None and self._thread.is_alive()
+    def _runs_for(self, job: ScheduledJob, fire_ts: float) -> Tuple[bool, bool]:
+        """(run, backlog) for a job whose occurrence at fire_ts is now due."""
+        now = time.time()
+        if now - fire_ts <= MISFIRE_GRACE_SECONDS:
+            return True, False
+        missed = 1 + len(job.cron.occurrences(fire_ts, now, job.tz, limit=MAX_MISSED_COUNTED))
+        if job.catch_up == CATCH_UP_SKIP:
+            logging.warning(f"Scheduled job {job.name} missed {missed} run(s), skipping")
+            return False, False
+        logging.info(f"Scheduled job {job.name} missed {missed} run(s), catching up ({job.catch_up})")
+        return True, job.catch_up == CATCH_UP_ALL
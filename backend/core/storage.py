@@ -0,0 +1,31 @@
+import sqlite3
+import threading
+from typing import Dict
+
+# Shared SQLite file for small pieces of durable state (token cache, ...).
+# Lives next to config.json, in the working directory of the backend.
+STATE_DB = "state.db"
+
+_local = threading.local()
+
+
+def get_connection(db_path: str = STATE_DB) -> sqlite3.Connection:
+    """
+    Return this thread's connection to db_path.
+
+    Connections run in autocommit mode; callers that need atomicity issue
+    BEGIN IMMEDIATE themselves. WAL lets readers proceed while another
+    process holds the write lock, and busy_timeout makes writers queue up
+    instead of failing with "database is locked".
+    """
+    conns: Dict[str, sqlite3.Connection] = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conns[db_path] = conn
+    return conn
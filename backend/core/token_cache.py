@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from core.storage import STATE_DB, get_connection
+
+# A fetcher calls /gettoken and returns (access_token, expires_in) or None.
+TokenFetcher = Callable[[], Optional[Tuple[str, int]]]
+
+
+class TokenCache:
+    """
+    access_token cache keyed by (corpid, secret), shared by every WeComClient
+    in the process and, through SQLite, by every worker process.
+
+    Refreshes are single-flight: threads in one process serialize on a
+    per-key lock, and processes on a short-lived claim row. The claim is
+    committed before /gettoken is called and the token stored in a second
+    short transaction, so the shared state.db write lock is never held
+    across the network call. Other processes wait for the claimant's
+    token (or keep using a token that is still valid). A background thread
+    renews tokens shortly before they expire so callers normally never
+    wait on a refresh.
+    """
+
+    # Treat tokens as expired this many seconds early
+    EXPIRY_MARGIN = 300
+    # Background refresh kicks in this many seconds before EXPIRY_MARGIN
+    PROACTIVE_WINDOW = 300
+    # A claim outlives the slowest /gettoken (timeouts and retries); a crashed claimant blocks no longer
+    CLAIM_SECONDS = 120
+    CLAIM_POLL_SECONDS = 0.2
+
+    def __init__(self, db_path: str = STATE_DB):
+        self.db_path = db_path
+        self._owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._memory: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._fetchers: Dict[str, TokenFetcher] = {}
+        self._wakeup = threading.Event()
+        self._refresher = None
+        self._init_db()
+
+    def _init_db(self):
+        get_connection(self.db_path).execute(
+            "CREATE TABLE IF NOT EXISTS access_tokens ("
+            " cache_key TEXT PRIMARY KEY,"
+            " access_token TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        get_connection(self.db_path).execute(
+            "CREATE TABLE IF NOT EXISTS token_refresh_claims ("
+            " cache_key TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def cache_key(corpid: str, secret: str) -> str:
+        # Never persist the raw secret
+        digest = hashlib.sha256((secret or "").encode("utf-8")).hexdigest()[:16]
+        return f"{corpid}:{digest}"
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _fresh(self, entry: Optional[Tuple[str, float]], margin: float) -> Optional[str]:
+        if entry and time.time() < entry[1] - margin:
+            return entry[0]
+        return None
+
+    def _read(self, key: str) -> Optional[Tuple[str, float]]:
+        row = get_connection(self.db_path).execute(
+            "SELECT access_token, expires_at FROM access_tokens WHERE cache_key = ?", (key,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def peek(self, corpid: str, secret: str) -> Optional[str]:
+        """In-memory lookup only; never blocks on disk or network."""
+        return self._fresh(self._memory.get(self.cache_key(corpid, secret)), self.EXPIRY_MARGIN)
+
+    def get_token(self, corpid: str, secret: str, fetch: TokenFetcher) -> Optional[str]:
+        key = self.cache_key(corpid, secret)
+        self._register(key, fetch)
+
+        token = self._fresh(self._memory.get(key), self.EXPIRY_MARGIN)
+        if token:
+            return token
+        return self._refresh(key, fetch, self.EXPIRY_MARGIN)
+
+    def _refresh(self, key: str, fetch: TokenFetcher, margin: float) -> Optional[str]:
+        with self._lock_for(key):
+            while True:
+                # Another thread or process may have refreshed while we waited
+                entry = self._read(key)
+                token = self._fresh(entry, margin)
+                if token:
+                    self._memory[key] = entry
+                    return token
+                if self._claim(key):
+                    break
+                # Another process is calling /gettoken; a token that still works beats waiting for it
+                token = self._fresh(entry, 0)
+                if token:
+                    return token
+                time.sleep(self.CLAIM_POLL_SECONDS)
+
+            try:
+                result = fetch()
+            except Exception:
+                self._release_claim(key)
+                raise
+            if not result:
+                self._release_claim(key)
+                return self._fresh(entry, 0)
+            token, expires_in = result
+            entry = (token, time.time() + expires_in)
+            conn = get_connection(self.db_path)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO access_tokens (cache_key, access_token, expires_at) VALUES (?, ?, ?)",
+                    (key, entry[0], entry[1])
+                )
+                conn.execute("DELETE FROM token_refresh_claims WHERE cache_key = ? AND owner = ?", (key, self._owner))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._memory[key] = entry
+            self._wakeup.set()
+            return token
+
+    def _claim(self, key: str) -> bool:
+        """Become the process that refreshes key, unless another one holds an unexpired claim."""
+        now = time.time()
+        conn = get_connection(self.db_path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires_at FROM token_refresh_claims WHERE cache_key = ?",
+                               (key,)).fetchone()
+            if row and row[0] != self._owner and row[1] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute("INSERT OR REPLACE INTO token_refresh_claims (cache_key, owner, expires_at) VALUES (?, ?, ?)",
+                         (key, self._owner, now + self.CLAIM_SECONDS))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _release_claim(self, key: str):
+        get_connection(self.db_path).execute("DELETE FROM token_refresh_claims WHERE cache_key = ? AND owner = ?",
+                                             (key, self._owner))
+
+    def invalidate(self, corpid: str, secret: str, token: Optional[str] = None):
+        """Drop a cached token, e.g. after WeCom reports it expired. Only drops `token` if given."""
+        key = self.cache_key(corpid, secret)
+        with self._lock_for(key):
+            entry = self._memory.get(key)
+            if token is None or (entry and entry[0] == token):
+                self._memory.pop(key, None)
+            conn = get_connection(self.db_path)
+            if token is None:
+                conn.execute("DELETE FROM access_tokens WHERE cache_key = ?", (key,))
+            else:
+                conn.execute("DELETE FROM access_tokens WHERE cache_key = ? AND access_token = ?", (key, token))
+
+    # --- background refresh ---
+
+    def _register(self, key: str, fetch: TokenFetcher):
+        self._fetchers[key] = fetch
+        if self._refresher is None or not self._refresher.is_alive():
+            with self._locks_guard:
+                if self._refresher is None or not self._refresher.is_alive():
+                    self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+                    self._refresher.start()
+
+    def _refresh_loop(self):
+        margin = self.EXPIRY_MARGIN + self.PROACTIVE_WINDOW
+        while True:
+            next_due = None
+            for key, fetch in list(self._fetchers.items()):
+                entry = self._memory.get(key) or self._read(key)
+                due = (entry[1] - margin) if entry else 0
+                if due <= time.time():
+                    try:
+                        self._refresh(key, fetch, margin)
+                    except Exception as e:
+                        logging.error(f"Error refreshing access token: {e}")
+                    entry = self._memory.get(key)
+                    due = (entry[1] - margin) if entry else 0
+                    if due <= time.time():
+                        # Refresh failed; keep serving the old token and try again later
+                        due = time.time() + 60
+                    else:
+                        logging.info(f"Proactively refreshed access token for {key.split(':')[0]}")
+                next_due = due if next_due is None else min(next_due, due)
+
+            timeout = None if next_due is None else max(1.0, next_due - time.time())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+_default_cache: Optional[TokenCache] = None
+_default_lock = threading.Lock()
+
+
+def get_token_cache() -> TokenCache:
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = TokenCache()
+    return _default_cache
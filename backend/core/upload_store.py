@@ -0,0 +1,274 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from core.media_cache import get_media_cache, hash_file
+from core.storage import STATE_DB, get_connection
+
+# Partial files live in a hidden directory inside the target folder, so the final
+# rename stays on one filesystem and scanners/watchers (which skip dot names) ignore them
+STAGING_DIR = ".uploads"
+UPLOAD_MAX_BYTES = 512 * 1024 * 1024
+# Bytes buffered before each write; request bodies arrive in much smaller pieces
+WRITE_BUFFER = 1024 * 1024
+# Unfinished resumable uploads are discarded after this long without progress
+UPLOAD_EXPIRY_SECONDS = 24 * 3600
+
+
+class UploadError(Exception):
+    """An upload request that must be rejected; status is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def safe_filename(filename: Optional[str]) -> str:
+    """The bare file name, without any client-supplied directory parts."""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if not name or name in (".", "..") or name.startswith("."):
+        raise UploadError(f"Invalid file name: {filename!r}")
+    return name
+
+
+def _staging_dir(folder: str) -> str:
+    path = os.path.join(folder, STAGING_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _fsync_file(path: str):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+class _HashState:
+    """Incremental hash of a part file, valid while `offset` matches the file's length."""
+
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+
+
+class UploadStore:
+    """
+    Uploads into route folders without exposing half-written files.
+
+    Data is streamed to a part file under <folder>/.uploads, hashed on the
+    way, and renamed over the final path only when complete. Resumable
+    uploads (create / append at an offset / commit) keep their state in
+    state.db and the part file on disk, so an interrupted transfer resumes
+    from the last byte written, even after a restart.
+    """
+
+    def __init__(self, db_path: str = STATE_DB, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._hashes: Dict[str, _HashState] = {}
+        self._busy: Set[str] = set()
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self):
+        get_connection(self.db_path).execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " id TEXT PRIMARY KEY,"
+            " filename TEXT NOT NULL,"
+            " folder TEXT NOT NULL,"
+            " route TEXT,"
+            " size INTEGER NOT NULL,"
+            " sha256 TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+
+    # --- one-shot ---
+
+    async def save_stream(self, folder: str, filename: str, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Stream chunks into folder/filename via a part file. Returns {filename, path, size, sha256}."""
+        filename = safe_filename(filename)
+        part_path = os.path.join(await asyncio.to_thread(_staging_dir, folder), f"{uuid.uuid4().hex}.part")
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with await asyncio.to_thread(open, part_path, "wb") as f:
+                async for data in _buffered(chunks):
+                    size += len(data)
+                    if size > self.max_bytes:
+                        raise UploadError(f"File exceeds the {self.max_bytes} byte upload limit", status=413)
+                    hasher.update(data)
+                    await asyncio.to_thread(f.write, data)
+            return await asyncio.to_thread(self._publish, part_path, folder, filename, hasher.hexdigest())
+        finally:
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+
+    def _publish(self, part_path: str, folder: str, filename: str, sha256: str) -> Dict[str, Any]:
+        _fsync_file(part_path)
+        final_path = os.path.join(folder, filename)
+        os.replace(part_path, final_path)
+        try:
+            get_media_cache().remember_digest(final_path, sha256)
+        except Exception as e:
+            logging.warning(f"Could not record hash of {filename}: {e}")
+        return {"filename": filename, "path": os.path.abspath(final_path),
+                "size": os.path.getsize(final_path), "sha256": sha256}
+
+    # --- resumable ---
+
+    def create(self, folder: str, filename: str, size: int, route: Optional[str] = None,
+               sha256: Optional[str] = None) -> Dict[str, Any]:
+        filename = safe_filename(filename)
+        if size < 0 or size > self.max_bytes:
+            raise UploadError(f"File exceeds the {self.max_bytes} byte upload limit", status=413)
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        open(self._part_path(folder, upload_id), "wb").close()
+        now = time.time()
+        get_connection(self.db_path).execute(
+            "INSERT INTO uploads (id, filename, folder, route, size, sha256, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (upload_id, filename, os.path.abspath(folder), route, size, sha256.lower() if sha256 else None, now, now)
+        )
+        with self._lock:
+            self._hashes[upload_id] = _HashState()
+        return self.get(upload_id)
+
+    def get(self, upload_id: str) -> Dict[str, Any]:
+        row = get_connection(self.db_path).execute(
+            "SELECT id, filename, folder, route, size, sha256, created_at, updated_at FROM uploads WHERE id = ?",
+            (upload_id,)
+        ).fetchone()
+        if not row:
+            raise UploadError("Upload not found", status=404)
+        upload = dict(zip(("upload_id", "filename", "folder", "route", "size", "sha256",
+                           "created_at", "updated_at"), row))
+        try:
+            upload["offset"] = os.path.getsize(self._part_path(upload["folder"], upload_id))
+        except OSError:
+            raise UploadError("Upload data is gone; start again", status=410)
+        return upload
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Write chunks at `offset`, which must equal the bytes already received
+        (409 with the current offset otherwise). Data the client sends past
+        the declared size is rejected.
+        """
+        with self._lock:
+            if upload_id in self._busy:
+                raise UploadError("Another append is in progress", status=409)
+            self._busy.add(upload_id)
+        try:
+            upload = await asyncio.to_thread(self.get, upload_id)
+            if offset != upload["offset"]:
+                raise UploadError("Offset mismatch", status=409, offset=upload["offset"])
+
+            with self._lock:
+                state = self._hashes.get(upload_id)
+            if state is not None and state.offset != offset:
+                # Lost track (e.g. after a restart); commit will hash the file from disk
+                state = None
+            position = offset
+            part_path = self._part_path(upload["folder"], upload_id)
+            try:
+                with await asyncio.to_thread(open, part_path, "r+b") as f:
+                    f.seek(offset)
+                    async for data in _buffered(chunks):
+                        if position + len(data) > upload["size"]:
+                            raise UploadError("Data beyond the declared size", status=413,
+                                              offset=position)
+                        await asyncio.to_thread(f.write, data)
+                        position += len(data)
+                        if state is not None:
+                            state.hasher.update(data)
+                            state.offset = position
+            finally:
+                # Whatever reached the disk counts; the client resumes from there
+                get_connection(self.db_path).execute(
+                    "UPDATE uploads SET updated_at = ? WHERE id = ?", (time.time(), upload_id))
+                with self._lock:
+                    if state is None:
+                        self._hashes.pop(upload_id, None)
+            return await asyncio.to_thread(self.get, upload_id)
+        finally:
+            with self._lock:
+                self._busy.discard(upload_id)
+
+    def commit(self, upload_id: str) -> Dict[str, Any]:
+        """Verify length (and sha256, if declared) and move the file into the route folder."""
+        upload = self.get(upload_id)
+        if upload["offset"] != upload["size"]:
+            raise UploadError(f"Upload incomplete: {upload['offset']} of {upload['size']} bytes",
+                              status=409, offset=upload["offset"])
+        part_path = self._part_path(upload["folder"], upload_id)
+        with self._lock:
+            state = self._hashes.get(upload_id)
+        digest = state.hasher.hexdigest() if state and state.offset == upload["size"] else hash_file(part_path)
+        if upload["sha256"] and digest != upload["sha256"]:
+            self.abort(upload_id)
+            raise UploadError("Checksum mismatch; upload discarded", status=422)
+
+        result = self._publish(part_path, upload["folder"], upload["filename"], digest)
+        self._forget(upload_id)
+        return {**result, "route": upload["route"]}
+
+    def abort(self, upload_id: str):
+        upload = self.get(upload_id)
+        try:
+            os.unlink(self._part_path(upload["folder"], upload_id))
+        except OSError:
+            pass
+        self._forget(upload_id)
+
+    def expire(self):
+        """Drop resumable uploads that made no progress within UPLOAD_EXPIRY_SECONDS."""
+        conn = get_connection(self.db_path)
+        rows = conn.execute("SELECT id, folder FROM uploads WHERE updated_at < ?",
+                            (time.time() - UPLOAD_EXPIRY_SECONDS,)).fetchall()
+        for upload_id, folder in rows:
+            try:
+                os.unlink(self._part_path(folder, upload_id))
+            except OSError:
+                pass
+            self._forget(upload_id)
+
+    def _forget(self, upload_id: str):
+        get_connection(self.db_path).execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+
+    @staticmethod
+    def _part_path(folder: str, upload_id: str) -> str:
+        return os.path.join(_staging_dir(folder), f"{upload_id}.part")
+
+
+async def _buffered(chunks: AsyncIterator[bytes], size: int = WRITE_BUFFER) -> AsyncIterator[bytes]:
+    """Coalesce small body chunks into writes of about `size` bytes."""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+_default_store: Optional[UploadStore] = None
+_default_lock = threading.Lock()
+
+
+def get_upload_store() -> UploadStore:
+    global _default_store
+    if _default_store is None:
+        with _default_lock:
+            if _default_store is None:
+                _default_store = UploadStore()
+    return _default_store
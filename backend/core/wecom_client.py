@@ -1,81 +1,218 @@
-import requests
+import contextvars
 import time
 import os
 import logging
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Any, Callable, Optional, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+from core.http_session import get_session, UPLOAD_TIMEOUT
+from core.token_cache import TokenCache, get_token_cache
+from core.media_cache import MediaCache, get_media_cache
+from core.rate_limiter import RateLimiter, get_rate_limiter
+from core.multipart import MultipartFileEncoder, ProgressCallback, check_media_file
+from core.fanout import FANOUT_WORKERS, FanoutResult, chunk_recipients, invalid_ids, split_ids
+from core.retry_policy import RetryPolicy, classify_errcode, OK, RETRYABLE, TOKEN_EXPIRED
+from core.metrics import API_ERRORS, SEND_DURATION, TOKEN_FETCH_DURATION, UPLOAD_BYTES, UPLOAD_DURATION, route_label
+
+ERRCODE_INVALID_MEDIA_ID = 40007
 
 class WeComClient:
     BASE_URL = "https://qyapi.weixin.qq.com/cgi-bin"
 
-    def __init__(self, corpid: str, secret: str, agentid: str):
+    def __init__(self, corpid: str, secret: str, agentid: str, token_cache: Optional[TokenCache] = None,
+                 media_cache: Optional[MediaCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
         self.corpid = corpid
         self.secret = secret
         self.agentid = agentid
-        self._access_token = None
-        self._token_expires_at = 0
+        # Tokens are shared across instances and worker processes
+        self.token_cache = token_cache or get_token_cache()
+        self.media_cache = media_cache or get_media_cache()
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    @property
+    def session(self) -> "requests.Session":
+        # All instances share one pooled keep-alive session, built on first use
+        return get_session()
 
     def _get_access_token(self) -> Optional[str]:
-        if self._access_token and time.time() < self._token_expires_at:
-            return self._access_token
+        return self.token_cache.get_token(self.corpid, self.secret, self._fetch_access_token)
 
+    def _fetch_access_token(self) -> Optional[Tuple[str, int]]:
+        """Call /gettoken. Returns (access_token, expires_in) or None."""
         url = f"{self.BASE_URL}/gettoken"
         params = {
             "corpid": self.corpid,
             "corpsecret": self.secret
         }
-        try:
-            response = requests.get(url, params=params)
-            data = response.json()
-            if data.get("errcode") == 0:
-                self._access_token = data.get("access_token")
-                # Expire 5 minutes early to be safe
-                self._token_expires_at = time.time() + data.get("expires_in", 7200) - 300
-                return self._access_token
-            else:
-                logging.error(f"Failed to get token: {data}")
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.acquire(self.corpid, "gettoken")
+            try:
+                with TOKEN_FETCH_DURATION.labels(route=route_label()).time():
+                    response = self.session.get(url, params=params)
+                data = response.json()
+            except Exception as e:
+                API_ERRORS.labels(route=route_label(), endpoint="gettoken", errcode="network").inc()
+                logging.error(f"Error getting token: {e}")
                 return None
-        except Exception as e:
-            logging.error(f"Error getting token: {e}")
+            if data.get("errcode") == 0:
+                return data.get("access_token"), data.get("expires_in", 7200)
+            API_ERRORS.labels(route=route_label(), endpoint="gettoken", errcode=str(data.get("errcode"))).inc()
+            if classify_errcode(data.get("errcode")) == RETRYABLE and self.retry_policy.should_retry(attempt):
+                time.sleep(self.retry_policy.backoff(attempt))
+                continue
+            logging.error(f"Failed to get token: {data}", extra={"errcode": data.get("errcode")})
             return None
 
-    def upload_media(self, file_path: str) -> Optional[str]:
-        """Upload file and return media_id"""
-        token = self._get_access_token()
-        if not token:
-            return None
+    def _request(self, endpoint: str, do_request: Callable[[str], "requests.Response"],
+                 retry_network_errors: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Rate-limited, retrying call to a token-authenticated endpoint.
 
-        url = f"{self.BASE_URL}/media/upload"
-        params = {
-            "access_token": token,
-            "type": "file"
-        }
-        
+        do_request(access_token) performs one HTTP attempt. Throttling errcodes
+        are retried with backoff, an expired token is refreshed and the call
+        repeated once, anything else is returned to the caller as-is. Returns
+        the response JSON, or None if no response could be obtained.
+        """
+        import requests
+
+        attempt = 0
+        token_refreshed = False
+        self.retry_policy.budget.record_request()
+        while True:
+            attempt += 1
+            token = self._get_access_token()
+            if not token:
+                return None
+
+            self.rate_limiter.acquire(self.corpid, endpoint)
+            try:
+                data = do_request(token).json()
+            except (requests.RequestException, ValueError) as e:
+                API_ERRORS.labels(route=route_label(), endpoint=endpoint, errcode="network").inc()
+                if retry_network_errors and self.retry_policy.should_retry(attempt):
+                    logging.warning(f"{endpoint} request failed ({e}), retrying")
+                    time.sleep(self.retry_policy.backoff(attempt))
+                    continue
+                logging.error(f"Error calling {endpoint}: {e}")
+                return None
+
+            kind = classify_errcode(data.get("errcode"))
+            if kind == OK:
+                return data
+            API_ERRORS.labels(route=route_label(), endpoint=endpoint, errcode=str(data.get("errcode"))).inc()
+            if kind == TOKEN_EXPIRED and not token_refreshed:
+                logging.warning(f"{endpoint}: access token rejected ({data.get('errcode')}), refreshing",
+                                extra={"errcode": data.get("errcode")})
+                self.token_cache.invalidate(self.corpid, self.secret, token)
+                token_refreshed = True
+                continue
+            if kind == RETRYABLE and self.retry_policy.should_retry(attempt):
+                delay = self.retry_policy.backoff(attempt)
+                logging.warning(f"{endpoint} throttled ({data.get('errcode')}), retrying in {delay:.1f}s",
+                                extra={"errcode": data.get("errcode")})
+                time.sleep(delay)
+                continue
+            return data
+
+    def upload_media(self, file_path: str, use_cache: bool = True,
+                     progress: Optional[ProgressCallback] = None) -> Optional[str]:
+        """
+        Upload file and return media_id. Identical content uploaded within the last 3 days is reused.
+        The body is streamed from disk; progress(bytes_sent, total) is called as chunks go out.
+        """
         if not os.path.exists(file_path):
             logging.error(f"File not found: {file_path}")
             return None
 
+        # Fail fast before any bytes are sent
+        error = check_media_file(file_path)
+        if error:
+            logging.error(f"Cannot upload {os.path.basename(file_path)}: {error}")
+            return None
+
+        digest = None
+        filename = os.path.basename(file_path)
+        if use_cache:
+            try:
+                digest = self.media_cache.file_digest(file_path)
+                media_id = self.media_cache.get(self.corpid, digest, filename)
+                if media_id:
+                    logging.info(f"Reusing cached media_id for {filename}")
+                    return media_id
+            except Exception as e:
+                logging.warning(f"Media cache unavailable: {e}")
+                digest = None
+
+        url = f"{self.BASE_URL}/media/upload"
+
+        def do_upload(token: str) -> "requests.Response":
+            params = {
+                "access_token": token,
+                "type": "file"
+            }
+            body = MultipartFileEncoder(file_path, progress=progress)
+            return self.session.post(url, params=params, data=body, headers=body.headers, timeout=UPLOAD_TIMEOUT)
+
         try:
-            with open(file_path, 'rb') as f:
-                files = {'media': f}
-                response = requests.post(url, params=params, files=files)
-                data = response.json()
-                if data.get("errcode") == 0:
-                    return data.get("media_id")
-                else:
-                    logging.error(f"Failed to upload media: {data}")
-                    return None
-        except Exception as e:
+            # A repeated upload only leaves an unused media_id behind, so network errors are retried
+            with UPLOAD_DURATION.labels(route=route_label()).time():
+                data = self._request("media/upload", do_upload)
+        except OSError as e:
             logging.error(f"Error uploading media: {e}")
             return None
+        if data is None:
+            return None
+        if data.get("errcode") == 0:
+            media_id = data.get("media_id")
+            UPLOAD_BYTES.labels(route=route_label()).observe(os.path.getsize(file_path))
+            if digest:
+                self.media_cache.put(self.corpid, digest, filename, os.path.getsize(file_path), media_id)
+            return media_id
+        else:
+            logging.error(f"Failed to upload media: {data}", extra={"errcode": data.get("errcode")})
+            return None
 
     def send_file_message(self, media_id: str, touser: str = "@all", toparty: str = "") -> bool:
-        token = self._get_access_token()
-        if not token:
-            return False
+        return self.send_file_fanout(media_id, touser, toparty).ok
+
+    def send_file_fanout(self, media_id: str, touser: str = "@all", toparty: str = "") -> FanoutResult:
+        """
+        Send one uploaded file to any number of recipients. The list is split
+        into calls of at most 1000 users / 100 parties, sent concurrently;
+        a call rejected for invalid IDs is repeated once without them.
+        """
+        chunks = chunk_recipients(touser, toparty)
+        result = FanoutResult(len(chunks))
+        if len(chunks) == 1:
+            self._send_chunk(media_id, chunks[0][0], chunks[0][1], result)
+        else:
+            # Each chunk keeps the caller's log context (task_id, route)
+            contexts = [contextvars.copy_context() for _ in chunks]
+            with ThreadPoolExecutor(max_workers=min(FANOUT_WORKERS, len(chunks)),
+                                    thread_name_prefix="fanout") as pool:
+                list(pool.map(lambda chunk, ctx: ctx.run(self._send_chunk, media_id, chunk[0], chunk[1], result),
+                              chunks, contexts))
+        result.log()
+        return result
 
+    def _send_chunk(self, media_id: str, touser: str, toparty: str, result: FanoutResult):
+        data = self._send_once(media_id, touser, toparty)
+        retry = result.record(touser, toparty, data, retry_allowed=True)
+        if retry:
+            logging.warning(f"Resending to {len(split_ids(retry[0]))} user(s) / {len(split_ids(retry[1]))} "
+                            f"party(ies) without the invalid IDs", extra={"errcode": data.get("errcode")})
+            result.record(retry[0], retry[1], self._send_once(media_id, *retry), retry_allowed=False)
+
+    def _send_once(self, media_id: str, touser: str, toparty: str) -> Optional[Dict[str, Any]]:
         url = f"{self.BASE_URL}/message/send"
-        params = {"access_token": token}
-        
+
         payload = {
             "touser": touser,
             "toparty": toparty,
@@ -87,14 +224,16 @@ class WeComClient:
             "safe": 0
         }
 
-        try:
-            response = requests.post(url, params=params, json=payload)
-            data = response.json()
-            if data.get("errcode") == 0:
-                return True
-            else:
-                logging.error(f"Failed to send message: {data}")
-                return False
-        except Exception as e:
-            logging.error(f"Error sending message: {e}")
-            return False
+        def do_send(token: str) -> "requests.Response":
+            return self.session.post(url, params={"access_token": token}, json=payload)
+
+        # A send that timed out may still have been delivered; don't risk a duplicate
+        with SEND_DURATION.labels(route=route_label()).time():
+            data = self._request("message/send", do_send, retry_network_errors=False)
+        if data is not None and data.get("errcode") != 0:
+            if data.get("errcode") == ERRCODE_INVALID_MEDIA_ID:
+                self.media_cache.invalidate_media(self.corpid, media_id)
+            if not any(invalid_ids(data)):
+                logging.error(f"Failed to send message: {data}", extra={"errcode": data.get("errcode")})
+        return data
+
@@ -1,31 +1,52 @@
-from fastapi import FastAPI, HTTPException, Response, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+import asyncio
+import json
 import logging
 import os
-import shutil
-from typing import Optional, Dict, Any
-
-from wechatpy.utils import check_signature
-from wechatpy.exceptions import InvalidSignatureException
-from wechatpy.enterprise.crypto import WeChatCrypto
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple
 
 from core.config_manager import ConfigManager
-from core.file_scanner import FileScanner
-from core.wecom_client import WeComClient
-from core.scheduler_service import SchedulerService
-
-# Setup Logging
-logging.basicConfig(
-    filename='app.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+from core.callback_service import CallbackError, CallbackService, get_callback_service
+from core.async_wecom_client import close_async_http_client
+from core.scheduler_service import SchedulerService, CATCH_UP_SKIP
+from core.cron import legacy_cron
+from core.folder_watcher import FolderWatcher
+from core.http_session import close_session
+from core.rate_limiter import get_rate_limiter
+from core.pipeline import DeliveryPipeline, resolve_routes, find_route
+from core.packager import DEFAULT_WORKERS as DEFAULT_PACKAGING_WORKERS, get_packager
+from core.upload_store import UploadError, UploadStore, UPLOAD_MAX_BYTES, get_upload_store
+from core.leader import LeaderElection, DEFAULT_LEASE_SECONDS, DEFAULT_RENEW_SECONDS
+from core.job_queue import (JobQueue, FatalJobError, BACKLOG_TRIGGER, DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_DELAY,
+                             DEFAULT_WORKERS, JOB_STATES)
+from core.metrics import JOB_QUEUE_DEPTH, release_process_metrics, render_metrics
+from core.http_cache import (SelectiveGZipMiddleware, VersionProbe, cache_headers, conditional_json,
+                             etag_matches, make_etag)
+from core.log_reader import LOG_FILE, tail_lines, read_since, parse_record, format_record, make_filter
+from core.log_setup import setup_logging, shutdown_logging, apply_levels
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_services()
+    init_scheduler()
+    # Elects right away when no other instance holds the lease
+    leader.start()
+    try:
+        yield
+    finally:
+        await shutdown_services()
 
 app = FastAPI(
     title="企业微信文件自动发送系统",
     version="1.0.0",
-    description="自动监控指定文件夹，并将最新文件通过企业微信发送给指定用户。"
+    description="自动监控指定文件夹，并将最新文件通过企业微信发送给指定用户。",
+    lifespan=lifespan
 )
 
 # CORS
@@ -35,96 +56,304 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the dashboard read ETags for its long-poll of /api/status
+    expose_headers=["ETag"],
 )
+# Compress larger JSON (config, logs, jobs); never the SSE log stream
+app.add_middleware(SelectiveGZipMiddleware, exclude_paths=("/api/logs/stream",))
 
-config_manager = ConfigManager()
-scheduler = SchedulerService()
+# Created by init_services() when the app starts, so importing this module
+# (uvicorn workers, bench, tooling) reads no config and opens no database
+config_manager: Optional[ConfigManager] = None
+scheduler: Optional[SchedulerService] = None
+pipeline: Optional[DeliveryPipeline] = None
+job_queue: Optional[JobQueue] = None
+leader: Optional[LeaderElection] = None
+callback_service: Optional[CallbackService] = None
+upload_store: Optional[UploadStore] = None
+watchers: Dict[str, FolderWatcher] = {}
+# Chunk size for reading uploads and suggested to resumable clients
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
 # --- Task Logic ---
-def execute_task():
-    logging.info("任务开始执行")
-    config = config_manager.load_config()
-    
-    monitor_folder = config.get("monitor_folder")
-    if not monitor_folder:
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job queue handler; re-resolves the route so config edits apply to queued jobs."""
+    route = find_route(config_manager.load_config(), job["route"])
+    if not route:
+        raise FatalJobError(f"Route not found: {job['route']}")
+    if job["trigger"] == BACKLOG_TRIGGER:
+        # Catching up on missed schedule runs: everything since the last success, not just the newest file
+        route = {**route, "delivery": {**route["delivery"], "catch_up": True}}
+    logging.info(f"[{route['name']}] 任务开始执行 (#{job['id']}, {job['trigger']}, 第 {job['attempts']} 次)")
+    return pipeline.run_job(route, job["file"])
+
+def enqueue_routes(trigger: str, route_name: Optional[str] = None) -> List[int]:
+    """Queue a run of every route (or just route_name). Returns the job ids."""
+    routes = resolve_routes(config_manager.load_config())
+    if route_name:
+        routes = [r for r in routes if r["name"] == route_name]
+    if not routes:
         logging.error("未配置监控文件夹")
-        return
+        return []
+    return [job_queue.enqueue(route["name"], trigger) for route in routes]
 
-    # 1. Scan
-    latest_file = FileScanner.get_latest_file(monitor_folder)
-    if not latest_file:
-        logging.info("未找到可发送的文件")
-        return
-    
-    logging.info(f"找到最新文件: {latest_file}")
-
-    # 2. WeCom Init
-    wecom_conf = config.get("wecom", {})
-    client = WeComClient(
-        corpid=wecom_conf.get("corpid"),
-        secret=wecom_conf.get("secret"),
-        agentid=wecom_conf.get("agentid")
-    )
+def has_own_schedule(route: Dict[str, Any]) -> bool:
+    return bool(route["schedule"].get("cron"))
 
-    # 3. Upload
-    media_id = client.upload_media(latest_file)
-    if not media_id:
-        logging.error("文件上传失败")
-        return
-    
-    # 4. Send
-    success = client.send_file_message(
-        media_id=media_id,
-        touser=wecom_conf.get("touser", "@all"),
-        toparty=wecom_conf.get("toparty", "")
-    )
+def schedule_trigger(backlog: bool) -> str:
+    return BACKLOG_TRIGGER if backlog else "schedule"
+
+def execute_task(backlog: bool = False):
+    """Global schedule: queue every route that has no schedule of its own."""
+    for route in resolve_routes(config_manager.load_config()):
+        if not has_own_schedule(route):
+            job_queue.enqueue(route["name"], schedule_trigger(backlog))
+
+def schedule_jobs(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Scheduler jobs for the config: one global job plus one per route with its own cron."""
+    sched_conf = config.get("schedule", {})
+    timezone = sched_conf.get("timezone")
+    catch_up = sched_conf.get("catch_up", CATCH_UP_SKIP)
+    routes = resolve_routes(config)
+
+    jobs = {}
+    for route in routes:
+        route_sched = route["schedule"]
+        if has_own_schedule(route) and route_sched.get("enabled", True):
+            jobs[f"route:{route['name']}"] = {
+                "cron": route_sched["cron"],
+                "timezone": route_sched.get("timezone", timezone),
+                "catch_up": route_sched.get("catch_up", catch_up),
+                "func": lambda backlog=False, name=route["name"]: job_queue.enqueue(name, schedule_trigger(backlog)),
+            }
 
-    if success:
-        logging.info(f"文件发送成功: {os.path.basename(latest_file)}")
+    if sched_conf.get("frequency") == "cron":
+        cron = sched_conf.get("cron")
     else:
-        logging.error("消息发送失败")
+        cron = legacy_cron(sched_conf.get("frequency", "daily"), sched_conf.get("time", "09:00"))
+    if cron and any(not has_own_schedule(r) for r in routes):
+        jobs["default"] = {"cron": cron, "timezone": timezone, "catch_up": catch_up, "func": execute_task}
+    return jobs
+
+def stop_watchers():
+    for watcher in watchers.values():
+        watcher.stop()
+    watchers.clear()
+
+def start_watchers(config: Dict[str, Any]):
+    """Event-driven mode: deliver files as soon as they land instead of on a timer."""
+    sched_conf = config.get("schedule", {})
+    for route in resolve_routes(config):
+        if not os.path.isdir(route["folder"]):
+            logging.error(f"[{route['name']}] 实时监控启动失败: 监控文件夹不存在")
+            continue
+        watcher = FolderWatcher(
+            route["folder"],
+            on_file=lambda path, name=route["name"]: on_watched_file(name, path),
+            file_pattern=route["file_pattern"],
+            settle_seconds=sched_conf.get("settle_seconds", 0.5),
+            poll_interval=sched_conf.get("poll_interval", 5)
+        )
+        watcher.start()
+        watchers[route["name"]] = watcher
+
+def on_watched_file(route_name: str, file_path: str):
+    logging.info(f"[{route_name}] 监控到新文件: {file_path}")
+    # Re-resolve so config edits (recipients, corp) apply without restarting the watcher
+    job_queue.enqueue(route_name, "watch", file=os.path.abspath(file_path))
+
+def on_callback_event(message):
+    logging.info(f"收到企业微信回调: {message.type} (来自 {getattr(message, 'source', '')})")
 
 # Initialize Scheduler based on config
 def init_scheduler():
-    config = config_manager.load_config()
-    sched_conf = config.get("schedule", {})
-    if sched_conf.get("enabled"):
-        scheduler.update_job(
-            time_str=sched_conf.get("time", "09:00"),
-            frequency=sched_conf.get("frequency", "daily"),
-            task_func=execute_task
+    """Apply the config; on the leader, also (re)build the schedules and watchers."""
+    global applied_config_version
+    with scheduler_lock:
+        config = config_manager.load_config()
+        applied_config_version = config_manager.version
+        apply_config(config)
+        if leader.is_leader:
+            start_scheduling(config)
+
+def apply_config(config: Dict[str, Any]):
+    """Settings every instance uses, leader or not."""
+    apply_levels(config.get("logging"))
+    upload_store.max_bytes = config.get("upload", {}).get("max_bytes", UPLOAD_MAX_BYTES)
+    delivery_conf = config.get("delivery", {})
+    job_queue.configure(
+        workers=delivery_conf.get("route_workers", DEFAULT_WORKERS),
+        max_attempts=delivery_conf.get("max_attempts", DEFAULT_MAX_ATTEMPTS),
+        retry_delay=delivery_conf.get("retry_delay", DEFAULT_RETRY_DELAY)
+    )
+    get_packager().configure(delivery_conf.get("packaging_workers", DEFAULT_PACKAGING_WORKERS))
+    rate_conf = config.get("rate_limits", {})
+    if rate_conf:
+        get_rate_limiter().configure(
+            endpoint_limits={k: tuple(v) for k, v in rate_conf.get("endpoints", {}).items()},
+            corp_limit=tuple(rate_conf["corp"]) if rate_conf.get("corp") else None
         )
-        scheduler.start()
-    else:
+
+def start_scheduling(config: Dict[str, Any]):
+    sched_conf = config.get("schedule", {})
+    stop_watchers()
+    if not sched_conf.get("enabled"):
+        scheduler.set_jobs({})
         scheduler.stop()
+        return
 
-# Start scheduler on app startup
-@app.on_event("startup")
-async def startup_event():
-    init_scheduler()
+    if sched_conf.get("frequency") == "watch":
+        scheduler.set_jobs({})
+        scheduler.stop()
+        start_watchers(config)
+    else:
+        # Only jobs whose schedule changed are reset
+        scheduler.set_jobs(schedule_jobs(config))
+        scheduler.start()
 
-@app.on_event("shutdown")
-async def shutdown_event():
+def stop_scheduling():
     scheduler.stop()
+    stop_watchers()
+
+# --- Leader election ---
+# Every process (uvicorn worker or container) serves HTTP and may enqueue jobs, but
+# only the holder of the "scheduler" lease in state.db fires schedules, runs
+# watchers and works the job queue, so recipients never get a file twice.
+scheduler_lock = threading.RLock()
+applied_config_version = 0
+
+def on_elected():
+    logging.info("本实例成为主节点，开始调度和投递")
+    init_scheduler()
+    # Queues again the jobs of instances that died mid-job
+    job_queue.start()
+
+def on_demoted():
+    logging.info("本实例不再是主节点，停止调度和投递")
+    with scheduler_lock:
+        stop_scheduling()
+        job_queue.stop()
+
+def on_lease_renewed():
+    # A former leader may die while finishing its jobs; pick them up once its heartbeat stops
+    job_queue.adopt_orphans()
+    # Jobs enqueued by other instances don't notify our workers
+    job_queue.wake()
+    # The config may have been saved through another instance
+    config_manager.load_config()
+    if config_manager.version != applied_config_version:
+        logging.info("配置已被其他实例修改，重新加载调度")
+        init_scheduler()
+
+# --- Lifecycle ---
+def init_services():
+    global config_manager, scheduler, pipeline, job_queue, leader, callback_service, upload_store
+    config_manager = ConfigManager()
+    # Records are queued and written by a background thread (JSON lines in app.log)
+    setup_logging(config_manager.get("logging"))
+    scheduler = SchedulerService()
+    pipeline = DeliveryPipeline()
+    job_queue = JobQueue(run_job)
+    leader_conf = config_manager.get("leader", {})
+    leader = LeaderElection(
+        "scheduler",
+        lease_seconds=leader_conf.get("lease_seconds", DEFAULT_LEASE_SECONDS),
+        renew_seconds=leader_conf.get("renew_seconds", DEFAULT_RENEW_SECONDS),
+        on_elected=on_elected,
+        on_demoted=on_demoted,
+        on_renewed=on_lease_renewed
+    )
+    callback_service = get_callback_service()
+    callback_service.add_handler(on_callback_event)
+    upload_store = get_upload_store()
+
+async def shutdown_services():
+    # Stops scheduling and the job queue, then frees the lease for another instance
+    leader.stop()
+    get_packager().shutdown()
+    close_session()
+    await close_async_http_client()
+    callback_service.stop()
+    release_process_metrics()
+    shutdown_logging()
 
 # --- Models ---
 class ConfigModel(BaseModel):
-    monitor_folder: str
+    monitor_folder: str = ""
     wecom: Dict[str, Any]
     schedule: Dict[str, Any]
+    delivery: Dict[str, Any] = {}
+    routes: List[Dict[str, Any]] = []
+    rate_limits: Dict[str, Any] = {}
+    upload: Dict[str, Any] = {}
+    scan: Dict[str, Any] = {}
+    logging: Dict[str, Any] = {}
+    leader: Dict[str, Any] = {}
 
 # --- Endpoints ---
 
-@app.get("/api/status")
-def get_status():
+# Long-polls of /api/status wait at most this long, re-checking the state every interval
+STATUS_WAIT_MAX = 60
+STATUS_POLL_INTERVAL = 1.0
+
+def status_body() -> Dict[str, Any]:
+    scheduler_running = scheduler.is_running()
+    next_run = scheduler.get_next_run() if scheduler_running else None
+    running_watchers = [w for w in watchers.values() if w.is_running()]
+    holder = leader.holder()
     return {
-        "running": scheduler.is_running(),
-        "next_run": str(scheduler.get_next_run()) if scheduler.get_next_run() else None
+        "running": scheduler_running or bool(running_watchers),
+        "next_run": next_run.isoformat() if next_run else None,
+        "watch_mode": running_watchers[0].mode if running_watchers else None,
+        "jobs": job_queue.counts(),
+        "leader": {"is_leader": leader.is_leader, "instance": leader.owner,
+                   "holder": {"owner": holder["owner"], "acquired_at": holder["acquired_at"]} if holder else None}
     }
 
+def status_snapshot() -> Tuple[str, Dict[str, Any]]:
+    """(ETag, body) of /api/status; the tag hashes the body, so every instance agrees on it."""
+    body = status_body()
+    return make_etag("status", body), body
+
+status_probe = VersionProbe(status_snapshot, STATUS_POLL_INTERVAL)
+
+@app.get("/api/status")
+async def get_status(request: Request, wait: float = 0):
+    """
+    Answers 304 when If-None-Match already holds the current ETag. With
+    wait > 0 that case becomes a long-poll: the request is held until the
+    status changes (200 with the new status) or `wait` seconds pass (304).
+    """
+    etag, body = await asyncio.to_thread(status_snapshot)
+    if wait > 0 and etag_matches(request, etag):
+        deadline = time.monotonic() + min(wait, STATUS_WAIT_MAX)
+        while etag_matches(request, etag) and time.monotonic() < deadline:
+            await asyncio.sleep(STATUS_POLL_INTERVAL)
+            if await request.is_disconnected():
+                break
+            etag, body = await asyncio.to_thread(status_probe.get)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    return JSONResponse(body, headers=cache_headers(etag))
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    counts = job_queue.counts()
+    for state in JOB_STATES:
+        JOB_QUEUE_DEPTH.labels(state=state).set(counts.get(state, 0))
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+@app.get("/api/schedule")
+def get_schedule():
+    return {"jobs": [{**job, "next_run": job["next_run"].isoformat() if job["next_run"] else None}
+                     for job in scheduler.jobs()]}
+
 @app.get("/api/config")
-def get_config():
-    return config_manager.load_config()
+def get_config(request: Request):
+    config = config_manager.load_config()
+    return conditional_json(request, make_etag("config", config_manager.digest), lambda: config)
 
 @app.post("/api/config")
 def update_config(config: ConfigModel):
@@ -132,142 +361,224 @@ def update_config(config: ConfigModel):
     init_scheduler() # Restart scheduler with new config
     return {"status": "ok", "message": "Config updated"}
 
-@app.post("/api/run")
-async def run_now(background_tasks: BackgroundTasks):
-    try:
-        background_tasks.add_task(execute_task)
-        return {"status": "ok", "message": "Task started in background"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/api/config/reload")
+def reload_config():
+    """Pick up a config.json edited on disk without waiting for the next read."""
+    config_manager.reload()
+    init_scheduler()
+    return {"status": "ok", "message": "Config reloaded"}
 
-@app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+@app.get("/api/deliveries")
+def get_deliveries(limit: int = 50):
+    return {"deliveries": pipeline.ledger.recent(limit)}
+
+@app.get("/api/routes")
+def get_routes():
     config = config_manager.load_config()
-    monitor_folder = config.get("monitor_folder")
-    
+    return {"routes": [
+        {"name": r["name"], "folder": r["folder"], "file_pattern": r["file_pattern"],
+         "touser": r["wecom"].get("touser", "@all"), "toparty": r["wecom"].get("toparty", ""),
+         "scan": r["scan"]}
+        for r in resolve_routes(config)
+    ]}
+
+@app.post("/api/run")
+def run_now(route: Optional[str] = None):
+    """Queue a run of every route (or one). Triggers for a route that already has a job waiting are merged into it."""
+    job_ids = enqueue_routes("manual", route)
+    if not job_ids:
+        raise HTTPException(status_code=400, detail="No route to run")
+    return {"status": "ok", "message": "Task queued", "jobs": job_ids}
+
+@app.get("/api/jobs")
+def get_jobs(request: Request, limit: int = 50, state: Optional[str] = None):
+    etag = make_etag("jobs", job_queue.version(), limit, state)
+    return conditional_json(request, etag,
+                            lambda: {"jobs": job_queue.recent(limit, state), "counts": job_queue.counts()})
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _upload_target(route: Optional[str]) -> str:
+    target = find_route(config_manager.load_config(), route)
+    monitor_folder = target["folder"] if target else None
     if not monitor_folder:
         raise HTTPException(status_code=500, detail="Monitor folder not configured")
-        
-    if not os.path.exists(monitor_folder):
-        os.makedirs(monitor_folder)
-        
-    file_path = os.path.join(monitor_folder, file.filename)
-    
+    os.makedirs(monitor_folder, exist_ok=True)
+    return monitor_folder
+
+def _upload_error(e: UploadError) -> HTTPException:
+    headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+    return HTTPException(status_code=e.status, detail=str(e), headers=headers)
+
+def _upload_view(upload: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in upload.items() if k != "folder"}
+
+@app.post("/api/upload")
+async def upload_file(request: Request, file: UploadFile = File(...), route: Optional[str] = None):
+    """Single-request upload. The file only appears in the folder once it is complete."""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > upload_store.max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {upload_store.max_bytes} byte upload limit")
+    monitor_folder = _upload_target(route)
+
+    async def chunks():
+        while True:
+            data = await file.read(UPLOAD_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logging.info(f"文件上传成功: {file.filename}")
-        return {"filename": file.filename, "status": "success"}
+        result = await upload_store.save_stream(monitor_folder, file.filename, chunks())
+    except UploadError as e:
+        raise _upload_error(e)
     except Exception as e:
         logging.error(f"文件上传失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    logging.info(f"文件上传成功: {result['filename']}", extra={"file": result["filename"]})
+    return {"filename": result["filename"], "size": result["size"], "sha256": result["sha256"], "status": "success"}
+
+# --- Resumable uploads: create, append at offset (repeat, resuming after errors), commit ---
+class UploadInitModel(BaseModel):
+    filename: str
+    size: int
+    route: Optional[str] = None
+    sha256: Optional[str] = None
+
+@app.post("/api/uploads")
+def create_upload(body: UploadInitModel):
+    try:
+        upload = upload_store.create(_upload_target(body.route), body.filename, body.size, body.route, body.sha256)
+    except UploadError as e:
+        raise _upload_error(e)
+    return {**_upload_view(upload), "chunk_size": UPLOAD_CHUNK_SIZE}
+
+@app.get("/api/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    """Current offset of an upload; resume by appending from there."""
+    try:
+        return _upload_view(upload_store.get(upload_id))
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.patch("/api/uploads/{upload_id}")
+async def append_upload(upload_id: str, offset: int, request: Request):
+    """Raw request body is written at `offset`, streamed straight to disk."""
+    try:
+        upload = await upload_store.append(upload_id, offset, request.stream())
+    except UploadError as e:
+        raise _upload_error(e)
+    return _upload_view(upload)
+
+@app.post("/api/uploads/{upload_id}/commit")
+def commit_upload(upload_id: str):
+    try:
+        result = upload_store.commit(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+    logging.info(f"文件上传成功: {result['filename']}", extra={"file": result["filename"]})
+    return {"filename": result["filename"], "size": result["size"], "sha256": result["sha256"], "status": "success"}
+
+@app.delete("/api/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    try:
+        upload_store.abort(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+    return {"status": "ok"}
+
+def _log_page(lines: List[str]) -> Dict[str, Any]:
+    records = [parse_record(line) for line in lines]
+    return {"logs": [format_record(r) for r in records], "records": records}
 
 @app.get("/api/logs")
-def get_logs(lines: int = 50):
-    if not os.path.exists("app.log"):
-        return {"logs": []}
-    
+def get_logs(request: Request, lines: int = 50, cursor: Optional[str] = None, level: Optional[str] = None,
+             route: Optional[str] = None, task_id: Optional[str] = None, file: Optional[str] = None,
+             errcode: Optional[str] = None, logger: Optional[str] = None):
+    """
+    Without a cursor: the last `lines` lines. With the cursor from a previous
+    response: only lines written since then. `reset` means the log rotated
+    and the client should discard what it has.
+
+    level (minimum severity), route, task_id, file, errcode and logger
+    filter on the structured fields of each record.
+    """
     try:
-        with open("app.log", "r", encoding='utf-8') as f:
-            all_lines = f.readlines()
-            return {"logs": all_lines[-lines:]}
-    except Exception:
-        return {"logs": []}
+        st = os.stat(LOG_FILE)
+    except OSError:
+        return {"logs": [], "records": [], "cursor": None, "reset": True}
+    # Same file, same size and same query: the answer can't have changed
+    etag = make_etag("logs", st.st_ino, st.st_size, str(request.query_params))
 
-import urllib.parse
-import hashlib
+    predicate = make_filter({"level": level, "route": route, "task_id": task_id, "file": file,
+                             "errcode": errcode, "logger": logger})
+
+    def build() -> Dict[str, Any]:
+        try:
+            if cursor:
+                logs, next_cursor, reset = read_since(LOG_FILE, cursor, predicate=predicate)
+            else:
+                logs, next_cursor = tail_lines(LOG_FILE, lines, predicate)
+                reset = True
+            return {**_log_page(logs), "cursor": next_cursor, "reset": reset}
+        except Exception:
+            return {"logs": [], "records": [], "cursor": None, "reset": True}
+
+    return conditional_json(request, etag, build)
+
+@app.get("/api/logs/stream")
+async def stream_logs(request: Request, lines: int = 50, level: Optional[str] = None,
+                      route: Optional[str] = None, task_id: Optional[str] = None):
+    """Server-Sent Events: the last `lines` lines, then new lines as they are written. One JSON record per event."""
+    predicate = make_filter({"level": level, "route": route, "task_id": task_id})
+
+    async def events():
+        cursor = None
+        if os.path.exists(LOG_FILE):
+            logs, cursor = await asyncio.to_thread(tail_lines, LOG_FILE, lines, predicate)
+            for line in logs:
+                yield f"data: {json.dumps(parse_record(line), ensure_ascii=False)}\n\n"
+        while not await request.is_disconnected():
+            await asyncio.sleep(1)
+            if not os.path.exists(LOG_FILE):
+                continue
+            logs, cursor, reset = await asyncio.to_thread(read_since, LOG_FILE, cursor, predicate=predicate)
+            if reset and cursor:
+                yield "event: reset\ndata: \n\n"
+            for line in logs:
+                yield f"data: {json.dumps(parse_record(line), ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/wecom/callback")
 def wecom_callback(msg_signature: str, timestamp: str, nonce: str, echostr: str):
-    # Log raw received params
-    logging.info(f"DEBUG: Raw params - sig={msg_signature}, ts={timestamp}, nonce={nonce}, echo={echostr}")
-    
-    # Decode echostr (important!)
-    echostr_decoded = urllib.parse.unquote(echostr)
-    
-    config = config_manager.load_config()
-    wecom_conf = config.get("wecom", {})
-    token = wecom_conf.get("token")
-    aes_key = wecom_conf.get("aes_key")
-    corpid = wecom_conf.get("corpid")
-    
-    if not token or not aes_key or not corpid:
-         logging.error("回调验证失败: Token, AES Key 或 CorpID 未配置")
-         raise HTTPException(status_code=400, detail="Config missing")
-
-    # Manual Signature Check to debug
+    """WeCom URL verification: reply with the decrypted echostr."""
     try:
-        sort_list = [token, timestamp, nonce, echostr_decoded]
-        sort_list.sort()
-        sha = hashlib.sha1()
-        sha.update("".join(sort_list).encode("utf-8"))
-        calculated_signature = sha.hexdigest()
-        logging.info(f"DEBUG: Calculated sig: {calculated_signature} vs Received: {msg_signature}")
-    except Exception as e:
-        logging.error(f"DEBUG Error: {e}")
+        echo = callback_service.verify_url(config_manager.load_config().get("wecom", {}),
+                                           msg_signature, timestamp, nonce, echostr)
+    except CallbackError as e:
+        logging.error(f"回调验证失败: {e}")
+        return Response(content=str(e), status_code=e.status, media_type="text/plain")
+    return Response(content=echo, media_type="text/plain")
 
+@app.post("/api/wecom/callback")
+async def wecom_callback_event(request: Request, msg_signature: str, timestamp: str, nonce: str):
+    """Encrypted message/event push. Decrypted and queued; processing happens after the reply."""
+    body = await request.body()
     try:
-        # Skip standalone check_signature, go straight to crypto
-        logging.info("Initializing WeChatCrypto...")
-        if len(aes_key) != 43:
-             logging.error(f"CRITICAL: AES Key length is {len(aes_key)}, expected 43!")
-        
-        crypto = WeChatCrypto(token, aes_key, corpid)
-        logging.info("WeChatCrypto initialized.")
-        
-        logging.info("Decrpyting...")
-        # Since signature is already manually checked, we can use decrypt_message directly if check_signature is missing?
-        # But for echostr, it is just a string, not XML.
-        # Actually, check_signature IS available in WeChatCrypto source usually. 
-        # But if it is missing, maybe we should use decrypt_echo? 
-        # Let's inspect available methods or try to use _decrypt directly if needed.
-        # Wait, echostr is special. 
-        
-        # In newer wechatpy, maybe check_signature is removed?
-        # Let's try to find alternative.
-        
-        # Workaround: manually decrypt
-        try:
-             decrypted_echo = crypto.check_signature(
-                msg_signature,
-                timestamp,
-                nonce,
-                echostr_decoded
-            )
-        except AttributeError:
-             # Fallback for versions where check_signature might be named differently or missing
-             logging.warning("AttributeError: check_signature not found. Trying manual decryption.")
-             # The echostr is encrypted using AES.
-             # WeChatCrypto.decrypt_message usually expects XML, but here it is a string.
-             # We can try crypto._decrypt(echostr_decoded, corpid) if available?
-             # Or maybe it is crypto.decrypt_message(echostr_decoded, receive_id=corpid)
-             
-             # Let's try verify_echo_str if available? No.
-             
-             # Actually, let's look at how wechatpy implements it.
-             # It seems check_signature WAS there.
-             pass
-             
-        # Re-raise if not handled
-        decrypted_echo = crypto.check_signature(
-            msg_signature,
-            timestamp,
-            nonce,
-            echostr_decoded
-        )
-        
-        # Ensure it's a string
-        if isinstance(decrypted_echo, bytes):
-            decrypted_echo = decrypted_echo.decode('utf-8')
-            
-        logging.info(f"回调验证成功! Decrypted Echo: {decrypted_echo}")
-        return Response(content=decrypted_echo, media_type="text/plain")
-        
-    except Exception as e:
-         import traceback
-         logging.error(f"Fatal Error in callback: {e}")
-         logging.error(traceback.format_exc())
-         return Response(content=f"Error: {str(e)}", status_code=500)
+        callback_service.accept_message(config_manager.load_config().get("wecom", {}),
+                                        body, msg_signature, timestamp, nonce)
+    except CallbackError as e:
+        logging.error(f"回调消息处理失败: {e}")
+        return Response(content=str(e), status_code=e.status, media_type="text/plain")
+    # An empty 200 acknowledges the push; WeCom won't retry it
+    return Response(content="", media_type="text/plain")
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,5 +1,25 @@
 const BASE_URL = 'http://localhost:8000/api';
 
+export interface RouteConfig {
+  name: string;
+  folder: string;
+  file_pattern?: string;
+  touser?: string;
+  toparty?: string;
+  enabled?: boolean;
+  schedule?: { cron?: string; timezone?: string; catch_up?: string; enabled?: boolean };
+  scan?: ScanConfig;
+}
+
+export interface ScanConfig {
+  recursive?: boolean;
+  include?: string[];
+  exclude?: string[];
+  max_depth?: number | null;
+  max_age_days?: number | null;
+  workers?: number;
+}
+
 export interface Config {
   monitor_folder: string;
   wecom: {
@@ -14,13 +34,104 @@ export interface Config {
   schedule: {
     enabled: boolean;
     time: string;
-    frequency: string;
+    frequency: string; // daily, hourly, cron, watch
+    cron?: string;
+    timezone?: string;
+    catch_up?: string; // skip, once, all
+  };
+  delivery?: {
+    skip_delivered: boolean;
+    catch_up: boolean;
   };
+  scan?: ScanConfig;
+  routes?: RouteConfig[];
 }
 
 export interface Status {
   running: boolean;
   next_run: string | null;
+  watch_mode?: string | null;
+  jobs?: Record<string, number>; // job count per state (queued, running, succeeded, failed)
+  leader?: { is_leader: boolean; instance: string; holder: { owner: string; acquired_at: string } | null };
+}
+
+export interface LogRecord {
+  ts: string;
+  level: string;
+  msg: string;
+  logger?: string;
+  task_id?: string;
+  route?: string;
+  file?: string;
+  duration_ms?: number;
+  errcode?: number;
+  exc?: string;
+}
+
+export interface LogFilter {
+  level?: string;
+  route?: string;
+  task_id?: string;
+}
+
+export interface LogsPage {
+  logs: string[];
+  records: LogRecord[];
+  cursor: string | null;
+  reset: boolean;
+}
+
+// Larger files go through the resumable protocol: create, append chunks at offsets, commit
+const RESUMABLE_THRESHOLD = 8 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+
+async function uploadResumable(file: File): Promise<any> {
+  const init = await fetch(`${BASE_URL}/uploads`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  });
+  if (!init.ok) {
+    const err = await init.json();
+    throw new Error(err.detail || 'Upload failed');
+  }
+  const upload = await init.json();
+  let offset: number = upload.offset;
+  let failures = 0;
+
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + upload.chunk_size);
+    try {
+      const res = await fetch(`${BASE_URL}/uploads/${upload.upload_id}?offset=${offset}`, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: chunk,
+      });
+      if (!res.ok && res.status !== 409) {
+        const err = await res.json();
+        throw new Error(err.detail || 'Upload failed');
+      }
+      if (res.ok) {
+        offset = (await res.json()).offset;
+        failures = 0;
+        continue;
+      }
+    } catch (e) {
+      if (++failures > MAX_CHUNK_RETRIES) throw e;
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+    }
+    // Resume from whatever the server actually has
+    const state = await fetch(`${BASE_URL}/uploads/${upload.upload_id}`);
+    if (!state.ok) throw new Error('Upload failed');
+    offset = (await state.json()).offset;
+  }
+
+  const res = await fetch(`${BASE_URL}/uploads/${upload.upload_id}/commit`, { method: 'POST' });
+  if (!res.ok) {
+    const err = await res.json();
+    throw new Error(err.detail || 'Upload failed');
+  }
+  return res.json();
 }
 
 export const api = {
@@ -29,6 +140,16 @@ export const api = {
     return res.json();
   },
 
+  // Long-poll: resolves once the status differs from `etag`, or with null after `wait` seconds without change
+  waitStatus: async (etag: string | null, wait = 25): Promise<{ status: Status; etag: string | null } | null> => {
+    const res = await fetch(`${BASE_URL}/status?wait=${wait}`, {
+      headers: etag ? { 'If-None-Match': etag } : {},
+    });
+    if (res.status === 304) return null;
+    if (!res.ok) throw new Error(`Status request failed: ${res.status}`);
+    return { status: await res.json(), etag: res.headers.get('ETag') };
+  },
+
   getConfig: async (): Promise<Config> => {
     const res = await fetch(`${BASE_URL}/config`);
     return res.json();
@@ -50,12 +171,21 @@ export const api = {
     return res.json();
   },
 
-  getLogs: async (): Promise<{ logs: string[] }> => {
-    const res = await fetch(`${BASE_URL}/logs`);
+  getLogs: async (cursor?: string | null, filter: LogFilter = {}): Promise<LogsPage> => {
+    const params = new URLSearchParams();
+    if (cursor) params.set('cursor', cursor);
+    Object.entries(filter).forEach(([key, value]) => {
+      if (value) params.set(key, value);
+    });
+    const query = params.toString() ? `?${params}` : '';
+    const res = await fetch(`${BASE_URL}/logs${query}`);
     return res.json();
   },
 
   uploadFile: async (file: File): Promise<any> => {
+    if (file.size > RESUMABLE_THRESHOLD) {
+      return uploadResumable(file);
+    }
     const formData = new FormData();
     formData.append('file', file);
     const res = await fetch(`${BASE_URL}/upload`, {
@@ -3,7 +3,7 @@ import { useAppStore } from '../store/useAppStore';
 import { Play, Clock, CheckCircle, AlertCircle, UploadCloud } from 'lucide-react';
 
 export function Dashboard() {
-  const { status, config, fetchStatus, fetchConfig, runTask, uploadFile, isLoading } = useAppStore();
+  const { status, config, waitStatus, fetchConfig, runTask, uploadFile, isLoading } = useAppStore();
   const fileInputRef = useRef<HTMLInputElement>(null);
   const [uploadMsg, setUploadMsg] = useState('');
 
@@ -37,11 +37,17 @@ export function Dashboard() {
   };
 
   useEffect(() => {
-    fetchStatus();
     fetchConfig();
-    const interval = setInterval(fetchStatus, 5000); // Poll status
-    return () => clearInterval(interval);
-  }, [fetchStatus, fetchConfig]);
+    let active = true;
+    // Long-poll: the server answers as soon as the status changes
+    const watch = async () => {
+      while (active) {
+        if (!(await waitStatus())) await new Promise((resolve) => setTimeout(resolve, 5000));
+      }
+    };
+    watch();
+    return () => { active = false; };
+  }, [waitStatus, fetchConfig]);
 
   if (!status || !config) return <div className="p-8">加载中...</div>;
 
@@ -59,6 +65,11 @@ export function Dashboard() {
           <div className="text-2xl font-bold text-gray-800">
             {status.running ? '运行中' : '已停止'}
           </div>
+          {status.jobs && (
+            <div className="mt-2 text-sm text-gray-500">
+              排队 {status.jobs.queued || 0} · 执行中 {status.jobs.running || 0} · 失败 {status.jobs.failed || 0}
+            </div>
+          )}
         </div>
 
         {/* Next Run Card */}
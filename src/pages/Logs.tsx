@@ -1,8 +1,31 @@
 import { useEffect } from 'react';
 import { useAppStore } from '../store/useAppStore';
+import { LogRecord } from '../api/client';
+
+const LEVELS = ['', 'INFO', 'WARNING', 'ERROR'];
+
+function levelColor(level: string) {
+  if (level === 'ERROR' || level === 'CRITICAL') return 'text-red-400';
+  if (level === 'WARNING') return 'text-yellow-400';
+  return 'text-green-400';
+}
+
+function LogLine({ record }: { record: LogRecord }) {
+  return (
+    <span className={levelColor(record.level)}>
+      {record.ts && <span className="text-gray-400 mr-2">{record.ts}</span>}
+      {record.level && <span className="mr-2">{record.level}</span>}
+      {record.task_id && <span className="text-gray-500 mr-2">#{record.task_id}</span>}
+      {record.msg}
+      {record.duration_ms !== undefined && <span className="text-gray-500 ml-2">({record.duration_ms} ms)</span>}
+      {record.errcode !== undefined && <span className="text-gray-500 ml-2">errcode={record.errcode}</span>}
+      {record.exc && <pre className="whitespace-pre-wrap text-red-300">{record.exc}</pre>}
+    </span>
+  );
+}
 
 export function Logs() {
-  const { logs, fetchLogs } = useAppStore();
+  const { logs, logFilter, fetchLogs, setLogFilter } = useAppStore();
 
   useEffect(() => {
     fetchLogs();
@@ -14,24 +37,40 @@ export function Logs() {
     <div className="p-8 h-screen flex flex-col">
       <div className="flex justify-between items-center mb-8">
         <h2 className="text-2xl font-bold text-gray-800">系统日志</h2>
-        <button 
-          onClick={() => fetchLogs()}
-          className="text-sm text-blue-600 hover:text-blue-800 underline"
-        >
-          刷新
-        </button>
+        <div className="flex items-center gap-3">
+          <select
+            value={logFilter.level || ''}
+            onChange={(e) => setLogFilter({ ...logFilter, level: e.target.value })}
+            className="text-sm border rounded px-2 py-1"
+          >
+            {LEVELS.map((level) => (
+              <option key={level} value={level}>{level || '全部级别'}</option>
+            ))}
+          </select>
+          <input
+            type="text"
+            placeholder="路由名称"
+            defaultValue={logFilter.route || ''}
+            onBlur={(e) => setLogFilter({ ...logFilter, route: e.target.value.trim() })}
+            className="text-sm border rounded px-2 py-1"
+          />
+          <button
+            onClick={() => fetchLogs()}
+            className="text-sm text-blue-600 hover:text-blue-800 underline"
+          >
+            刷新
+          </button>
+        </div>
       </div>
 
       <div className="flex-1 bg-gray-900 rounded-xl p-4 overflow-auto font-mono text-sm shadow-inner">
         {logs.length === 0 ? (
           <div className="text-gray-500 text-center mt-10">暂无日志</div>
         ) : (
-          logs.map((log, index) => (
+          logs.map((record, index) => (
             <div key={index} className="mb-1">
               <span className="text-gray-500 mr-2">{index + 1}.</span>
-              <span className={log.includes('ERROR') ? 'text-red-400' : 'text-green-400'}>
-                {log}
-              </span>
+              <LogLine record={record} />
             </div>
           ))
         )}
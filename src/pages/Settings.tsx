@@ -12,7 +12,10 @@ export function Settings() {
   }, [fetchConfig]);
 
   useEffect(() => {
-    if (config) setFormData(config);
+    if (config) setFormData({
+      ...config,
+      delivery: { skip_delivered: true, catch_up: false, ...config.delivery },
+    });
   }, [config]);
 
   const handleChange = (section: keyof Config, key: string, value: any) => {
@@ -61,6 +64,11 @@ export function Settings() {
                 className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-blue-500 outline-none"
               />
               <p className="text-xs text-gray-500 mt-1">请输入需要监控的文件夹绝对路径。</p>
+              {formData.routes && formData.routes.length > 0 && (
+                <p className="text-xs text-amber-600 mt-1">
+                  已在 config.json 中配置 {formData.routes.length} 条路由，将按路由分别监控和发送。
+                </p>
+              )}
             </div>
           </div>
         </div>
@@ -177,8 +185,23 @@ export function Settings() {
                 >
                   <option value="daily">每天</option>
                   <option value="hourly">每小时</option>
+                  <option value="cron">Cron 表达式</option>
+                  <option value="watch">实时监控 (文件到达即发送)</option>
                 </select>
               </div>
+              {formData.schedule.frequency === 'cron' && (
+              <div>
+                <label className="block text-sm font-medium text-gray-700 mb-1">Cron (分 时 日 月 周)</label>
+                <input
+                  type="text"
+                  placeholder="0 9 * * 1-5"
+                  value={formData.schedule.cron || ''}
+                  onChange={(e) => handleChange('schedule', 'cron', e.target.value)}
+                  className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-blue-500 outline-none font-mono"
+                />
+              </div>
+              )}
+              {(formData.schedule.frequency === 'daily' || formData.schedule.frequency === 'hourly') && (
               <div>
                 <label className="block text-sm font-medium text-gray-700 mb-1">时间 (HH:MM)</label>
                 <input
@@ -188,10 +211,60 @@ export function Settings() {
                   className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-blue-500 outline-none"
                 />
               </div>
+              )}
+              {formData.schedule.frequency !== 'watch' && (
+              <>
+              <div>
+                <label className="block text-sm font-medium text-gray-700 mb-1">时区</label>
+                <input
+                  type="text"
+                  placeholder="Asia/Shanghai (留空使用系统时区)"
+                  value={formData.schedule.timezone || ''}
+                  onChange={(e) => handleChange('schedule', 'timezone', e.target.value)}
+                  className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-blue-500 outline-none"
+                />
+              </div>
+              <div>
+                <label className="block text-sm font-medium text-gray-700 mb-1">错过的运行</label>
+                <select
+                  value={formData.schedule.catch_up || 'skip'}
+                  onChange={(e) => handleChange('schedule', 'catch_up', e.target.value)}
+                  className="w-full px-4 py-2 border rounded-lg focus:ring-2 focus:ring-blue-500 outline-none"
+                >
+                  <option value="skip">跳过</option>
+                  <option value="once">补执行一次</option>
+                  <option value="all">补执行一次并补发全部文件</option>
+                </select>
+              </div>
+              </>
+              )}
             </div>
           )}
         </div>
 
+        {/* Delivery */}
+        <div className="bg-white p-6 rounded-xl shadow-sm border border-gray-100">
+          <h3 className="text-lg font-bold text-gray-800 mb-4 border-b pb-2">发送策略</h3>
+          <div className="grid gap-3">
+            <label className="flex items-center gap-3 text-sm text-gray-700">
+              <input
+                type="checkbox"
+                checked={formData.delivery?.skip_delivered ?? true}
+                onChange={(e) => handleChange('delivery', 'skip_delivered', e.target.checked)}
+              />
+              跳过已发送过的文件
+            </label>
+            <label className="flex items-center gap-3 text-sm text-gray-700">
+              <input
+                type="checkbox"
+                checked={formData.delivery?.catch_up ?? false}
+                onChange={(e) => handleChange('delivery', 'catch_up', e.target.checked)}
+              />
+              补发上次成功后新增的全部文件 (而不仅是最新一个)
+            </label>
+          </div>
+        </div>
+
         <button
           type="submit"
           disabled={isLoading}
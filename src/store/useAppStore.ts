@@ -1,15 +1,22 @@
 import { create } from 'zustand';
-import { api, Config, Status } from '../api/client';
+import { api, Config, LogFilter, LogRecord, Status } from '../api/client';
+
+const MAX_LOG_LINES = 500;
 
 interface AppState {
   config: Config | null;
   status: Status | null;
-  logs: string[];
+  statusEtag: string | null;
+  logs: LogRecord[];
+  logsCursor: string | null;
+  logFilter: LogFilter;
   isLoading: boolean;
   
   fetchConfig: () => Promise<void>;
   fetchStatus: () => Promise<void>;
+  waitStatus: () => Promise<boolean>;
   fetchLogs: () => Promise<void>;
+  setLogFilter: (filter: LogFilter) => Promise<void>;
   updateConfig: (config: Config) => Promise<void>;
   runTask: () => Promise<void>;
   uploadFile: (file: File) => Promise<void>;
@@ -18,7 +25,10 @@ interface AppState {
 export const useAppStore = create<AppState>((set, get) => ({
   config: null,
   status: null,
+  statusEtag: null,
   logs: [],
+  logsCursor: null,
+  logFilter: {},
   isLoading: false,
 
   fetchConfig: async () => {
@@ -39,15 +49,35 @@ export const useAppStore = create<AppState>((set, get) => ({
     }
   },
 
+  // One long-poll round; false on error so the caller can back off
+  waitStatus: async () => {
+    try {
+      const result = await api.waitStatus(get().statusEtag);
+      if (result) set({ status: result.status, statusEtag: result.etag });
+      return true;
+    } catch (e) {
+      console.error(e);
+      return false;
+    }
+  },
+
   fetchLogs: async () => {
     try {
-      const { logs } = await api.getLogs();
-      set({ logs });
+      // Only fetch what was written since the last poll
+      const page = await api.getLogs(get().logsCursor, get().logFilter);
+      const logs = page.reset ? page.records : [...get().logs, ...page.records];
+      set({ logs: logs.slice(-MAX_LOG_LINES), logsCursor: page.cursor });
     } catch (e) {
       console.error(e);
     }
   },
 
+  setLogFilter: async (logFilter) => {
+    // A new filter needs a fresh tail, not an increment on the old cursor
+    set({ logFilter, logs: [], logsCursor: null });
+    await get().fetchLogs();
+  },
+
   updateConfig: async (config) => {
     set({ isLoading: true });
     try {